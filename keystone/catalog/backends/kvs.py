@@ -12,14 +12,12 @@ class Catalog(kvs.Base):
     def get_service(self, service_id):
         return self.db.get('service-%s' % service_id)
 
-    def list_services(self):
-        return self.db.get('service_list', [])
+    def list_services(self, marker=None, limit=None, reverse=False):
+        return self.db.srange('service_list', marker, limit, reverse)
 
     def create_service(self, service_id, service):
         self.db.set('service-%s' % service_id, service)
-        service_list = set(self.db.get('service_list', []))
-        service_list.add(service_id)
-        self.db.set('service_list', list(service_list))
+        self.db.sadd('service_list', service_id)
         return service
 
     def update_service(self, service_id, service):
@@ -28,9 +26,7 @@ class Catalog(kvs.Base):
 
     def delete_service(self, service_id):
         self.db.delete('service-%s' % service_id)
-        service_list = set(self.db.get('service_list', []))
-        service_list.remove(service_id)
-        self.db.set('service_list', list(service_list))
+        self.db.srem('service_list', service_id)
         return None
 
     # Private interface
@@ -34,10 +34,12 @@ class ServiceController(wsgi.Application):
     # CRUD extensions
     # NOTE(termie): this OS-KSADM stuff is not very consistent
     def get_services(self, context):
-        service_list = self.catalog_api.list_services(context)
-        service_refs = [self.catalog_api.get_service(context, x)
-                        for x in service_list]
-        return {'OS-KSADM:services': service_refs}
+        def list_services(marker, limit, reverse):
+            service_list = self.catalog_api.list_services(
+                    context, marker=marker, limit=limit, reverse=reverse)
+            return [self.catalog_api.get_service(context, x)
+                    for x in service_list]
+        return self._paginate(context, 'OS-KSADM:services', list_services)
 
     def get_service(self, context, service_id):
         service_ref = self.catalog_api.get_service(context, service_id)
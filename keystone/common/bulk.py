@@ -0,0 +1,130 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""Streaming import and export of identity and ec2 data.
+
+Data is moved as (type, data) records, one JSON object per line:
+
+    {"type": "user", "data": {"id": "foo", "name": "FOO", ...}}
+
+The types are tenant, role, user, membership ({user_id, tenant_id}),
+metadata ({user_id, tenant_id, data}) and ec2_credential.  Records are read
+from the drivers a page at a time and written to them a batch at a time, so
+memory use does not depend on how much data there is.
+
+"""
+
+import json
+
+from keystone.common import utils
+
+
+IDENTITY_TYPES = ('tenant', 'role', 'user', 'membership', 'metadata')
+EC2_TYPES = ('ec2_credential',)
+
+
+def export_records(identity_api, ec2_api=None, page_size=1000):
+    """Read every record from the drivers.
+
+    Tenants and roles come first, then each user followed by its
+    memberships, their metadata and its ec2 credentials.
+
+    Yields: (type, data) records.
+
+    """
+    for tenant_ref in _pages(identity_api.list_tenants, page_size):
+        yield 'tenant', tenant_ref
+    for role_ref in _pages(identity_api.list_roles, page_size):
+        yield 'role', role_ref
+
+    for user_ref in _pages(identity_api.list_users, page_size):
+        user_id = user_ref['id']
+        user_ref = dict(user_ref)
+        # exported as membership records
+        user_ref.pop('tenants', None)
+        yield 'user', user_ref
+
+        for tenant_id in identity_api.get_tenants_for_user(user_id):
+            yield 'membership', {'user_id': user_id, 'tenant_id': tenant_id}
+            metadata_ref = identity_api.get_metadata(user_id, tenant_id)
+            if metadata_ref:
+                yield 'metadata', {'user_id': user_id,
+                                   'tenant_id': tenant_id,
+                                   'data': metadata_ref}
+
+        if ec2_api is not None:
+            def list_credentials(marker, limit):
+                return ec2_api.list_credentials(user_id, marker=marker,
+                                                limit=limit)
+            for credential_ref in _pages(list_credentials, page_size,
+                                         key='access'):
+                yield 'ec2_credential', credential_ref
+
+
+def import_records(records, identity_api, ec2_api=None, batch_size=1000,
+                   progress=None):
+    """Write records to the drivers, `batch_size` at a time.
+
+    Each batch goes to the driver's `import_records`, which the sql backends
+    run as a single transaction.  `progress(count)` is called with the number
+    of records written so far after every batch.
+
+    Returns: the number of records written.
+
+    """
+    batches = {}
+    count = 0
+    for record_type, data in records:
+        if record_type in IDENTITY_TYPES:
+            api = identity_api
+        elif record_type in EC2_TYPES and ec2_api is not None:
+            api = ec2_api
+        else:
+            raise ValueError('Unexpected record type: %s' % record_type)
+
+        batch = batches.setdefault(api, [])
+        batch.append((record_type, data))
+        if len(batch) >= batch_size:
+            count = _flush(api, batch, count, progress)
+
+    # identity records first, credentials belong to users
+    for api in (identity_api, ec2_api):
+        if batches.get(api):
+            count = _flush(api, batches[api], count, progress)
+    return count
+
+
+def dump_lines(records):
+    """Yields: each record as a line of JSON."""
+    for record_type, data in records:
+        yield '%s\n' % json.dumps({'type': record_type, 'data': data},
+                                  cls=utils.SmarterEncoder)
+
+
+def load_lines(lines):
+    """Yields: the record on each line of JSON, skipping empty lines."""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        yield record['type'], record['data']
+
+
+def _pages(list_f, page_size, key='id'):
+    marker = None
+    while True:
+        refs = list_f(marker=marker, limit=page_size)
+        for ref in refs:
+            yield ref
+        if len(refs) < page_size:
+            return
+        marker = refs[-1][key]
+
+
+def _flush(api, batch, count, progress):
+    api.import_records(batch)
+    count += len(batch)
+    del batch[:]
+    if progress is not None:
+        progress(count)
+    return count
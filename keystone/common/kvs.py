@@ -1,21 +1,339 @@
 # vim: tabstop=4 shiftwidth=4 softtabstop=4
 
+import cPickle as pickle
+import mmap
+import os
+import struct
+import time
+import zlib
+
+import eventlet
+
+from keystone import config
+from keystone.common import logging
+from keystone.common import threadpool
+from keystone.common import utils
+
+
+CONF = config.CONF
+
 
 class DictKvs(dict):
+    """In memory store.
+
+    Besides plain values, a key can hold a set, changed in place with `sadd`
+    and `srem` in constant time.  `srange` sorts a set when it asks for a
+    range of it and keeps the sorted copy until the set next changes.
+
+    `get` returns a set itself, not a copy, as it is on every read path;
+    callers must not change it, use `smembers` for a copy to change.
+
+    """
+
+    def __init__(self, *args, **kw):
+        super(DictKvs, self).__init__(*args, **kw)
+        # sorted copies of sets, by key
+        self._ordered = {}
+
+    def get_multi(self, keys):
+        """Returns: a list of the values of `keys`, None for missing ones."""
+        return [self.get(x) for x in keys]
+
     def set(self, key, value):
         self[key] = value
+        self._ordered.pop(key, None)
 
     def delete(self, key):
         del self[key]
+        self._ordered.pop(key, None)
+
+    def sadd(self, key, value):
+        """Add `value` to the set at `key`, creating the set if needed."""
+        members = self._members(key)
+        if value in members:
+            return
+        members.add(value)
+        self._ordered.pop(key, None)
+
+    def srem(self, key, value):
+        """Remove `value` from the set at `key`, KeyError if it is not in."""
+        self._members(key).remove(value)
+        self._ordered.pop(key, None)
+
+    def sismember(self, key, value):
+        return value in self.get(key, ())
+
+    def smembers(self, key):
+        return set(self.get(key, ()))
+
+    def srange(self, key, marker=None, limit=None, reverse=False):
+        """Up to `limit` members of the set at `key` after `marker`, in order.
+
+        If `reverse` the members before `marker` are returned instead,
+        nearest first.
+
+        """
+        ordered = self._ordered.get(key)
+        if ordered is None:
+            if key not in self:
+                return []
+            ordered = self._ordered[key] = sorted(self[key])
+        return utils.page(ordered, marker, limit, reverse)
+
+    def _members(self, key):
+        members = self.get(key)
+        if not isinstance(members, set):
+            # sets used to be stored as lists
+            members = self[key] = set(members or ())
+            self._ordered.pop(key, None)
+        return members
+
+
+class PersistentKvs(DictKvs):
+    """DictKvs that keeps its contents across restarts.
+
+    Every set and delete is appended to `<path>.log` as a length and crc32
+    framed pickle before it returns, so a crashed process loses nothing.  The
+    log is fsynced once per group of `sync_batch` operations, and at the
+    latest `sync_interval` seconds after a write (by a green thread timer,
+    when no later write gets to it first), so a power failure loses at most
+    the last group.
+
+    Once the log holds `snapshot_threshold` operations the store is pickled
+    in line, which holds up every green thread for as long as it takes, then
+    the log is moved aside to `<path>.log.prev` and a new log started.  The
+    pickle is then written to a snapshot at `path`, which atomically replaces
+    the previous one, from an OS thread so writes carry on meanwhile, and
+    `<path>.log.prev` is removed.  At startup the snapshot is read through a
+    memory map and both logs replayed on top of it; a torn record at the end
+    of a log is discarded.
+
+    """
+
+    HEADER = struct.Struct('>II')
+
+    def __init__(self, path, sync_batch=64, sync_interval=1,
+                 snapshot_threshold=100000):
+        super(PersistentKvs, self).__init__()
+        self.path = path
+        self.log_path = '%s.log' % path
+        self.prev_log_path = '%s.log.prev' % path
+        self.sync_batch = sync_batch
+        self.sync_interval = sync_interval
+        self.snapshot_threshold = snapshot_threshold
+
+        self._load_snapshot()
+        self._log_records = (self._replay_log(self.prev_log_path)
+                             + self._replay_log(self.log_path))
+        self._log = open(self.log_path, 'ab')
+        self._pending = 0
+        self._synced_at = time.time()
+        # the green thread timer fsyncing unsynced writes, if any
+        self._syncer = None
+        # the green thread writing a snapshot, if any
+        self._snapshotter = None
+        self._pool = threadpool.ThreadPool(size=1)
+
+    def set(self, key, value):
+        super(PersistentKvs, self).set(key, value)
+        self._append(('set', key, value))
+
+    def delete(self, key):
+        super(PersistentKvs, self).delete(key)
+        self._append(('delete', key))
+
+    def sadd(self, key, value):
+        super(PersistentKvs, self).sadd(key, value)
+        self._append(('sadd', key, value))
+
+    def srem(self, key, value):
+        super(PersistentKvs, self).srem(key, value)
+        self._append(('srem', key, value))
+
+    def sync(self):
+        """Flush the log to disk."""
+        if self._syncer is not None:
+            self._syncer.cancel()
+            self._syncer = None
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._pending = 0
+        self._synced_at = time.time()
+
+    def snapshot(self):
+        """Write the whole store to disk and start a new log.
+
+        Unlike the snapshots taken once the log is long enough, this one is
+        written before it returns.
+
+        """
+        self._wait_for_snapshot()
+        self._write_snapshot(
+                pickle.dumps(dict(self), pickle.HIGHEST_PROTOCOL))
+
+        # replaying the old logs over the new snapshot would be harmless, so
+        # a crash before they are truncated loses nothing either
+        if os.path.exists(self.prev_log_path):
+            os.remove(self.prev_log_path)
+        self._log.close()
+        self._log = open(self.log_path, 'wb')
+        self.sync()
+        self._log_records = 0
+
+    def close(self):
+        self._wait_for_snapshot()
+        self.sync()
+        self._log.close()
+
+    def _append(self, op):
+        body = pickle.dumps(op, pickle.HIGHEST_PROTOCOL)
+        self._log.write(self.HEADER.pack(len(body), self._crc(body)) + body)
+        self._log.flush()
+        self._pending += 1
+        self._log_records += 1
+
+        if (self._pending >= self.sync_batch
+                or time.time() - self._synced_at >= self.sync_interval):
+            self.sync()
+        elif self._syncer is None:
+            self._syncer = eventlet.spawn_after(self.sync_interval,
+                                                self._sync_pending)
+        if (self._log_records >= self.snapshot_threshold
+                and (self._snapshotter is None or self._snapshotter.dead)):
+            if os.path.exists(self.prev_log_path):
+                # the last snapshot failed and its log is still needed
+                self.snapshot()
+            else:
+                self._start_snapshot()
+
+    def _sync_pending(self):
+        self._syncer = None
+        if self._pending and not self._log.closed:
+            self.sync()
+
+    def _start_snapshot(self):
+        """Start a new log and write a snapshot from a thread.
+
+        The store is pickled in line on the hub, since that needs a
+        consistent view of it, so every green thread waits for the pickling.
+        Only writing and fsyncing the pickle happen in the thread.
+
+        """
+        data = pickle.dumps(dict(self), pickle.HIGHEST_PROTOCOL)
+        self.sync()
+        self._log.close()
+        os.rename(self.log_path, self.prev_log_path)
+        self._log = open(self.log_path, 'ab')
+        self._fsync_dir()
+        self._log_records = 0
+        self._snapshotter = eventlet.spawn(self._finish_snapshot, data)
+
+    def _finish_snapshot(self, data):
+        try:
+            self._pool.execute(self._write_snapshot, data)
+            os.remove(self.prev_log_path)
+        except Exception:
+            logging.exception('Failed to write a snapshot of %s, the next '
+                              'one will be written in line', self.path)
+
+    def _wait_for_snapshot(self):
+        if self._snapshotter is not None:
+            self._snapshotter.wait()
+            self._snapshotter = None
+
+    def _write_snapshot(self, data):
+        tmp_path = '%s.tmp' % self.path
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, self.path)
+        self._fsync_dir()
+
+    def _load_snapshot(self):
+        if not os.path.exists(self.path) or not os.path.getsize(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                self.update(pickle.load(m))
+            finally:
+                m.close()
+
+    def _replay_log(self, log_path):
+        """Apply a log to the store, returns how many records it holds."""
+        if not os.path.exists(log_path):
+            return 0
+        with open(log_path, 'rb') as f:
+            data = f.read()
+
+        count = 0
+        offset = 0
+        while offset + self.HEADER.size <= len(data):
+            length, crc = self.HEADER.unpack_from(data, offset)
+            start = offset + self.HEADER.size
+            body = data[start:start + length]
+            if len(body) < length or self._crc(body) != crc:
+                break
+            op = pickle.loads(body)
+            if op[0] == 'set':
+                self[op[1]] = op[2]
+            elif op[0] == 'delete':
+                self.pop(op[1], None)
+            elif op[0] == 'sadd':
+                DictKvs.sadd(self, op[1], op[2])
+            else:
+                self._members(op[1]).discard(op[2])
+            offset = start + length
+            count += 1
+
+        if offset < len(data):
+            logging.warning('Discarding %d bytes of torn log at the end of %s',
+                            len(data) - offset, log_path)
+            with open(log_path, 'r+b') as f:
+                f.truncate(offset)
+        return count
+
+    def _fsync_dir(self):
+        fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _crc(body):
+        return zlib.crc32(body) & 0xffffffff
 
 
 INMEMDB = DictKvs()
 
+# PersistentKvs stores by path, see `get_db`.
+PERSISTENT = {}
+
+
+def get_db():
+    """The store kvs backends share unless given their own.
+
+    Persistent when `[kvs] path` is set, otherwise in memory.
+
+    """
+    path = CONF.kvs.path
+    if not path:
+        return INMEMDB
+    if path not in PERSISTENT:
+        PERSISTENT[path] = PersistentKvs(
+                path,
+                sync_batch=CONF.kvs.sync_batch,
+                sync_interval=CONF.kvs.sync_interval,
+                snapshot_threshold=CONF.kvs.snapshot_threshold)
+    return PERSISTENT[path]
+
 
 class Base(object):
     def __init__(self, db=None):
         if db is None:
-            db = INMEMDB
+            db = get_db()
         elif type(db) is type({}):
             db = DictKvs(db)
         self.db = db
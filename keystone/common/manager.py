@@ -1,11 +1,32 @@
 # vim: tabstop=4 shiftwidth=4 softtabstop=4
 
+import collections
+import copy
 import functools
+import sys
+import time
 
 from keystone import config
+from keystone.common import logging
 from keystone.common import utils
 
 
+CONF = config.CONF
+
+
+# Read through caches shared by every Manager of the same driver, keyed by
+# driver name.  See `[cache]`.
+CACHES = {}
+
+# Calls that never change what the driver returns, anything else invalidates.
+READ_PREFIXES = ('get_', 'list_', 'check_', 'authenticate', 'enforce')
+WRITE_PREFIXES = ('create_', 'update_', 'delete_')
+# Calls that check credentials or access.  Writes only invalidate entries by
+# the noun in their name, so a cached check would keep accepting a changed
+# password or a removed role until it expired; these are never cached.
+UNCACHED_PREFIXES = ('authenticate', 'get_auth_context', 'check_', 'enforce')
+
+
 class Manager(object):
     """Base class for intermediary request layer.
 
@@ -17,10 +38,22 @@ class Manager(object):
 
     An example of a probable use case is logging all the calls.
 
+    With `[cache] enabled` the methods listed in `[cache] methods` are read
+    through a :class:`Cache` shared by the Managers of the same driver.
+
     """
 
     def __init__(self, driver_name):
         self.driver = utils.import_object(driver_name)
+        self.cache = None
+        if CONF.cache.enabled:
+            self.cache = CACHES.get(driver_name)
+            if self.cache is None:
+                self.cache = CACHES[driver_name] = Cache(
+                        parse_ttls(CONF.cache.methods, CONF.cache.ttl),
+                        negative_ttl=CONF.cache.negative_ttl,
+                        max_size=CONF.cache.max_size,
+                        max_bytes=CONF.cache.max_bytes)
 
     def __getattr__(self, name):
         """Forward calls to the underlying driver."""
@@ -28,9 +61,202 @@ class Manager(object):
         #               that for now, in the future we'll probably do some
         #               logging and whatnot in this class
         f = getattr(self.driver, name)
+        cache = self.__dict__.get('cache')
 
-        @functools.wraps(f)
-        def _wrapper(context, *args, **kw):
-            return f(*args, **kw)
+        if cache is None or name.startswith('_'):
+            @functools.wraps(f)
+            def _wrapper(context, *args, **kw):
+                return f(*args, **kw)
+        elif name in cache.ttls:
+            @functools.wraps(f)
+            def _wrapper(context, *args, **kw):
+                return cache.call(name, f, args, kw)
+        elif name.startswith(READ_PREFIXES):
+            @functools.wraps(f)
+            def _wrapper(context, *args, **kw):
+                return f(*args, **kw)
+        else:
+            @functools.wraps(f)
+            def _wrapper(context, *args, **kw):
+                try:
+                    return f(*args, **kw)
+                finally:
+                    cache.invalidate(name, args, kw)
         setattr(self, name, _wrapper)
         return _wrapper
+
+    def get_cache_stats(self, context):
+        """Returns: {method: {'hits': int, 'misses': int}} for cached calls."""
+        if self.cache is None:
+            return {}
+        return self.cache.get_stats()
+
+
+class Cache(object):
+    """Bounded least recently used cache of driver reads.
+
+    Entries are keyed by method and arguments and expire after the method's
+    ttl, results of None (misses) after `negative_ttl`.  The cache holds at
+    most `max_size` entries and roughly `max_bytes` of data.
+
+    """
+
+    def __init__(self, ttls, negative_ttl=5, max_size=10000,
+                 max_bytes=16777216):
+        self.ttls = ttls
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.stats = dict((x, {'hits': 0, 'misses': 0}) for x in ttls)
+        # key -> (expires, value, size, ident) in least recently used order
+        self._entries = collections.OrderedDict()
+        # method -> first argument -> keys, for invalidation
+        self._index = collections.defaultdict(dict)
+        # bumped by every invalidation so reads racing a write are not kept
+        self._generation = 0
+
+    def call(self, name, f, args, kw):
+        """Returns: f(*args, **kw), from the cache when possible."""
+        try:
+            key = (name, args, tuple(sorted(kw.iteritems())))
+            hash(key)
+        except TypeError:
+            key = (name, _freeze(args), _freeze(kw))
+
+        now = time.time()
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            if entry[0] > now:
+                self._entries[key] = entry
+                self.stats[name]['hits'] += 1
+                return copy.deepcopy(entry[1])
+            self._forget(key, entry)
+
+        self.stats[name]['misses'] += 1
+        generation = self._generation
+        value = f(*args, **kw)
+        if generation == self._generation:
+            self._store(key, _ident(args, kw), value, now)
+        return value
+
+    def invalidate(self, name, args, kw):
+        """Drop the entries a call to the write method `name` made stale.
+
+        `create_x`, `update_x` and `delete_x` drop the entries of `get_x` for
+        the same first argument and every entry of the other cached methods
+        mentioning x.  Any other write drops everything.
+
+        """
+        self._generation += 1
+        noun = None
+        for prefix in WRITE_PREFIXES:
+            if name.startswith(prefix):
+                noun = name[len(prefix):]
+        methods = [x for x in self.ttls if noun and noun in x]
+        if not methods:
+            self.clear()
+            return
+
+        ident = _ident(args, kw)
+        for method in methods:
+            keys = set()
+            if method == 'get_%s' % noun and ident is not None:
+                for x in (ident, None):
+                    keys.update(self._index[method].get(x, ()))
+            else:
+                for x in self._index[method].itervalues():
+                    keys.update(x)
+            for key in keys:
+                self._forget(key, self._entries.get(key))
+
+    def clear(self):
+        self._generation += 1
+        self._entries.clear()
+        self._index.clear()
+        self.size = 0
+
+    def get_stats(self):
+        return copy.deepcopy(self.stats)
+
+    def _store(self, key, ident, value, now):
+        size = _sizeof(key) + _sizeof(value)
+        if size > self.max_bytes:
+            return
+        if value is None:
+            ttl = self.negative_ttl
+        else:
+            ttl = self.ttls[key[0]]
+        self._forget(key, self._entries.get(key))
+        self._entries[key] = (now + ttl, copy.deepcopy(value), size, ident)
+        self._index[key[0]].setdefault(ident, set()).add(key)
+        self.size += size
+        while (len(self._entries) > self.max_size
+               or self.size > self.max_bytes):
+            self._forget(*self._entries.popitem(last=False))
+
+    def _forget(self, key, entry):
+        if entry is None:
+            return
+        self._entries.pop(key, None)
+        self.size -= entry[2]
+        idents = self._index[key[0]]
+        keys = idents.get(entry[3])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del idents[entry[3]]
+
+
+def parse_ttls(methods, default_ttl):
+    """Parse `[cache] methods` entries of the form name or name:ttl.
+
+    Methods starting with one of `UNCACHED_PREFIXES` are left out.
+
+    Returns: {name: ttl}.
+
+    """
+    ttls = {}
+    for method in methods or []:
+        name, _sep, ttl = method.strip().partition(':')
+        if name.startswith(UNCACHED_PREFIXES):
+            logging.warning('Not caching %s, credential and access checks '
+                            'are never cached', name)
+        elif name:
+            ttls[name] = int(ttl) if ttl else default_ttl
+    return ttls
+
+
+def _ident(args, kw):
+    """The first argument of a call, usually the id it is about."""
+    if args:
+        value = args[0]
+    elif len(kw) == 1:
+        value = kw.values()[0]
+    else:
+        return None
+    try:
+        hash(value)
+    except TypeError:
+        return None
+    return value
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.iteritems()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(x) for x in value)
+    return value
+
+
+def _sizeof(value):
+    """Approximate memory used by `value` and what it contains."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for k, v in value.iteritems():
+            size += _sizeof(k) + _sizeof(v)
+    elif isinstance(value, (list, tuple, set)):
+        for x in value:
+            size += _sizeof(x)
+    return size
@@ -0,0 +1,241 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""Minimal client for the memcached text protocol.
+
+Keys are spread over the servers with a consistent hash ring, so adding or
+removing a server only moves the keys that hashed next to it, and every
+server has a pool of persistent connections.
+
+"""
+
+import bisect
+import cPickle as pickle
+import hashlib
+
+from eventlet import pools
+from eventlet.green import socket
+
+from keystone.common import logging
+
+
+# Values are stored as is when they are strings and pickled otherwise, the
+# flags on a stored value tell which.
+FLAG_PICKLE = 1
+
+# memcached reads expiration times beyond 30 days as unix timestamps.
+MAX_RELATIVE_EXPIRATION = 60 * 60 * 24 * 30
+
+# What storage commands answer when they ran, anything else is an error.
+STORE_RESPONSES = ('STORED', 'NOT_STORED', 'EXISTS', 'NOT_FOUND')
+
+
+class ServerError(IOError):
+    """memcached refused a command, with SERVER_ERROR for instance."""
+
+
+class HashRing(object):
+    """Consistent hash ring with `replicas` points per node."""
+
+    def __init__(self, nodes, replicas=100):
+        self._ring = {}
+        for node in nodes:
+            for i in range(replicas):
+                self._ring[self._hash('%s-%d' % (node, i))] = node
+        self._points = sorted(self._ring)
+
+    def get_node(self, key):
+        if not self._points:
+            raise ValueError('No nodes in the hash ring')
+        index = bisect.bisect(self._points, self._hash(key))
+        return self._ring[self._points[index % len(self._points)]]
+
+    @staticmethod
+    def _hash(key):
+        return int(hashlib.md5(key).hexdigest()[:8], 16)
+
+
+class Connection(object):
+    def __init__(self, host, port, timeout=None):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.file = self.sock.makefile('rb')
+
+    def send(self, data):
+        self.sock.sendall(data)
+
+    def readline(self):
+        line = self.file.readline()
+        if not line.endswith('\r\n'):
+            raise socket.error('Connection closed by memcached')
+        return line[:-2]
+
+    def read(self, size):
+        data = self.file.read(size + 2)
+        if len(data) != size + 2:
+            raise socket.error('Connection closed by memcached')
+        return data[:-2]
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+class ConnectionPool(pools.Pool):
+    """Persistent connections to one server."""
+
+    def __init__(self, server, max_size=10, timeout=None):
+        host, _sep, port = server.rpartition(':')
+        self.host = host
+        self.port = int(port)
+        self.timeout = timeout
+        super(ConnectionPool, self).__init__(max_size=max_size)
+
+    def create(self):
+        return Connection(self.host, self.port, self.timeout)
+
+    def call(self, f):
+        """Run `f(conn)` on a pooled connection.
+
+        A connection that failed is closed instead of going back in the pool,
+        as there may be an unread response on it.
+
+        """
+        conn = self.get()
+        try:
+            rv = f(conn)
+        except Exception:
+            conn.close()
+            # an empty slot, the next get connects again
+            self.put(None)
+            raise
+        self.put(conn)
+        return rv
+
+    def get(self):
+        conn = super(ConnectionPool, self).get()
+        if conn is None:
+            try:
+                conn = self.create()
+            except Exception:
+                self.put(None)
+                raise
+        return conn
+
+
+class Client(object):
+    """Storage commands raise ServerError when memcached answers with an
+    error rather than telling whether it stored the value.
+
+    """
+
+    def __init__(self, servers, max_connections=10, timeout=None):
+        self.ring = HashRing(servers)
+        self.pools = dict((x, ConnectionPool(x, max_connections, timeout))
+                          for x in servers)
+
+    def get(self, key):
+        return self.get_multi([key]).get(key)
+
+    def get_multi(self, keys):
+        """Get several keys with one request per server.
+
+        Returns: dict of the keys that were found and their values.
+
+        """
+        rv = {}
+        for server, server_keys in self._group_by_server(keys).iteritems():
+            for key, value, _cas in self._retrieve(server, 'get', server_keys):
+                rv[key] = value
+        return rv
+
+    def gets(self, key):
+        """Returns: (value, cas id) to update `key` with, or (None, None)."""
+        for key, value, cas_id in self._retrieve(self._server(key), 'gets',
+                                                 [key]):
+            return value, cas_id
+        return None, None
+
+    def set(self, key, value, time=0):
+        return self._store('set', key, value, time) == 'STORED'
+
+    def add(self, key, value, time=0):
+        """Store `key` only if it does not exist yet."""
+        return self._store('add', key, value, time) == 'STORED'
+
+    def cas(self, key, value, cas_id, time=0):
+        """Store `key` only if it did not change since `gets` gave `cas_id`.
+
+        Returns: True if stored, False if it changed, None if it is gone.
+
+        """
+        rv = self._store('cas', key, value, time, cas_id)
+        if rv == 'NOT_FOUND':
+            return None
+        return rv == 'STORED'
+
+    def delete(self, key):
+        """Returns: whether the key existed."""
+        def _delete(conn):
+            conn.send('delete %s\r\n' % key)
+            return conn.readline()
+        return self._call(self._server(key), _delete) == 'DELETED'
+
+    def _server(self, key):
+        return self.ring.get_node(key)
+
+    def _group_by_server(self, keys):
+        by_server = {}
+        for key in keys:
+            by_server.setdefault(self._server(key), []).append(key)
+        return by_server
+
+    def _call(self, server, f):
+        try:
+            return self.pools[server].call(f)
+        except (socket.error, IOError), e:
+            logging.warning('memcached at %s failed: %s', server, e)
+            raise
+
+    def _retrieve(self, server, command, keys):
+        def _retrieve(conn):
+            conn.send('%s %s\r\n' % (command, ' '.join(keys)))
+            rv = []
+            line = conn.readline()
+            while line != 'END':
+                parts = line.split()
+                if parts[0] != 'VALUE':
+                    raise IOError('Unexpected memcached response: %s' % line)
+                data = conn.read(int(parts[3]))
+                cas_id = len(parts) > 4 and int(parts[4]) or None
+                rv.append((parts[1], self._decode(data, int(parts[2])),
+                           cas_id))
+                line = conn.readline()
+            return rv
+        return self._call(server, _retrieve)
+
+    def _store(self, command, key, value, time, cas_id=None):
+        data, flags = self._encode(value)
+        line = '%s %s %d %d %d' % (command, key, flags, time, len(data))
+        if cas_id is not None:
+            line = '%s %d' % (line, cas_id)
+
+        def _store(conn):
+            conn.send('%s\r\n%s\r\n' % (line, data))
+            return conn.readline()
+        rv = self._call(self._server(key), _store)
+        if rv not in STORE_RESPONSES:
+            # e.g. SERVER_ERROR object too large for cache
+            raise ServerError('memcached failed to %s %s: %s'
+                              % (command, key, rv))
+        return rv
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, str):
+            return value, 0
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL), FLAG_PICKLE
+
+    @staticmethod
+    def _decode(data, flags):
+        if flags & FLAG_PICKLE:
+            return pickle.loads(data)
+        return data
@@ -3,45 +3,162 @@
 """SQL backends for the various services."""
 
 
+import functools
+import itertools
 import json
+import operator
+import sys
+import time
 
-import eventlet.db_pool
+from eventlet import corolocal
+from eventlet import queue
 import sqlalchemy as sql
 from sqlalchemy import types as sql_types
 from sqlalchemy.ext import declarative
+import sqlalchemy.exc
 import sqlalchemy.orm
 import sqlalchemy.pool
 import sqlalchemy.engine.url
 
 from keystone import config
+from keystone.common import logging
+from keystone.common import threadpool
+from keystone.common import utils
 
 
 CONF = config.CONF
 
 
-ModelBase = declarative.declarative_base()
+class ModelMeta(declarative.DeclarativeMeta):
+    """Looks up the column names of DictBase models once, when they are
+    declared, for DictBase to use on every row.
+
+    """
+
+    def __init__(cls, name, bases, dict_):
+        super(ModelMeta, cls).__init__(name, bases, dict_)
+        if '__mapper__' in cls.__dict__ and issubclass(cls, DictBase):
+            # NOTE: by column name, which JsonProperty attributes share
+            names = tuple(x.name for x in cls.__mapper__.columns)
+            cls._column_names = names
+            getter = operator.attrgetter(*names)
+            if len(names) == 1:
+                cls._column_values = staticmethod(lambda obj: (getter(obj),))
+            else:
+                cls._column_values = staticmethod(getter)
+
+
+ModelBase = declarative.declarative_base(metaclass=ModelMeta)
 
 
 # For exporting to other modules
 Column = sql.Column
 String = sql.String
+DateTime = sql.DateTime
 ForeignKey = sql.ForeignKey
+and_ = sql.and_
 
 
 # Special Fields
 class JsonBlob(sql_types.TypeDecorator):
+    """JSON text, handed out undecoded as :class:`LazyJson`.
+
+    Use it through a :class:`JsonProperty` so the text is only decoded if
+    the value is used.  Encoded and decoded with the `[sql] json_codec`
+    module, which backends set up when they are created.
+
+    """
+
     impl = sql.Text
 
     def process_bind_param(self, value, dialect):
-        return json.dumps(value)
+        if isinstance(value, LazyJson):
+            # written back unchanged, unless it was decoded and could have
+            # been modified in place
+            if not value.decoded:
+                return value.text
+            value = value.value
+        return get_codec().dumps(value)
 
     def process_result_value(self, value, dialect):
-        return json.loads(value)
+        # NULL for the columns of a row missing from an outer join
+        if value is None:
+            return None
+        return LazyJson(value)
+
+
+class LazyJson(object):
+    """The text of a JsonBlob, decoded the first time `get` is called."""
+
+    __slots__ = ('text', 'value', 'decoded')
+
+    def __init__(self, text):
+        self.text = text
+        self.value = None
+        self.decoded = False
+
+    def get(self):
+        if not self.decoded:
+            self.value = get_codec().loads(self.text)
+            self.decoded = True
+        return self.value
+
+
+class JsonProperty(object):
+    """Model attribute for the JsonBlob column mapped as `column`.
+
+    Reads decode the column the first time, the value is kept with the row
+    until it is assigned or reloaded::
+
+        _extra = sql.Column('extra', sql.JsonBlob())
+        extra = sql.JsonProperty('_extra')
+
+    """
+
+    def __init__(self, column):
+        self.column = column
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = getattr(obj, self.column)
+        if isinstance(value, LazyJson):
+            return value.get()
+        return value
+
+    def __set__(self, obj, value):
+        setattr(obj, self.column, value)
+
+
+# JSON codecs by module name, and the one in use, see `[sql] json_codec`.
+CODECS = {'json': json}
+CODEC = json
+
+
+def get_codec():
+    """Returns: the JSON codec in use, a module with `dumps` and `loads`."""
+    return CODEC
+
+
+def set_codec(name):
+    """Use the JSON codec module `name`, importing it if need be."""
+    global CODEC
+    codec = CODECS.get(name)
+    if codec is None:
+        codec = CODECS[name] = utils.import_object(name)
+    CODEC = codec
 
 
 class DictBase(object):
+    """Lets a model be used like a dict of its columns."""
+
+    # set by ModelMeta for each model
+    _column_names = ()
+    _column_values = staticmethod(lambda obj: ())
+
     def to_dict(self):
-        return dict(self.iteritems())
+        return dict(itertools.izip(self._column_names,
+                                   self._column_values(self)))
 
     def __setitem__(self, key, value):
         setattr(self, key, value)
@@ -53,12 +170,7 @@ class DictBase(object):
         return getattr(self, key, default)
 
     def __iter__(self):
-        self._i = iter(sqlalchemy.orm.object_mapper(self).columns)
-        return self
-
-    def next(self):
-        n = self._i.next().name
-        return n
+        return iter(self._column_names)
 
     def update(self, values):
         """Make the model object behave like a dict."""
@@ -66,53 +178,502 @@ class DictBase(object):
             setattr(self, k, v)
 
     def iteritems(self):
-        """Make the model object behave like a dict.
-
-        Includes attributes from joins.
+        """Make the model object behave like a dict."""
+        return itertools.izip(self._column_names, self._column_values(self))
+
+
+class GreenPool(sqlalchemy.pool.Pool):
+    """Connection pool for green threads.
+
+    Keeps up to `max_size` connections open.  `warm_up` opens the first
+    `min_size` of them ahead of time, the rest are opened as they are needed.
+    When they are all checked out further checkouts wait on an eventlet
+    queue, so other green threads keep running, and raise
+    sqlalchemy.exc.TimeoutError after `timeout` seconds.
+
+    Connections that sat idle for `ping_interval` seconds or more are checked
+    with a `SELECT 1` before they are handed out and replaced if that fails.
+
+    """
+
+    def __init__(self, creator, min_size=1, max_size=10, timeout=30,
+                 ping_interval=10, **kw):
+        sqlalchemy.pool.Pool.__init__(self, creator, **kw)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        # (checked in at, connection record)
+        self._idle = queue.LightQueue()
+        self._opened = 0
+        self._stats = {'checkouts': 0,
+                       'waits': 0,
+                       'wait_time': 0.0,
+                       'max_wait_time': 0.0,
+                       'timeouts': 0,
+                       'pings': 0,
+                       'reconnects': 0}
+
+    def warm_up(self):
+        """Open connections until `min_size` of them are open."""
+        while self._opened < self.min_size:
+            self._opened += 1
+            try:
+                record = self._create_connection()
+            except Exception:
+                self._opened -= 1
+                raise
+            self._idle.put((time.time(), record))
+
+    def get_stats(self):
+        """Checkouts, the time they waited, and how many connections are open,
+        idle and checked out.
 
         """
-        return dict([(k, getattr(self, k)) for k in self])
-        #local = dict(self)
-        #joined = dict([(k, v) for k, v in self.__dict__.iteritems()
-        #               if not k[0] == '_'])
-        #local.update(joined)
-        #return local.iteritems()
+        stats = dict(self._stats)
+        stats['open'] = self._opened
+        stats['idle'] = self._idle.qsize()
+        stats['checked_out'] = self._opened - stats['idle']
+        return stats
+
+    def status(self):
+        return ('GreenPool open: %(open)d  idle: %(idle)d  '
+                'checked out: %(checked_out)d' % self.get_stats())
+
+    def recreate(self):
+        self.logger.info('Pool recreating')
+        return self.__class__(self._creator, min_size=self.min_size,
+                              max_size=self.max_size, timeout=self.timeout,
+                              ping_interval=self.ping_interval,
+                              recycle=self._recycle, echo=self.echo,
+                              logging_name=self._orig_logging_name,
+                              use_threadlocal=self._use_threadlocal,
+                              _dispatch=self.dispatch)
+
+    def dispose(self):
+        while True:
+            try:
+                _checked_in, record = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            record.close()
+            self._opened -= 1
+
+    def _do_get(self):
+        stats = self._stats
+        stats['checkouts'] += 1
+        try:
+            checked_in, record = self._idle.get_nowait()
+        except queue.Empty:
+            if self._opened < self.max_size:
+                self._opened += 1
+                try:
+                    return self._create_connection()
+                except Exception:
+                    self._opened -= 1
+                    raise
+
+            stats['waits'] += 1
+            start = time.time()
+            try:
+                checked_in, record = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                stats['timeouts'] += 1
+                raise sqlalchemy.exc.TimeoutError(
+                        'GreenPool limit of %d connections reached, '
+                        'connection timed out, timeout %s'
+                        % (self.max_size, self.timeout))
+            finally:
+                waited = time.time() - start
+                stats['wait_time'] += waited
+                stats['max_wait_time'] = max(stats['max_wait_time'], waited)
+
+        if (record.connection is not None
+                and time.time() - checked_in >= self.ping_interval):
+            self._ping(record)
+        return record
+
+    def _do_return_conn(self, record):
+        self._idle.put((time.time(), record))
+
+    def _ping(self, record):
+        self._stats['pings'] += 1
+        try:
+            cursor = record.connection.cursor()
+            try:
+                cursor.execute('SELECT 1')
+            finally:
+                cursor.close()
+        except Exception, e:
+            logging.warning('Replacing database connection that failed a '
+                            'ping: %s', e)
+            self._stats['reconnects'] += 1
+            # the record opens a new connection when it is next used
+            record.invalidate(e)
+
+
+class Replicas(object):
+    """Read only copies of a primary database.
+
+    `choose` picks the replica to read from next, in turn (round_robin) or
+    the one with the fewest connections in use (least_loaded).  Replicas are
+    checked with a `SELECT 1` every `check_interval` seconds, and again right
+    after a statement failed on them; one that fails the check is skipped
+    until it passes.
+
+    """
+
+    def __init__(self, engines, selection='round_robin', check_interval=10):
+        self.engines = list(engines)
+        self.selection = selection
+        self.check_interval = check_interval
+        self._next = 0
+        self._state = {}
+        for engine in self.engines:
+            state = self._state[engine] = {'healthy': True,
+                                           'checked_at': None,
+                                           'in_use': 0,
+                                           'reads': 0,
+                                           'failures': 0}
+            sqlalchemy.event.listen(
+                    engine, 'checkout',
+                    functools.partial(self._on_checkout, state))
+            sqlalchemy.event.listen(
+                    engine, 'checkin',
+                    functools.partial(self._on_checkin, state))
+            sqlalchemy.event.listen(
+                    engine, 'dbapi_error',
+                    functools.partial(self._on_error, state))
+
+    def choose(self):
+        """Returns: the engine of a healthy replica, or None."""
+        if not self.engines:
+            return None
+        # the order replicas are tried in turns with every call
+        i = self._next
+        self._next = (i + 1) % len(self.engines)
+        candidates = [x for x in self.engines[i:] + self.engines[:i]
+                      if self._is_healthy(x)]
+        if not candidates:
+            return None
+
+        if self.selection == 'least_loaded':
+            engine = min(candidates, key=lambda x: self._state[x]['in_use'])
+        else:
+            engine = candidates[0]
+        self._state[engine]['reads'] += 1
+        return engine
+
+    def get_stats(self):
+        """Returns: {url: {'healthy', 'in_use', 'reads', 'failures'}}."""
+        stats = {}
+        for engine in self.engines:
+            state = dict(self._state[engine])
+            del state['checked_at']
+            stats[str(engine.url)] = state
+        return stats
+
+    def _is_healthy(self, engine):
+        state = self._state[engine]
+        now = time.time()
+        if (state['checked_at'] is not None
+                and now - state['checked_at'] < self.check_interval):
+            return state['healthy']
+
+        state['checked_at'] = now
+        try:
+            engine.execute('SELECT 1').close()
+        except Exception, e:
+            if state['healthy']:
+                logging.warning('Not reading from replica %s: %s',
+                                engine.url, e)
+            state['healthy'] = False
+        else:
+            state['healthy'] = True
+        return state['healthy']
+
+    def _on_checkout(self, state, *args):
+        state['in_use'] += 1
+
+    def _on_checkin(self, state, *args):
+        state['in_use'] -= 1
+
+    def _on_error(self, state, *args):
+        state['failures'] += 1
+        # check it before it is used again
+        state['checked_at'] = None
+
+
+class ThreadedDbapi(object):
+    """A DB-API module whose connections make their calls in `pool`.
+
+    C drivers such as MySQLdb do not yield to the eventlet hub while they
+    wait for the database, every green thread would wait with them.  Here
+    the calls run in the OS threads of a :class:`threadpool.ThreadPool`
+    instead, and fail with threadpool.Timeout if they take longer than its
+    timeout.
+
+    A connection whose call timed out is still busy in its thread, so it
+    is abandoned: its other calls fail, its rollback and close do nothing
+    and it is replaced when it is checked back in to the pool.
+
+    """
+
+    def __init__(self, dbapi, pool):
+        self.dbapi = dbapi
+        self.pool = pool
+
+    def connect(self, *args, **kw):
+        connection = self.pool.execute(self.dbapi.connect, *args, **kw)
+        return ThreadedConnection(connection, self.pool)
+
+    def __getattr__(self, name):
+        return getattr(self.dbapi, name)
+
+
+class _Threaded(object):
+    # calls that are skipped once the connection is abandoned
+    _cleanup = ('rollback', 'close')
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if not callable(value):
+            return value
+
+        def _call(*args, **kw):
+            return self._execute(name, value, args, kw)
+        return _call
+
+    def _execute(self, name, f, args, kw):
+        connection = self._connection
+        if name in self._cleanup:
+            if connection.abandoned:
+                return
+            if sys.exc_info()[0] is not None:
+                # NOTE: SQLAlchemy rolls back and closes while handling an
+                #       error, then re-raises it with a bare raise.  Waiting
+                #       for a thread would switch green threads, which
+                #       clears the error being handled, so these quick calls
+                #       are made right here instead.
+                return f(*args, **kw)
+        elif connection.abandoned:
+            raise threadpool.Timeout('connection abandoned after a timeout')
+        try:
+            return self._pool.execute(f, *args, **kw)
+        except threadpool.Timeout:
+            connection.abandoned = True
+            raise
+
+
+class ThreadedConnection(_Threaded):
+    def __init__(self, connection, pool):
+        self._target = connection
+        self._connection = self
+        self._pool = pool
+        self.abandoned = False
+
+    def cursor(self, *args, **kw):
+        cursor = self._execute('cursor', self._target.cursor, args, kw)
+        return ThreadedCursor(cursor, self)
+
+
+class ThreadedCursor(_Threaded):
+    def __init__(self, cursor, connection):
+        self._target = cursor
+        self._connection = connection
+        self._pool = connection._pool
+
+
+def _replace_abandoned(dbapi_connection, connection_record):
+    if getattr(dbapi_connection, 'abandoned', False):
+        connection_record.invalidate()
+
+
+# Runs the DB-API calls of every engine, see `[sql] thread_pool_size`.
+THREAD_POOL = None
+
+
+def get_thread_pool():
+    global THREAD_POOL
+    if THREAD_POOL is None:
+        THREAD_POOL = threadpool.ThreadPool(
+                size=CONF.sql.thread_pool_size,
+                timeout=CONF.sql.thread_pool_timeout)
+    return THREAD_POOL
+
+
+def green_pool_args():
+    """Returns: the arguments to sqlalchemy.create_engine for a
+    :class:`GreenPool` set up from `[sql]`.
+
+    """
+    # NOTE: create_engine hands the pool its arguments by their own names,
+    #       except for a few it renames, timeout being pool_timeout
+    return {'poolclass': GreenPool,
+            'min_size': CONF.sql.min_pool_size,
+            'max_size': CONF.sql.max_pool_size,
+            'pool_timeout': CONF.sql.pool_timeout,
+            'ping_interval': CONF.sql.pool_ping_interval}
+
+
+def create_engine(url):
+    """Returns: a SQLAlchemy engine for `url` set up from `[sql]`.
+
+    Except for sqlite, whose connections are cheap to open and bound to a
+    file that the tests replace, connections are kept in a
+    :class:`GreenPool`.  With `[sql] thread_pool_size` their calls are made
+    in OS threads, see :class:`ThreadedDbapi`.
+
+    """
+    connection_dict = sqlalchemy.engine.url.make_url(url)
+
+    engine_args = {'pool_recycle': CONF.sql.idle_timeout,
+                   'echo': CONF.sql.echo,
+                   }
+
+    if 'sqlite' in connection_dict.drivername:
+        engine_args['poolclass'] = sqlalchemy.pool.NullPool
+    else:
+        engine_args.update(green_pool_args())
+
+    if CONF.sql.thread_pool_size:
+        dbapi = connection_dict.get_dialect().dbapi()
+        engine_args['module'] = ThreadedDbapi(dbapi, get_thread_pool())
+        if 'sqlite' in connection_dict.drivername:
+            # used from whichever thread runs the call
+            engine_args['connect_args'] = {'check_same_thread': False}
+
+    engine = sql.create_engine(url, **engine_args)
+    if CONF.sql.thread_pool_size:
+        sqlalchemy.event.listen(engine, 'checkin', _replace_abandoned)
+    if isinstance(engine.pool, GreenPool):
+        engine.pool.warm_up()
+    return engine
+
+
+# Engines, session makers and replica sets shared by every backend, by
+# connection url.
+ENGINES = {}
+MAKERS = {}
+REPLICAS = {}
+
+# When each green thread last asked for a session to write with, see
+# `[sql] read_your_writes`.
+WRITES = corolocal.local()
 
 
 # Backends
 class Base(object):
-    _MAKER = None
-    _ENGINE = None
-
-    def get_session(self, autocommit=True, expire_on_commit=False):
-        """Return a SQLAlchemy session."""
-        if self._MAKER is None or self._ENGINE is None:
-            self._ENGINE = self.get_engine()
-            self._MAKER = self.get_maker(self._ENGINE,
-                                         autocommit,
-                                         expire_on_commit)
-
-        session = self._MAKER()
-        # TODO(termie): we may want to do something similar
-        #session.query = nova.exception.wrap_db_error(session.query)
-        #session.flush = nova.exception.wrap_db_error(session.flush)
-        return session
+    def __init__(self):
+        # NOTE: looked up here rather than for every value, reading an
+        #       option costs as much as decoding a small blob
+        set_codec(CONF.sql.json_codec)
+        # open the pool's first connections at startup, not on the first
+        # request
+        if CONF.sql.connection:
+            self.get_engine()
+
+    def get_session(self, autocommit=True, expire_on_commit=False,
+                    read_only=False):
+        """Return a SQLAlchemy session.
+
+        With `read_only` the session reads from one of `[sql] replicas`,
+        unless the green thread asked for a session to write with in the
+        last `[sql] read_your_writes` seconds or no replica is healthy.
 
-    def get_engine(self):
-        """Return a SQLAlchemy engine."""
-        connection_dict = sqlalchemy.engine.url.make_url(CONF.sql.connection)
+        """
+        engine = None
+        if read_only and CONF.sql.replicas:
+            written_at = getattr(WRITES, 'at', None)
+            if (written_at is None
+                    or time.time() - written_at >= CONF.sql.read_your_writes):
+                engine = self.get_replicas().choose()
+        if engine is None:
+            engine = self.get_engine()
+            if not read_only:
+                WRITES.at = time.time()
+        return self._get_session(engine, autocommit, expire_on_commit)
 
-        engine_args = {"pool_recycle": CONF.sql.idle_timeout,
-                       "echo": True,
-                       }
+    def get_engine(self):
+        """Return the SQLAlchemy engine for `[sql] connection`.
 
-        if "sqlite" in connection_dict.drivername:
-            engine_args["poolclass"] = sqlalchemy.pool.NullPool
+        There is one engine, and so one pool of connections, per url.
 
-        return sql.create_engine(CONF.sql.connection, **engine_args)
+        """
+        url = CONF.sql.connection
+        if url not in ENGINES:
+            ENGINES[url] = create_engine(url)
+        return ENGINES[url]
+
+    def get_replicas(self):
+        """Return the :class:`Replicas` for `[sql] replicas`."""
+        key = (CONF.sql.connection, tuple(CONF.sql.replicas))
+        if key not in REPLICAS:
+            engines = []
+            for url in CONF.sql.replicas:
+                if url not in ENGINES:
+                    ENGINES[url] = create_engine(url)
+                engines.append(ENGINES[url])
+            REPLICAS[key] = Replicas(
+                    engines,
+                    selection=CONF.sql.replica_selection,
+                    check_interval=CONF.sql.replica_check_interval)
+        return REPLICAS[key]
 
     def get_maker(self, engine, autocommit=True, expire_on_commit=False):
         """Return a SQLAlchemy sessionmaker using the given engine."""
         return sqlalchemy.orm.sessionmaker(bind=engine,
                                            autocommit=autocommit,
                                            expire_on_commit=expire_on_commit)
+
+    def get_pool_stats(self):
+        """Counters of the connection pool, see GreenPool.get_stats.
+
+        Returns: the counters, or {} if connections are not pooled.
+
+        """
+        pool = self.get_engine().pool
+        if not isinstance(pool, GreenPool):
+            return {}
+        return pool.get_stats()
+
+    def _get_session(self, engine, autocommit=True, expire_on_commit=False):
+        key = (str(engine.url), autocommit, expire_on_commit)
+        if key not in MAKERS:
+            MAKERS[key] = self.get_maker(engine, autocommit, expire_on_commit)
+        session = MAKERS[key]()
+        # TODO(termie): we may want to do something similar
+        #session.query = nova.exception.wrap_db_error(session.query)
+        #session.flush = nova.exception.wrap_db_error(session.flush)
+        return session
+
+    def _range(self, query, column, marker=None, limit=None, reverse=False):
+        """Limit `query` to up to `limit` rows after `marker` in `column`.
+
+        If `reverse` the rows before `marker` are returned instead, nearest
+        first.  `column` should be indexed so this is a range scan.
+
+        """
+        if reverse:
+            if marker is not None:
+                query = query.filter(column < marker)
+            query = query.order_by(column.desc())
+        else:
+            if marker is not None:
+                query = query.filter(column > marker)
+            query = query.order_by(column)
+        if limit is not None:
+            query = query.limit(limit)
+        return query
+
+    def _in(self, query, column, values, batch_size=500):
+        """Yields: the rows of `query` with `column` in `values`.
+
+        Queried `batch_size` values at a time, databases limit how many
+        parameters a statement may have (999 for sqlite).
+
+        """
+        values = list(values)
+        for i in xrange(0, len(values), batch_size):
+            for row in query.filter(column.in_(values[i:i + batch_size])):
+                yield row
@@ -8,10 +8,17 @@ import keystone.identity.backends.sql
 import keystone.contrib.ec2.backends.sql
 
 
+INITIAL_TABLES = ['user', 'tenant', 'role', 'metadata',
+                  'user_tenant_membership', 'ec2_credential']
+
+
 def upgrade(migrate_engine):
     # Upgrade operations go here. Don't create your own engine; bind
     # migrate_engine to your metadata
-    sql.ModelBase.metadata.create_all(migrate_engine)
+    # NOTE: only create the tables that existed at this version, models for
+    #       later versions share the metadata but get their own migrations
+    tables = [sql.ModelBase.metadata.tables[x] for x in INITIAL_TABLES]
+    sql.ModelBase.metadata.create_all(migrate_engine, tables=tables)
 
 
 def downgrade(migrate_engine):
@@ -0,0 +1,23 @@
+from sqlalchemy import *
+from migrate import *
+
+
+meta = MetaData()
+
+
+token = Table('token', meta,
+              Column('id', String(64), primary_key=True),
+              Column('expires', DateTime(), index=True),
+              Column('user_id', String(64), index=True),
+              Column('tenant_id', String(64)),
+              Column('extra', Text()))
+
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    token.create()
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    token.drop()
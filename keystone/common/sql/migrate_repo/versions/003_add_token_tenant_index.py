@@ -0,0 +1,17 @@
+from sqlalchemy import *
+from migrate import *
+
+
+meta = MetaData()
+
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    token = Table('token', meta, autoload=True)
+    Index('ix_token_tenant_id', token.c.tenant_id).create(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    token = Table('token', meta, autoload=True)
+    Index('ix_token_tenant_id', token.c.tenant_id).drop(migrate_engine)
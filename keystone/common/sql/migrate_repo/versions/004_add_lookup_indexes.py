@@ -0,0 +1,23 @@
+from sqlalchemy import *
+from migrate import *
+
+
+meta = MetaData()
+
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    # NOTE: metadata and user_tenant_membership are looked up by user_id
+    #       through their (user_id, tenant_id) primary keys already
+    ec2_credential = Table('ec2_credential', meta, autoload=True)
+    Index('ix_ec2_credential_user_id',
+          ec2_credential.c.user_id,
+          ec2_credential.c.access).create(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    ec2_credential = Table('ec2_credential', meta, autoload=True)
+    Index('ix_ec2_credential_user_id',
+          ec2_credential.c.user_id,
+          ec2_credential.c.access).drop(migrate_engine)
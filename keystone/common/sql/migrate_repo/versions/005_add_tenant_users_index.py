@@ -0,0 +1,23 @@
+from sqlalchemy import *
+from migrate import *
+
+
+meta = MetaData()
+
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    user_tenant_membership = Table('user_tenant_membership', meta,
+                                   autoload=True)
+    Index('ix_user_tenant_membership_tenant_id',
+          user_tenant_membership.c.tenant_id,
+          user_tenant_membership.c.user_id).create(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    user_tenant_membership = Table('user_tenant_membership', meta,
+                                   autoload=True)
+    Index('ix_user_tenant_membership_tenant_id',
+          user_tenant_membership.c.tenant_id,
+          user_tenant_membership.c.user_id).drop(migrate_engine)
@@ -0,0 +1,70 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""Run blocking calls in real threads without stalling the eventlet hub."""
+
+import eventlet
+from eventlet import semaphore
+from eventlet import tpool
+
+
+class Timeout(Exception):
+    """A call did not finish within the pool's timeout."""
+
+
+class ThreadPool(object):
+    """Runs at most `size` blocking calls at a time in OS threads.
+
+    Calls go through :func:`eventlet.tpool.execute` so the calling green
+    thread yields while they run, callers beyond `size` wait their turn.  A
+    caller gives up after `timeout` seconds, though the call keeps its slot
+    until the thread it runs in actually returns.
+
+    Calls are made in the threads of :mod:`eventlet.tpool`, of which there
+    are EVENTLET_THREADPOOL_SIZE (20 unless set in the environment).
+
+    """
+
+    def __init__(self, size=10, timeout=None):
+        self.size = size
+        self.timeout = timeout
+        self._slots = semaphore.Semaphore(size)
+        self._stats = {'calls': 0,
+                       'timeouts': 0,
+                       'running': 0,
+                       'waiting': 0,
+                       'max_waiting': 0}
+
+    def execute(self, f, *args, **kw):
+        """Returns: f(*args, **kw), or raises what it raised or Timeout."""
+        stats = self._stats
+        stats['calls'] += 1
+        stats['waiting'] += 1
+        stats['max_waiting'] = max(stats['max_waiting'], stats['waiting'])
+        timer = eventlet.Timeout(self.timeout)
+        try:
+            try:
+                self._slots.acquire()
+            finally:
+                stats['waiting'] -= 1
+            stats['running'] += 1
+            worker = eventlet.spawn(self._run, f, args, kw)
+            return worker.wait()
+        except eventlet.Timeout, e:
+            if e is not timer:
+                raise
+            stats['timeouts'] += 1
+            raise Timeout('%s did not return within %ss'
+                          % (getattr(f, '__name__', f), self.timeout))
+        finally:
+            timer.cancel()
+
+    def get_stats(self):
+        """Calls made and timed out, and how many are running or waiting."""
+        return dict(self._stats)
+
+    def _run(self, f, args, kw):
+        try:
+            return tpool.execute(f, *args, **kw)
+        finally:
+            self._stats['running'] -= 1
+            self._slots.release()
@@ -18,6 +18,8 @@
 #    under the License.
 
 import base64
+import bisect
+import datetime
 import hashlib
 import hmac
 import json
@@ -49,9 +51,46 @@ def import_object(import_str, *args, **kw):
         return cls(*args, **kw)
 
 
+def page(ordered, marker=None, limit=None, reverse=False):
+    """Up to `limit` items of the sorted list `ordered` after `marker`.
+
+    If `reverse` the items before `marker` are returned instead, nearest
+    first.
+
+    """
+    if reverse:
+        end = len(ordered)
+        if marker is not None:
+            end = bisect.bisect_left(ordered, marker)
+        start = 0
+        if limit is not None:
+            start = max(0, end - limit)
+        return ordered[start:end][::-1]
+
+    start = 0
+    if marker is not None:
+        start = bisect.bisect_right(ordered, marker)
+    end = len(ordered)
+    if limit is not None:
+        end = start + limit
+    return ordered[start:end]
+
+
+ISO_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def isotime(at=None):
+    """Stringify a naive utc datetime (default now) in ISO 8601 format."""
+    if at is None:
+        at = datetime.datetime.utcnow()
+    return at.strftime(ISO_TIME_FORMAT)
+
+
 class SmarterEncoder(json.JSONEncoder):
     """Help for JSON encoding dict-like objects."""
     def default(self, obj):
+        if hasattr(obj, 'to_dict'):
+            return obj.to_dict()
         if not isinstance(obj, dict) and hasattr(obj, 'iteritems'):
             return dict(obj.iteritems())
         return super(SmarterEncoder, self).default(obj)
@@ -68,17 +107,17 @@ class Ec2Signer(object):
 
     def generate(self, credentials):
         """Generate auth string according to what SignatureVersion is given."""
-        if credentials.params['SignatureVersion'] == '0':
-            return self._calc_signature_0(credentials.params)
-        if credentials.params['SignatureVersion'] == '1':
-            return self._calc_signature_1(credentials.params)
-        if credentials.params['SignatureVersion'] == '2':
-            return self._calc_signature_2(credentials.params,
-                                          credentials.verb,
-                                          credentials.host,
-                                          credentials.path)
+        if credentials['params']['SignatureVersion'] == '0':
+            return self._calc_signature_0(credentials['params'])
+        if credentials['params']['SignatureVersion'] == '1':
+            return self._calc_signature_1(credentials['params'])
+        if credentials['params']['SignatureVersion'] == '2':
+            return self._calc_signature_2(credentials['params'],
+                                          credentials['verb'],
+                                          credentials['host'],
+                                          credentials['path'])
         raise Exception('Unknown Signature Version: %s' %
-                        credentials.params['SignatureVersion'])
+                        credentials['params']['SignatureVersion'])
 
     @staticmethod
     def _get_utf8_value(value):
@@ -108,7 +147,7 @@ class Ec2Signer(object):
 
     def _calc_signature_2(self, params, verb, server_string, path):
         """Generate AWS signature version 2 string."""
-        LOG.debug('using _calc_signature_2')
+        logging.debug('using _calc_signature_2')
         string_to_sign = '%s\n%s\n%s\n' % (verb, server_string, path)
         if self.hmac_256:
             current_hmac = self.hmac_256
@@ -124,16 +163,75 @@ class Ec2Signer(object):
             val = urllib.quote(val, safe='-_~')
             pairs.append(urllib.quote(key, safe='') + '=' + val)
         qs = '&'.join(pairs)
-        LOG.debug('query string: %s', qs)
+        logging.debug('query string: %s', qs)
         string_to_sign += qs
-        LOG.debug('string_to_sign: %s', string_to_sign)
+        logging.debug('string_to_sign: %s', string_to_sign)
         current_hmac.update(string_to_sign)
         b64 = base64.b64encode(current_hmac.digest())
-        LOG.debug('len(b64)=%d', len(b64))
-        LOG.debug('base64 encoded digest: %s', b64)
+        logging.debug('len(b64)=%d', len(b64))
+        logging.debug('base64 encoded digest: %s', b64)
         return b64
 
 
+class TokenSigner(object):
+    """Signs and verifies self-contained tokens with a shared key.
+
+    A signed token is ``<urlsafe base64 json payload>.<hex hmac-sha256>``, so
+    anyone holding the key can read and trust it without asking keystone.
+
+    """
+
+    def __init__(self, key):
+        if not key:
+            raise ValueError('A signing key is required')
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        self.key = key
+
+    @staticmethod
+    def is_signed(token_id):
+        """Tell signed token ids apart from plain uuid ones."""
+        return '.' in token_id
+
+    def sign(self, payload):
+        """Returns: a token id carrying `payload`."""
+        body = base64.urlsafe_b64encode(
+                json.dumps(payload, separators=(',', ':'))).rstrip('=')
+        return '%s.%s' % (body, self._digest(body))
+
+    def verify(self, token_id):
+        """Check the signature and the `expires` field of a token id.
+
+        Returns: the payload, or None if the token was not signed with our
+                 key or has expired.
+
+        """
+        if isinstance(token_id, unicode):
+            token_id = token_id.encode('utf-8')
+        body, _sep, signature = token_id.rpartition('.')
+        if not body or not self._compare(signature, self._digest(body)):
+            return None
+        padding = '=' * (-len(body) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(body + padding))
+        expires = payload.get('expires')
+        if expires is not None and expires <= isotime():
+            return None
+        return payload
+
+    def _digest(self, body):
+        return hmac.new(self.key, body, hashlib.sha256).hexdigest()
+
+    @staticmethod
+    def _compare(a, b):
+        """Compare in constant time so the signature cannot be guessed."""
+        if len(a) != len(b):
+            return False
+        result = 0
+        for x, y in zip(a, b):
+            result |= ord(x) ^ ord(y)
+        return result == 0
+
+
 # From python 2.7
 def check_output(*popenargs, **kwargs):
   r"""Run command with arguments and return its output as a byte string.
@@ -22,6 +22,7 @@
 import json
 import logging
 import sys
+import urllib
 
 import eventlet
 import eventlet.wsgi
@@ -32,9 +33,13 @@ import webob
 import webob.dec
 import webob.exc
 
+from keystone import config
 from keystone.common import utils
 
 
+CONF = config.CONF
+
+
 class WritableLogger(object):
     """A thin wrapper that responds to `write` and logs."""
 
@@ -159,6 +164,8 @@ class Application(BaseApplication):
         logging.debug('arg_dict: %s', arg_dict)
 
         context = req.environ.get('openstack.context', {})
+        context['query_string'] = dict(req.GET.iteritems())
+        context['path'] = req.path_url
         # allow middleware up the stack to override the params
         params = {}
         if 'openstack.params' in req.environ:
@@ -189,6 +196,52 @@ class Application(BaseApplication):
         return dict([(self._normalize_arg(k), v)
                      for (k, v) in d.iteritems()])
 
+    def _paginate(self, context, name, list_f, key='id'):
+        """Get the page of a list the request asks for with limit and marker.
+
+        `list_f(marker, limit, reverse)` should list the refs after `marker`
+        in order of `key`, or those before it nearest first if `reverse`.
+
+        Returns: {name: the refs, '<name>_links': next and previous links}.
+
+        """
+        query = context.get('query_string', {})
+        marker = query.get('marker')
+        try:
+            limit = int(query.get('limit', CONF.list_limit))
+        except ValueError:
+            raise webob.exc.HTTPBadRequest('limit must be an integer')
+        if limit < 1:
+            raise webob.exc.HTTPBadRequest('limit must be positive')
+        limit = min(limit, CONF.list_limit)
+
+        # one more than asked for tells whether there is a next page
+        refs = list_f(marker=marker, limit=limit + 1, reverse=False)
+        links = []
+        if len(refs) > limit:
+            refs = refs[:limit]
+            links.append(self._page_link(context, 'next', refs[-1][key],
+                                         limit))
+        if marker is not None:
+            start = refs and refs[0][key] or marker
+            previous = list_f(marker=start, limit=limit + 1, reverse=True)
+            if previous:
+                # the previous page starts after the one before it
+                previous_marker = None
+                if len(previous) > limit:
+                    previous_marker = previous[limit][key]
+                links.append(self._page_link(context, 'previous',
+                                             previous_marker, limit))
+        return {name: refs, '%s_links' % name: links}
+
+    def _page_link(self, context, rel, marker, limit):
+        params = {'limit': limit}
+        if marker is not None:
+            params['marker'] = marker
+        return {'rel': rel,
+                'href': '%s?%s' % (context.get('path', ''),
+                                   urllib.urlencode(sorted(params.items())))}
+
     def assert_admin(self, context):
         if not context['is_admin']:
             user_token_ref = self.token_api.get_token(
@@ -402,7 +455,9 @@ class ExtensionRouter(Router):
             mapper = routes.Mapper()
         self.application = application
         self.add_routes(mapper)
-        mapper.connect('{path_info:.*}', controller=self.application)
+        # NOTE: the leading slash keeps routes from appending the whole path
+        #       to SCRIPT_NAME, which would break the application's URLs
+        mapper.connect('/{path_info:.*}', controller=self.application)
         super(ExtensionRouter, self).__init__(mapper)
 
     def add_routes(self, mapper):
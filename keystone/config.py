@@ -114,6 +114,24 @@ def register_cli_bool(*args, **kw):
     return conf.register_cli_opt(cfg.BoolOpt(*args, **kw), group=group)
 
 
+def register_int(*args, **kw):
+    conf = kw.pop('conf', CONF)
+    group = _ensure_group(kw, conf)
+    return conf.register_opt(cfg.IntOpt(*args, **kw), group=group)
+
+
+def register_cli_int(*args, **kw):
+    conf = kw.pop('conf', CONF)
+    group = _ensure_group(kw, conf)
+    return conf.register_cli_opt(cfg.IntOpt(*args, **kw), group=group)
+
+
+def register_list(*args, **kw):
+    conf = kw.pop('conf', CONF)
+    group = _ensure_group(kw, conf)
+    return conf.register_opt(cfg.ListOpt(*args, **kw), group=group)
+
+
 def _ensure_group(kw, conf):
     group = kw.pop('group', None)
     if group:
@@ -128,18 +146,69 @@ register_str('admin_token', default='ADMIN')
 register_str('compute_port')
 register_str('admin_port')
 register_str('public_port')
+register_int('list_limit', default=1000)
 
 
 # sql options
 register_str('connection', group='sql')
-register_str('idle_timeout', group='sql')
-register_str('min_pool_size', group='sql')
-register_str('maz_pool_size', group='sql')
-register_str('pool_timeout', group='sql')
+register_int('idle_timeout', group='sql', default=200)
+register_int('min_pool_size', group='sql', default=1)
+register_int('max_pool_size', group='sql', default=10)
+register_int('pool_timeout', group='sql', default=30)
+register_int('pool_ping_interval', group='sql', default=10)
+register_bool('echo', group='sql', default=False)
+register_list('replicas', group='sql', default=[])
+register_str('replica_selection', group='sql', default='round_robin')
+register_int('replica_check_interval', group='sql', default=10)
+register_int('read_your_writes', group='sql', default=5)
+register_str('json_codec', group='sql', default='json')
+register_int('thread_pool_size', group='sql', default=0)
+register_int('thread_pool_timeout', group='sql', default=30)
+
+
+# kvs options
+register_str('path', group='kvs')
+register_int('sync_batch', group='kvs', default=64)
+register_int('sync_interval', group='kvs', default=1)
+register_int('snapshot_threshold', group='kvs', default=100000)
+
+
+# cache options
+register_bool('enabled', group='cache', default=False)
+register_list('methods', group='cache',
+              default=['get_user', 'get_user_by_name', 'get_tenant',
+                       'get_tenant_by_name', 'get_role', 'get_metadata',
+                       'get_catalog'])
+register_int('ttl', group='cache', default=60)
+register_int('negative_ttl', group='cache', default=5)
+register_int('max_size', group='cache', default=10000)
+register_int('max_bytes', group='cache', default=16777216)
+
+
+# memcache options
+register_str('servers', group='memcache', default='localhost:11211')
+register_int('max_connections', group='memcache', default=10)
+register_int('socket_timeout', group='memcache', default=3)
 
 
 register_str('driver', group='catalog')
 register_str('driver', group='identity')
 register_str('driver', group='policy')
 register_str('driver', group='token')
+register_int('expiration', group='token', default=86400)
+register_int('expiry_granularity', group='token', default=60)
+register_int('max_tokens', group='token', default=0)
+register_bool('reuse', group='token', default=False)
+register_int('reuse_cache_size', group='token', default=10000)
+register_str('format', group='token', default='uuid')
+register_int('identity_cache_ttl', group='token', default=5)
+register_int('identity_cache_size', group='token', default=10000)
+register_str('signing_key', group='token')
+register_bool('group_commit', group='token', default=False)
+register_int('group_commit_window', group='token', default=5)
+register_int('group_commit_size', group='token', default=100)
 register_str('driver', group='ec2')
+register_int('workers', group='pam', default=10)
+register_int('timeout', group='pam', default=10)
+register_int('cache_ttl', group='pam', default=0)
+register_int('cache_size', group='pam', default=10000)
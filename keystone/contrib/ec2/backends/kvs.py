@@ -9,23 +9,41 @@ class Ec2(kvs.Base):
         credential_ref = self.db.get('credential-%s' % credential_id)
         return credential_ref
 
-    def list_credentials(self, user_id):
-        credential_ids = self.db.get('credential_list', [])
-        rv = [self.get_credential(x) for x in credential_ids]
-        return [x for x in rv if x['user_id'] == user_id]
+    def list_credentials(self, user_id, marker=None, limit=None,
+                         reverse=False):
+        self._split_credential_list()
+        credential_ids = self.db.srange('credential_list-%s' % user_id,
+                                        marker, limit, reverse)
+        return [self.get_credential(x) for x in credential_ids]
 
     # CRUD
     def create_credential(self, credential_id, credential):
+        self._split_credential_list()
         self.db.set('credential-%s' % credential_id, credential)
-        credential_list = set(self.db.get('credential_list', []))
-        credential_list.add(credential_id)
-        self.db.set('credential_list', list(credential_list))
+        self.db.sadd('credential_list-%s' % credential['user_id'],
+                     credential_id)
         return credential
 
+    def import_records(self, records):
+        for record_type, data in records:
+            self.create_credential(data['access'], data)
+
     def delete_credential(self, credential_id):
+        self._split_credential_list()
         old_credential = self.db.get('credential-%s' % credential_id)
         self.db.delete('credential-%s' % credential_id)
-        credential_list = set(self.db.get('credential_list', []))
-        credential_list.remove(credential_id)
-        self.db.set('credential_list', list(credential_list))
+        self.db.srem('credential_list-%s' % old_credential['user_id'],
+                     credential_id)
         return None
+
+    # Private interface
+    def _split_credential_list(self):
+        """Move ids from the old `credential_list` to per user lists."""
+        if 'credential_list' not in self.db:
+            return
+        for credential_id in self.db.get('credential_list'):
+            credential_ref = self.get_credential(credential_id)
+            if credential_ref is not None:
+                self.db.sadd('credential_list-%s' % credential_ref['user_id'],
+                             credential_id)
+        self.db.delete('credential_list')
@@ -8,6 +8,8 @@ class Ec2Credential(sql.ModelBase, sql.DictBase):
     __tablename__ = 'ec2_credential'
     access = sql.Column(sql.String(64), primary_key=True)
     secret = sql.Column(sql.String(64))
+    # NOTE: indexed together with access by ix_ec2_credential_user_id, which
+    #       migration 004 creates
     user_id = sql.Column(sql.String(64))
     tenant_id = sql.Column(sql.String(64))
 
@@ -15,23 +17,23 @@ class Ec2Credential(sql.ModelBase, sql.DictBase):
     def from_dict(cls, user_dict):
         return cls(**user_dict)
 
-    def to_dict(self):
-        return dict(self.iteritems())
-
 
 class Ec2(sql.Base):
     def get_credential(self, credential_id):
-        session = self.get_session()
+        session = self.get_session(read_only=True)
         credential_ref = session.query(Ec2Credential)\
                                 .filter_by(access=credential_id).first()
         if not credential_ref:
             return
         return credential_ref.to_dict()
 
-    def list_credentials(self, user_id):
-        session = self.get_session()
+    def list_credentials(self, user_id, marker=None, limit=None,
+                         reverse=False):
+        session = self.get_session(read_only=True)
         credential_refs = session.query(Ec2Credential)\
                                  .filter_by(user_id=user_id)
+        credential_refs = self._range(credential_refs, Ec2Credential.access,
+                                      marker, limit, reverse)
         return [x.to_dict() for x in credential_refs]
 
     # CRUD
@@ -43,6 +45,13 @@ class Ec2(sql.Base):
             session.flush()
         return credential_ref.to_dict()
 
+    def import_records(self, records):
+        session = self.get_session()
+        with session.begin():
+            for record_type, data in records:
+                session.add(Ec2Credential.from_dict(data.copy()))
+            session.flush()
+
     def delete_credential(self, credential_id):
         session = self.get_session()
         credential_ref = session.query(Ec2Credential)\
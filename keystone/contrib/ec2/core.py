@@ -26,8 +26,10 @@ from keystone import catalog
 from keystone import config
 from keystone import identity
 from keystone import policy
+from keystone import service
 from keystone import token
 from keystone.common import manager
+from keystone.common import utils
 from keystone.common import wsgi
 
 
@@ -81,6 +83,7 @@ class Ec2Controller(wsgi.Application):
         self.token_api = token.Manager()
         self.policy_api = policy.Manager()
         self.ec2_api = Manager()
+        self.token_controller = service.TokenController()
         super(Ec2Controller, self).__init__()
 
     def authenticate_ec2(self, context, credentials=None,
@@ -113,7 +116,7 @@ class Ec2Controller(wsgi.Application):
         creds_ref = self.ec2_api.get_credential(context,
                                                 credentials['access'])
 
-        signer = utils.Signer(creds_ref['secret'])
+        signer = utils.Ec2Signer(creds_ref['secret'])
         signature = signer.generate(credentials)
         if signature == credentials['signature']:
             pass
@@ -123,17 +126,26 @@ class Ec2Controller(wsgi.Application):
             hostname, _port = credentials['host'].split(":")
             credentials['host'] = hostname
             signature = signer.generate(credentials)
-            if signature != credentials.signature:
+            if signature != credentials['signature']:
                 # TODO(termie): proper exception
                 raise Exception("Not Authorized")
         else:
             raise Exception("Not Authorized")
 
-        # TODO(termie): don't create new tokens every time
+        reuse_key = None
+        if CONF.token.reuse:
+            reuse_key = token.reuse_key(
+                    creds_ref['user_id'],
+                    creds_ref['tenant_id'],
+                    'ec2:%s:%s' % (creds_ref['access'], creds_ref['secret']))
+            rv = self.token_api.get_reusable(context, reuse_key)
+            if rv:
+                return rv
+
         # TODO(termie): this is copied from TokenController.authenticate
-        token_id = uuid.uuid4().hex
-        tenant_ref = self.identity_api.get_tenant(creds_ref['tenant_id'])
-        user_ref = self.identity_api.get_user(creds_ref['user_id'])
+        tenant_ref = self.identity_api.get_tenant(context,
+                                                  creds_ref['tenant_id'])
+        user_ref = self.identity_api.get_user(context, creds_ref['user_id'])
         metadata_ref = self.identity_api.get_metadata(
                 context=context,
                 user_id=user_ref['id'],
@@ -144,26 +156,28 @@ class Ec2Controller(wsgi.Application):
                 tenant_id=tenant_ref['id'],
                     metadata=metadata_ref)
 
+        # fill out the roles in the metadata
+        roles_ref = self.identity_api.get_roles(
+                context, metadata_ref.get('roles', []))
+
+        expires = token.default_expire_time()
+        token_id = token.new_token_id(user_ref, tenant_ref, roles_ref, expires)
         token_ref = self.token_api.create_token(
-                context, token_id, dict(expires='',
-                                        id=token_id,
+                context, token_id, dict(id=token_id,
+                                        expires=expires,
                                         user=user_ref,
                                         tenant=tenant_ref,
                                         metadata=metadata_ref))
 
-        # TODO(termie): optimize this call at some point and put it into the
-        #               the return for metadata
-        # fill out the roles in the metadata
-        roles_ref = []
-        for role_id in metadata_ref.get('roles', []):
-            roles_ref.append(self.identity_api.get_role(context, role_id))
-
         # TODO(termie): make this a util function or something
         # TODO(termie): i don't think the ec2 middleware currently expects a
         #               full return, but it contains a note saying that it
         #               would be better to expect a full return
-        return TokenController._format_authenticate(
-                self, token_ref, roles_ref, catalog_ref)
+        rv = self.token_controller._format_authenticate(
+                token_ref, roles_ref, catalog_ref)
+        if reuse_key:
+            self.token_api.set_reusable(context, reuse_key, token_id, rv)
+        return rv
 
     def create_credential(self, context, user_id, tenant_id):
         """Create a secret/access pair for use with ec2 style auth.
@@ -186,16 +200,22 @@ class Ec2Controller(wsgi.Application):
         return {'credential': cred_ref}
 
     def get_credentials(self, context, user_id):
-        """List all credentials for a user.
+        """List a user's credentials a page at a time.
 
         :param context: standard context
         :param user_id: id of user
-        :returns: credentials: list of ec2 credential dicts
+        :returns: credentials: list of ec2 credential dicts,
+                  credentials_links: links to the next and previous pages
         """
 
         # TODO(termie): validate that this request is valid for given user
         #               tenant
-        return {'credentials': self.ec2_api.list_credentials(context, user_id)}
+        def list_credentials(marker, limit, reverse):
+            return self.ec2_api.list_credentials(
+                    context, user_id, marker=marker, limit=limit,
+                    reverse=reverse)
+        return self._paginate(context, 'credentials', list_credentials,
+                              key='access')
 
     def get_credential(self, context, user_id, credential_id):
         """Retreive a user's access/secret pair by the access key.
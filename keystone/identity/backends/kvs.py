@@ -6,43 +6,61 @@ from keystone.common import kvs
 
 class Identity(kvs.Base, identity.Driver):
     # Public interface
-    def authenticate(self, user_id=None, tenant_id=None, password=None):
+    def authenticate(self, user_id=None, tenant_id=None, password=None,
+                     user_name=None, tenant_name=None):
         """Authenticate based on a user, tenant and password.
 
         Expects the user object to have a password field and the tenant to be
         in the list of tenants on the user.
 
         """
-        user_ref = self.get_user(user_id)
-        tenant_ref = None
-        metadata_ref = None
+        user_ref, tenant_ref, is_member, metadata_ref = self.get_auth_context(
+                user_id=user_id, user_name=user_name,
+                tenant_id=tenant_id, tenant_name=tenant_name)
         if not user_ref or user_ref.get('password') != password:
             raise AssertionError('Invalid user / password')
-        if tenant_id and tenant_id not in user_ref['tenants']:
+        if (tenant_id or tenant_name) and not is_member:
             raise AssertionError('Invalid tenant')
+        return (user_ref, tenant_ref, metadata_ref)
 
-        tenant_ref = self.get_tenant(tenant_id)
-        if tenant_ref:
-            metadata_ref = self.get_metadata(user_id, tenant_id)
+    def get_auth_context(self, user_id=None, user_name=None,
+                         tenant_id=None, tenant_name=None):
+        if user_id is not None:
+            user_ref = self.get_user(user_id)
         else:
-            metadata_ref = {}
-        return (user_ref, tenant_ref, metadata_ref)
+            user_ref = self.get_user_by_name(user_name)
+        if not user_ref:
+            return (None, None, False, {})
+        if tenant_id is not None:
+            tenant_ref = self.get_tenant(tenant_id)
+        elif tenant_name is not None:
+            tenant_ref = self.get_tenant_by_name(tenant_name)
+        else:
+            tenant_ref = None
+        if not tenant_ref:
+            return (user_ref, None, False, {})
+
+        is_member = tenant_ref['id'] in user_ref.get('tenants', [])
+        metadata_ref = self.get_metadata(user_ref['id'], tenant_ref['id'])
+        return (user_ref, tenant_ref, is_member, metadata_ref or {})
 
     def get_tenant(self, tenant_id):
         tenant_ref = self.db.get('tenant-%s' % tenant_id)
         return tenant_ref
 
+    def get_tenants(self, tenant_ids):
+        tenant_refs = self.db.get_multi(['tenant-%s' % x for x in tenant_ids])
+        return [x for x in tenant_refs if x is not None]
+
     def get_tenant_by_name(self, tenant_name):
-        tenant_ref = self.db.get('tenant_name-%s' % tenant_name)
-        return tenant_ref
+        return self._get_by_name('tenant', tenant_name)
 
     def get_user(self, user_id):
         user_ref = self.db.get('user-%s' % user_id)
         return user_ref
 
     def get_user_by_name(self, user_name):
-        user_ref = self.db.get('user_name-%s' % user_name)
-        return user_ref
+        return self._get_by_name('user', user_name)
 
     def get_metadata(self, user_id, tenant_id):
         return self.db.get('metadata-%s-%s' % (tenant_id, user_id))
@@ -51,14 +69,36 @@ class Identity(kvs.Base, identity.Driver):
         role_ref = self.db.get('role-%s' % role_id)
         return role_ref
 
-    def list_users(self):
-        user_ids = self.db.get('user_list', [])
+    def get_roles(self, role_ids):
+        role_refs = self.db.get_multi(['role-%s' % x for x in role_ids])
+        return [x for x in role_refs if x is not None]
+
+    def list_tenants(self, marker=None, limit=None, reverse=False):
+        tenant_ids = self.db.srange('tenant_list', marker, limit, reverse)
+        return [self.get_tenant(x) for x in tenant_ids]
+
+    def list_users(self, marker=None, limit=None, reverse=False):
+        user_ids = self.db.srange('user_list', marker, limit, reverse)
         return [self.get_user(x) for x in user_ids]
 
-    def list_roles(self):
-        role_ids = self.db.get('role_list', [])
+    def list_roles(self, marker=None, limit=None, reverse=False):
+        role_ids = self.db.srange('role_list', marker, limit, reverse)
         return [self.get_role(x) for x in role_ids]
 
+    def import_records(self, records):
+        for record_type, data in records:
+            if record_type == 'tenant':
+                self.create_tenant(data['id'], data)
+            elif record_type == 'role':
+                self.create_role(data['id'], data)
+            elif record_type == 'user':
+                self.create_user(data['id'], data)
+            elif record_type == 'membership':
+                self.add_user_to_tenant(data['tenant_id'], data['user_id'])
+            elif record_type == 'metadata':
+                self.create_metadata(data['user_id'], data['tenant_id'],
+                                     data['data'])
+
     # These should probably be part of the high-level API
     def add_user_to_tenant(self, tenant_id, user_id):
         user_ref = self.get_user(user_id)
@@ -66,6 +106,7 @@ class Identity(kvs.Base, identity.Driver):
         tenants.add(tenant_id)
         user_ref['tenants'] = list(tenants)
         self.update_user(user_id, user_ref)
+        self.db.sadd('tenant_users-%s' % tenant_id, user_id)
 
     def remove_user_from_tenant(self, tenant_id, user_id):
         user_ref = self.get_user(user_id)
@@ -73,6 +114,15 @@ class Identity(kvs.Base, identity.Driver):
         tenants.remove(tenant_id)
         user_ref['tenants'] = list(tenants)
         self.update_user(user_id, user_ref)
+        index_key = 'tenant_users-%s' % tenant_id
+        if self.db.sismember(index_key, user_id):
+            self.db.srem(index_key, user_id)
+
+    def get_tenant_users(self, tenant_id, marker=None, limit=None,
+                         reverse=False):
+        user_ids = self.db.srange('tenant_users-%s' % tenant_id,
+                                  marker, limit, reverse)
+        return [self.get_user(x) for x in user_ids]
 
     def get_tenants_for_user(self, user_id):
         user_ref = self.get_user(user_id)
@@ -104,47 +154,42 @@ class Identity(kvs.Base, identity.Driver):
 
     # CRUD
     def create_user(self, user_id, user):
-        self.db.set('user-%s' % user_id, user)
-        self.db.set('user_name-%s' % user['name'], user)
-        user_list = set(self.db.get('user_list', []))
-        user_list.add(user_id)
-        self.db.set('user_list', list(user_list))
+        self._set_named('user', user_id, user)
+        self.db.sadd('user_list', user_id)
+        for tenant_id in user.get('tenants', []):
+            self.db.sadd('tenant_users-%s' % tenant_id, user_id)
         return user
 
     def update_user(self, user_id, user):
-        # get the old name and delete it too
-        old_user = self.db.get('user-%s' % user_id)
-        self.db.delete('user_name-%s' % old_user['name'])
-        self.db.set('user-%s' % user_id, user)
-        self.db.set('user_name-%s' % user['name'], user)
+        self._set_named('user', user_id, user)
         return user
 
     def delete_user(self, user_id):
-        old_user = self.db.get('user-%s' % user_id)
-        self.db.delete('user_name-%s' % old_user['name'])
-        self.db.delete('user-%s' % user_id)
-        user_list = set(self.db.get('user_list', []))
-        user_list.remove(user_id)
-        self.db.set('user_list', list(user_list))
+        old_user = self._delete_named('user', user_id)
+        self.db.srem('user_list', user_id)
+        for tenant_id in old_user.get('tenants', []):
+            index_key = 'tenant_users-%s' % tenant_id
+            if self.db.sismember(index_key, user_id):
+                self.db.srem(index_key, user_id)
         return None
 
     def create_tenant(self, tenant_id, tenant):
-        self.db.set('tenant-%s' % tenant_id, tenant)
-        self.db.set('tenant_name-%s' % tenant['name'], tenant)
+        self._set_named('tenant', tenant_id, tenant)
+        self.db.sadd('tenant_list', tenant_id)
+        if 'tenant_users-%s' % tenant_id not in self.db:
+            # users created before their tenant may already be in it
+            self.db.set('tenant_users-%s' % tenant_id, set())
         return tenant
 
     def update_tenant(self, tenant_id, tenant):
-        # get the old name and delete it too
-        old_tenant = self.db.get('tenant-%s' % tenant_id)
-        self.db.delete('tenant_name-%s' % old_tenant['name'])
-        self.db.set('tenant-%s' % tenant_id, tenant)
-        self.db.set('tenant_name-%s' % tenant['name'], tenant)
+        self._set_named('tenant', tenant_id, tenant)
         return tenant
 
     def delete_tenant(self, tenant_id):
-        old_tenant = self.db.get('tenant-%s' % tenant_id)
-        self.db.delete('tenant_name-%s' % old_tenant['name'])
-        self.db.delete('tenant-%s' % tenant_id)
+        self._delete_named('tenant', tenant_id)
+        self.db.srem('tenant_list', tenant_id)
+        if 'tenant_users-%s' % tenant_id in self.db:
+            self.db.delete('tenant_users-%s' % tenant_id)
         return None
 
     def create_metadata(self, user_id, tenant_id, metadata):
@@ -161,9 +206,7 @@ class Identity(kvs.Base, identity.Driver):
 
     def create_role(self, role_id, role):
         self.db.set('role-%s' % role_id, role)
-        role_list = set(self.db.get('role_list', []))
-        role_list.add(role_id)
-        self.db.set('role_list', list(role_list))
+        self.db.sadd('role_list', role_id)
         return role
 
     def update_role(self, role_id, role):
@@ -172,7 +215,48 @@ class Identity(kvs.Base, identity.Driver):
 
     def delete_role(self, role_id):
         self.db.delete('role-%s' % role_id)
-        role_list = set(self.db.get('role_list', []))
-        role_list.remove(role_id)
-        self.db.set('role_list', list(role_list))
+        self.db.srem('role_list', role_id)
         return None
+
+    # Private interface
+    # NOTE: `<kind>_name-<name>` keys only hold the id of the record, which
+    #       is stored once under `<kind>-<id>`.  The record is written before
+    #       the name points at it and the name is removed before the record,
+    #       so a name never points at a missing record, and a name is only
+    #       removed while it still points at the record being changed.
+    def _get_by_name(self, kind, name):
+        ref_id = self.db.get('%s_name-%s' % (kind, name))
+        if ref_id is None:
+            return None
+        if isinstance(ref_id, dict):
+            # names used to hold a copy of the whole record
+            ref_id = ref_id['id']
+        ref = self.db.get('%s-%s' % (kind, ref_id))
+        if ref is None or ref['name'] != name:
+            return None
+        return ref
+
+    def _set_named(self, kind, ref_id, ref):
+        old_ref = self.db.get('%s-%s' % (kind, ref_id))
+        self.db.set('%s-%s' % (kind, ref_id), ref)
+        name_key = '%s_name-%s' % (kind, ref['name'])
+        if old_ref is None or old_ref['name'] != ref['name']:
+            self.db.set(name_key, ref_id)
+            if old_ref is not None:
+                self._delete_name(kind, ref_id, old_ref['name'])
+        elif isinstance(self.db.get(name_key), dict):
+            self.db.set(name_key, ref_id)
+
+    def _delete_named(self, kind, ref_id):
+        old_ref = self.db.get('%s-%s' % (kind, ref_id))
+        self._delete_name(kind, ref_id, old_ref['name'])
+        self.db.delete('%s-%s' % (kind, ref_id))
+        return old_ref
+
+    def _delete_name(self, kind, ref_id, name):
+        name_key = '%s_name-%s' % (kind, name)
+        pointer = self.db.get(name_key)
+        if isinstance(pointer, dict):
+            pointer = pointer['id']
+        if pointer == ref_id:
+            self.db.delete(name_key)
@@ -2,20 +2,52 @@
 
 from __future__ import absolute_import
 
+import collections
+import hashlib
+import hmac
+import os
+import time
+
 import pam
 
+from keystone import config
+from keystone.common import threadpool
+
+
+CONF = config.CONF
+
+# PAM conversations, shared by every PamIdentity.  See `[pam]`.
+POOL = None
+
+# Expiry times of successful verifications, keyed by a salted hash of the
+# credentials and kept in least recently used order.  See `[pam] cache_ttl`.
+VERIFIED = collections.OrderedDict()
+SALT = os.urandom(16)
+
+
+def get_pool():
+    global POOL
+    if POOL is None:
+        POOL = threadpool.ThreadPool(size=CONF.pam.workers,
+                                     timeout=CONF.pam.timeout)
+    return POOL
+
 
 class PamIdentity(object):
     """Very basic identity based on PAM.
 
     Tenant is always the same as User, root user has admin role.
+
+    PAM stacks may block on nss or ldap lookups, so the conversations run in
+    a bounded pool of OS threads (see `[pam] workers` and `[pam] timeout`).
+
     """
 
     def authenticate(self, username, password, **kwargs):
-        if pam.authenticate(username, password):
+        if self._verify(username, password):
             metadata = {}
             if username == 'root':
-                metadata['is_admin'] == True
+                metadata['is_admin'] = True
 
             tenant = {'id': username,
                       'name': username}
@@ -27,3 +59,29 @@ class PamIdentity(object):
     def get_tenants(self, username):
         return [{'id': username,
                  'name': username}]
+
+    def get_stats(self):
+        """Counters for the PAM conversations, see ThreadPool.get_stats."""
+        return get_pool().get_stats()
+
+    # Private interface
+    def _verify(self, username, password):
+        ttl = CONF.pam.cache_ttl
+        if not ttl:
+            return get_pool().execute(pam.authenticate, username, password)
+
+        credentials = [isinstance(x, unicode) and x.encode('utf-8') or x
+                       for x in (username or '', password or '')]
+        key = hmac.new(SALT, '\0'.join(credentials), hashlib.sha256).digest()
+        now = time.time()
+        expires = VERIFIED.pop(key, None)
+        if expires is not None and expires > now:
+            VERIFIED[key] = expires
+            return True
+
+        if not get_pool().execute(pam.authenticate, username, password):
+            return False
+        VERIFIED[key] = now + ttl
+        while len(VERIFIED) > CONF.pam.cache_size:
+            VERIFIED.popitem(last=False)
+        return True
@@ -10,7 +10,8 @@ class User(sql.ModelBase, sql.DictBase):
     id = sql.Column(sql.String(64), primary_key=True)
     name = sql.Column(sql.String(64), unique=True)
     #password = sql.Column(sql.String(64))
-    extra = sql.Column(sql.JsonBlob())
+    _extra = sql.Column('extra', sql.JsonBlob())
+    extra = sql.JsonProperty('_extra')
 
     @classmethod
     def from_dict(cls, user_dict):
@@ -35,7 +36,8 @@ class Tenant(sql.ModelBase, sql.DictBase):
     __tablename__ = 'tenant'
     id = sql.Column(sql.String(64), primary_key=True)
     name = sql.Column(sql.String(64), unique=True)
-    extra = sql.Column(sql.JsonBlob())
+    _extra = sql.Column('extra', sql.JsonBlob())
+    extra = sql.JsonProperty('_extra')
 
     @classmethod
     def from_dict(cls, tenant_dict):
@@ -64,18 +66,20 @@ class Role(sql.ModelBase, sql.DictBase):
 
 class Metadata(sql.ModelBase, sql.DictBase):
     __tablename__ = 'metadata'
-    #__table_args__ = (
-    #    sql.Index('idx_metadata_usertenant', 'user', 'tenant'),
-    #    )
+    # NOTE: the (user_id, tenant_id) primary key doubles as the index for
+    #       lookups by user
 
     user_id = sql.Column(sql.String(64), primary_key=True)
     tenant_id = sql.Column(sql.String(64), primary_key=True)
-    data = sql.Column(sql.JsonBlob())
+    _data = sql.Column('data', sql.JsonBlob())
+    data = sql.JsonProperty('_data')
 
 
 class UserTenantMembership(sql.ModelBase, sql.DictBase):
     """Tenant membership join table."""
     __tablename__ = 'user_tenant_membership'
+    # NOTE: looked up by user through the primary key and by tenant through
+    #       ix_user_tenant_membership_tenant_id, which migration 005 creates
     user_id = sql.Column(sql.String(64),
                          sql.ForeignKey('user.id'),
                          primary_key=True)
@@ -90,60 +94,92 @@ class Identity(sql.Base, identity.Driver):
         migration.db_sync()
 
     # Identity interface
-    def authenticate(self, user_id=None, tenant_id=None, password=None):
+    def authenticate(self, user_id=None, tenant_id=None, password=None,
+                     user_name=None, tenant_name=None):
         """Authenticate based on a user, tenant and password.
 
         Expects the user object to have a password field and the tenant to be
         in the list of tenants on the user.
 
         """
-        user_ref = self.get_user(user_id)
-        tenant_ref = None
-        metadata_ref = None
+        user_ref, tenant_ref, is_member, metadata_ref = self.get_auth_context(
+                user_id=user_id, user_name=user_name,
+                tenant_id=tenant_id, tenant_name=tenant_name)
         if not user_ref or user_ref.get('password') != password:
             raise AssertionError('Invalid user / password')
-
-        tenants = self.get_tenants_for_user(user_id)
-        if tenant_id and tenant_id not in tenants:
+        if (tenant_id or tenant_name) and not is_member:
             raise AssertionError('Invalid tenant')
+        return (user_ref, tenant_ref, metadata_ref)
 
-        tenant_ref = self.get_tenant(tenant_id)
-        if tenant_ref:
-            metadata_ref = self.get_metadata(user_id, tenant_id)
+    def get_auth_context(self, user_id=None, user_name=None,
+                         tenant_id=None, tenant_name=None):
+        """Fetch the user, tenant, membership and metadata in one query."""
+        if user_id is not None:
+            user_filter = User.id == user_id
         else:
-            metadata_ref = {}
-        return (user_ref, tenant_ref, metadata_ref)
+            user_filter = User.name == user_name
+
+        session = self.get_session(read_only=True)
+        if tenant_id is None and tenant_name is None:
+            user_ref = session.query(User).filter(user_filter).first()
+            return (user_ref and user_ref.to_dict() or None, None, False, {})
+
+        if tenant_id is not None:
+            tenant_filter = Tenant.id == tenant_id
+        else:
+            tenant_filter = Tenant.name == tenant_name
+        row = session.query(User,
+                            Tenant,
+                            UserTenantMembership.tenant_id,
+                            Metadata)\
+                     .outerjoin(Tenant, tenant_filter)\
+                     .outerjoin(UserTenantMembership, sql.and_(
+                            UserTenantMembership.user_id == User.id,
+                            UserTenantMembership.tenant_id == Tenant.id))\
+                     .outerjoin(Metadata, sql.and_(
+                            Metadata.user_id == User.id,
+                            Metadata.tenant_id == Tenant.id))\
+                     .filter(user_filter)\
+                     .first()
+        if row is None:
+            return (None, None, False, {})
+
+        user_ref, tenant_ref, member_tenant_id, metadata_ref = row
+        return (user_ref.to_dict(),
+                tenant_ref and tenant_ref.to_dict() or None,
+                member_tenant_id is not None,
+                metadata_ref and metadata_ref.data or {})
 
     def get_tenant(self, tenant_id):
-        session = self.get_session()
+        session = self.get_session(read_only=True)
         tenant_ref = session.query(Tenant).filter_by(id=tenant_id).first()
         if not tenant_ref:
             return
         return tenant_ref.to_dict()
 
     def get_tenant_by_name(self, tenant_name):
-        session = self.get_session()
+        session = self.get_session(read_only=True)
         tenant_ref = session.query(Tenant).filter_by(name=tenant_name).first()
         if not tenant_ref:
             return
         return tenant_ref.to_dict()
 
     def get_user(self, user_id):
-        session = self.get_session()
+        session = self.get_session(read_only=True)
         user_ref = session.query(User).filter_by(id=user_id).first()
         if not user_ref:
             return
         return user_ref.to_dict()
 
     def get_user_by_name(self, user_name):
-        session = self.get_session()
+        session = self.get_session(read_only=True)
         user_ref = session.query(User).filter_by(name=user_name).first()
         if not user_ref:
             return
         return user_ref.to_dict()
 
     def get_metadata(self, user_id, tenant_id):
-        session = self.get_session()
+        session = self.get_session(read_only=True)
         metadata_ref = session.query(Metadata)\
                               .filter_by(user_id=user_id)\
                               .filter_by(tenant_id=tenant_id)\
@@ -151,20 +187,65 @@ class Identity(sql.Base, identity.Driver):
         return getattr(metadata_ref, 'data', None)
 
     def get_role(self, role_id):
-        session = self.get_session()
+        session = self.get_session(read_only=True)
         role_ref = session.query(Role).filter_by(id=role_id).first()
         return role_ref
 
-    def list_users(self):
-        session = self.get_session()
-        user_refs = session.query(User)
+    def get_roles(self, role_ids):
+        if not role_ids:
+            return []
+        session = self.get_session(read_only=True)
+        role_refs = dict((x.id, x) for x in
+                         self._in(session.query(Role), Role.id, role_ids))
+        return [role_refs[x] for x in role_ids if x in role_refs]
+
+    def get_tenants(self, tenant_ids):
+        if not tenant_ids:
+            return []
+        session = self.get_session(read_only=True)
+        tenant_refs = dict((x.id, x) for x in self._in(session.query(Tenant),
+                                                       Tenant.id, tenant_ids))
+        return [tenant_refs[x].to_dict() for x in tenant_ids
+                if x in tenant_refs]
+
+    def list_tenants(self, marker=None, limit=None, reverse=False):
+        session = self.get_session(read_only=True)
+        tenant_refs = self._range(session.query(Tenant), Tenant.id,
+                                  marker, limit, reverse)
+        return [x.to_dict() for x in tenant_refs]
+
+    def list_users(self, marker=None, limit=None, reverse=False):
+        session = self.get_session(read_only=True)
+        user_refs = self._range(session.query(User), User.id,
+                                marker, limit, reverse)
         return [x.to_dict() for x in user_refs]
 
-    def list_roles(self):
-        session = self.get_session()
-        role_refs = session.query(Role)
+    def list_roles(self, marker=None, limit=None, reverse=False):
+        session = self.get_session(read_only=True)
+        role_refs = self._range(session.query(Role), Role.id,
+                                marker, limit, reverse)
         return list(role_refs)
 
+    def import_records(self, records):
+        session = self.get_session()
+        with session.begin():
+            for record_type, data in records:
+                if record_type == 'tenant':
+                    session.add(Tenant.from_dict(data.copy()))
+                elif record_type == 'role':
+                    session.add(Role(**data))
+                elif record_type == 'user':
+                    session.add(User.from_dict(data.copy()))
+                elif record_type == 'membership':
+                    session.add(UserTenantMembership(
+                            user_id=data['user_id'],
+                            tenant_id=data['tenant_id']))
+                elif record_type == 'metadata':
+                    session.add(Metadata(user_id=data['user_id'],
+                                         tenant_id=data['tenant_id'],
+                                         data=data['data']))
+            session.flush()
+
     # These should probably be part of the high-level API
     def add_user_to_tenant(self, tenant_id, user_id):
         session = self.get_session()
@@ -190,8 +271,19 @@ class Identity(sql.Base, identity.Driver):
             session.delete(membership_ref)
             session.flush()
 
+    def get_tenant_users(self, tenant_id, marker=None, limit=None,
+                         reverse=False):
+        session = self.get_session(read_only=True)
+        query = session.query(User)\
+                       .join(UserTenantMembership,
+                             UserTenantMembership.user_id == User.id)\
+                       .filter(UserTenantMembership.tenant_id == tenant_id)
+        user_refs = self._range(query, UserTenantMembership.user_id,
+                                marker, limit, reverse)
+        return [x.to_dict() for x in user_refs]
+
     def get_tenants_for_user(self, user_id):
-        session = self.get_session()
+        session = self.get_session(read_only=True)
         membership_refs = session.query(UserTenantMembership)\
                           .filter_by(user_id=user_id)\
                           .all()
@@ -13,6 +13,7 @@ from keystone import config
 from keystone import policy
 from keystone import token
 from keystone.common import manager
+from keystone.common import utils
 from keystone.common import wsgi
 
 
@@ -34,14 +35,31 @@ class Manager(manager.Manager):
 class Driver(object):
     """Interface description for an Identity driver."""
 
-    def authenticate(self, user_id=None, tenant_id=None, password=None):
+    def authenticate(self, user_id=None, tenant_id=None, password=None,
+                     user_name=None, tenant_name=None):
         """Authenticate a given user, tenant and password.
 
+        The user and the tenant can each be given by id or by name.
+
         Returns: (user, tenant, metadata).
 
         """
         raise NotImplementedError()
 
+    def get_auth_context(self, user_id=None, user_name=None,
+                         tenant_id=None, tenant_name=None):
+        """Get everything authenticating a user for a tenant needs at once.
+
+        The user and the tenant can each be given by id or by name.
+
+        Returns: (user_ref, tenant_ref, is_member, metadata_ref), where
+                 user_ref is None if there is no such user, tenant_ref is None
+                 if there is no such tenant (or user, or no tenant was given)
+                 and metadata_ref is empty if there is none.
+
+        """
+        raise NotImplementedError()
+
     def get_tenant(self, tenant_id):
         """Get a tenant by id.
 
@@ -50,6 +68,16 @@ class Driver(object):
         """
         raise NotImplementedError()
 
+    def get_tenants(self, tenant_ids):
+        """Get several tenants by id at once.
+
+        Tenants that do not exist are left out.
+
+        Returns: a list of tenant_refs in the order of `tenant_ids`.
+
+        """
+        raise NotImplementedError()
+
     def get_tenant_by_name(self, tenant_name):
         """Get a tenant by name.
 
@@ -82,25 +110,62 @@ class Driver(object):
         """
         raise NotImplementedError()
 
-    def list_users(self):
-        """List all users in the system.
+    def get_roles(self, role_ids):
+        """Get several roles by id at once.
+
+        Roles that do not exist are left out.
+
+        Returns: a list of role_refs in the order of `role_ids`.
+
+        """
+        raise NotImplementedError()
+
+    def list_tenants(self, marker=None, limit=None, reverse=False):
+        """List the tenants in the system in order of id.
+
+        Lists up to `limit` tenants with ids after `marker`, or before it,
+        nearest first, if `reverse`.
+
+        Returns: a list of tenant_refs or an empty list.
+
+        """
+        raise NotImplementedError()
+
+    def list_users(self, marker=None, limit=None, reverse=False):
+        """List the users in the system in order of id.
 
         NOTE(termie): I'd prefer if this listed only the users for a given
                       tenant.
 
+        Lists up to `limit` users with ids after `marker`, or before it,
+        nearest first, if `reverse`.
+
         Returns: a list of user_refs or an empty list.
 
         """
         raise NotImplementedError()
 
-    def list_roles(self):
-        """List all roles in the system.
+    def list_roles(self, marker=None, limit=None, reverse=False):
+        """List the roles in the system in order of id.
+
+        Lists up to `limit` roles with ids after `marker`, or before it,
+        nearest first, if `reverse`.
 
         Returns: a list of role_refs or an empty list.
 
         """
         raise NotImplementedError()
 
+    def import_records(self, records):
+        """Create tenants, roles, users, memberships and metadata in bulk.
+
+        `records` is a list of (type, data) pairs as described in
+        :mod:`keystone.common.bulk`, created in order, in one transaction
+        where the backend has them.
+
+        """
+        raise NotImplementedError()
+
     # NOTE(termie): six calls below should probably be exposed by the api
     #               more clearly when the api redesign happens
     def add_user_to_tenant(self, tenant_id, user_id):
@@ -109,6 +174,18 @@ class Driver(object):
     def remove_user_from_tenant(self, tenant_id, user_id):
         raise NotImplementedError()
 
+    def get_tenant_users(self, tenant_id, marker=None, limit=None,
+                         reverse=False):
+        """List the users of a tenant in order of id.
+
+        Lists up to `limit` users with ids after `marker`, or before it,
+        nearest first, if `reverse`.
+
+        Returns: a list of user_refs or an empty list.
+
+        """
+        raise NotImplementedError()
+
     def get_tenants_for_user(self, user_id):
         """Get the tenants associated with a given user.
 
@@ -236,14 +313,24 @@ class TenantController(wsgi.Application):
         assert token_ref is not None
 
         user_ref = token_ref['user']
-        tenant_ids = self.identity_api.get_tenants_for_user(
-                context, user_ref['id'])
-        tenant_refs = []
-        for tenant_id in tenant_ids:
-            tenant_refs.append(self.identity_api.get_tenant(
-                    context=context,
-                    tenant_id=tenant_id))
-        return self._format_tenants_for_token(tenant_refs)
+        tenant_ids = sorted(set(self.identity_api.get_tenants_for_user(
+                context, user_ref['id'])))
+
+        def list_tenants(marker, limit, reverse):
+            tenant_refs = []
+            # tenants that no longer exist are left out, fetch more ids
+            # until the page is full
+            while len(tenant_refs) < limit:
+                page_ids = utils.page(tenant_ids, marker,
+                                      limit - len(tenant_refs), reverse)
+                if not page_ids:
+                    break
+                tenant_refs.extend(self.identity_api.get_tenants(
+                        context, page_ids))
+                marker = page_ids[-1]
+            return tenant_refs
+        return self._format_tenants_for_token(
+                self._paginate(context, 'tenants', list_tenants))
 
     def get_tenant(self, context, tenant_id):
         # TODO(termie): this stuff should probably be moved to middleware
@@ -285,17 +372,23 @@ class TenantController(wsgi.Application):
     def delete_tenant(self, context, tenant_id, **kw):
         self.assert_admin(context)
         self.identity_api.delete_tenant(context, tenant_id)
+        self.token_api.revoke_tokens_for_tenant(context, tenant_id)
 
-    def get_tenant_users(self, context, **kw):
+    def get_tenant_users(self, context, tenant_id, **kw):
         self.assert_admin(context)
-        raise NotImplementedError()
+        if not self.identity_api.get_tenant(context, tenant_id):
+            raise webob.exc.HTTPNotFound()
+
+        def list_users(marker, limit, reverse):
+            return self.identity_api.get_tenant_users(
+                    context, tenant_id, marker=marker, limit=limit,
+                    reverse=reverse)
+        return self._paginate(context, 'users', list_users)
 
-    def _format_tenants_for_token(self, tenant_refs):
-        for x in tenant_refs:
+    def _format_tenants_for_token(self, page):
+        for x in page['tenants']:
             x['enabled'] = True
-        o = {'tenants': tenant_refs,
-             'tenants_links': []}
-        return o
+        return page
 
 
 class UserController(wsgi.Application):
@@ -317,8 +410,11 @@ class UserController(wsgi.Application):
         # NOTE(termie): i can't imagine that this really wants all the data
         #               about every single user in the system...
         self.assert_admin(context)
-        user_refs = self.identity_api.list_users(context)
-        return {'users': user_refs}
+
+        def list_users(marker, limit, reverse):
+            return self.identity_api.list_users(
+                    context, marker=marker, limit=limit, reverse=reverse)
+        return self._paginate(context, 'users', list_users)
 
     # CRUD extension
     def create_user(self, context, user):
@@ -341,11 +437,15 @@ class UserController(wsgi.Application):
         del user['id']
         user_ref.update(user)
         self.identity_api.update_user(context, user_id, user_ref)
+        # a new password or disabling the user invalidates existing tokens
+        if 'password' in user or not user.get('enabled', True):
+            self.token_api.revoke_tokens_for_user(context, user_id)
         return {'user': user_ref}
 
     def delete_user(self, context, user_id):
         self.assert_admin(context)
         self.identity_api.delete_user(context, user_id)
+        self.token_api.revoke_tokens_for_user(context, user_id)
 
     def set_user_enabled(self, context, user_id, user):
         return self.update_user(context, user_id, user)
@@ -394,9 +494,11 @@ class RoleController(wsgi.Application):
 
     def get_roles(self, context):
         self.assert_admin(context)
-        roles = self.identity_api.list_roles(context)
-        # TODO(termie): probably inefficient at some point
-        return {'roles': roles}
+
+        def list_roles(marker, limit, reverse):
+            return self.identity_api.list_roles(
+                    context, marker=marker, limit=limit, reverse=reverse)
+        return self._paginate(context, 'roles', list_roles)
 
     # COMPAT(diablo): CRUD extension
     def get_role_refs(self, context, user_id):
@@ -463,3 +565,5 @@ class RoleController(wsgi.Application):
         if not roles:
             self.identity_api.remove_user_from_tenant(
                     context, tenant_id, user_id)
+            self.token_api.revoke_tokens_for_user(
+                    context, user_id, tenant_id=tenant_id)
@@ -22,7 +22,8 @@ TOKEN-BASED AUTH MIDDLEWARE
 This WSGI component performs multiple jobs:
 
 * it verifies that incoming client requests have valid tokens by verifying
-  tokens with the auth service.
+  tokens with the auth service, or locally for signed tokens when it shares
+  the auth service's 'signing_key'.
 * it will reject unauthenticated requests UNLESS it is in 'delay_auth_decision'
   mode, which means the final decision is delegated to the downstream WSGI
   component (usually the OpenStack service)
@@ -76,7 +77,8 @@ import webob
 import webob.exc
 from webob.exc import HTTPUnauthorized
 
-from keystone.bufferedhttp import http_connect_raw as http_connect
+from keystone.common import utils
+from keystone.common.bufferedhttp import http_connect_raw as http_connect
 
 PROTOCOL_NAME = "Token Authentication"
 
@@ -128,6 +130,12 @@ class AuthProtocol(object):
         # validating tokens is a privileged call
         self.admin_token = conf.get('admin_token')
 
+        # Key shared with the auth service ([token] signing_key) so signed
+        # tokens can be verified without calling it.  Revocations are not
+        # seen this way, a revoked signed token is honored until it expires.
+        signing_key = conf.get('signing_key')
+        self.signer = signing_key and utils.TokenSigner(signing_key) or None
+
     def __init__(self, app, conf):
         """ Common initialization code """
 
@@ -248,9 +256,18 @@ class AuthProtocol(object):
         return webob.exc.HTTPUnauthorized()(env,
             start_response)
 
+    def _verify_signed_claims(self, claims):
+        """Returns: the payload of a signed token we can verify, else None."""
+        if self.signer is None or not self.signer.is_signed(claims):
+            return None
+        return self.signer.verify(claims)
+
     def _validate_claims(self, claims):
         """Validate claims, and provide identity information isf applicable """
 
+        if self.signer is not None and self.signer.is_signed(claims):
+            return self._verify_signed_claims(claims) is not None
+
         # Step 1: We need to auth with the keystone service, so get an
         # admin token
         #TODO(ziad): Need to properly implement this, where to store creds
@@ -287,6 +304,10 @@ class AuthProtocol(object):
     def _expound_claims(self, claims):
         # Valid token. Get user data and put it in to the call
         # so the downstream service can use it
+        payload = self._verify_signed_claims(claims)
+        if payload is not None:
+            return self._expound_signed_claims(payload)
+
         headers = {"Content-type": "application/json",
                     "Accept": "application/json",
                     "X-Auth-Token": self.admin_token}
@@ -329,6 +350,15 @@ class AuthProtocol(object):
             verified_claims['tenantName'] = tenant_name
         return verified_claims
 
+    def _expound_signed_claims(self, payload):
+        tenant_ref = payload.get('tenant') or {}
+        verified_claims = {'user': payload['user']['name'],
+                    'tenant': tenant_ref.get('id'),
+                    'roles': [x['name'] for x in payload['roles']]}
+        if tenant_ref.get('name'):
+            verified_claims['tenantName'] = tenant_ref['name']
+        return verified_claims
+
     def _decorate_request(self, index, value, env, proxy_headers):
         """Add headers to request"""
         proxy_headers[index] = value
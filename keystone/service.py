@@ -3,13 +3,13 @@
 import json
 import urllib
 import urlparse
-import uuid
 
 import routes
 import webob.dec
 import webob.exc
 
 from keystone import catalog
+from keystone import config
 from keystone import identity
 from keystone import policy
 from keystone import token
@@ -18,6 +18,9 @@ from keystone.common import utils
 from keystone.common import wsgi
 
 
+CONF = config.CONF
+
+
 class AdminRouter(wsgi.ComposingRouter):
     def __init__(self):
         mapper = routes.Mapper()
@@ -128,38 +131,38 @@ class TokenController(wsgi.Application):
         that will return a token that is scoped to that tenant.
         """
 
-        token_id = uuid.uuid4().hex
+        reuse_key = None
         if 'passwordCredentials' in auth:
             username = auth['passwordCredentials'].get('username', '')
             password = auth['passwordCredentials'].get('password', '')
             tenant_name = auth.get('tenantName', None)
 
-            if username:
-                user_ref = self.identity_api.get_user_by_name(
-                        context=context, user_name=username)
-                user_id = user_ref['id']
-            else:
+            user_id = None
+            if not username:
                 user_id = auth['passwordCredentials'].get('userId', None)
 
             # more compat
-            if tenant_name:
-                tenant_ref = self.identity_api.get_tenant_by_name(
-                        context=context, tenant_name=tenant_name)
-                tenant_id = tenant_ref['id']
-            else:
+            tenant_id = None
+            if not tenant_name:
                 tenant_id = auth.get('tenantId', None)
 
+            # names are resolved by the backend along with everything else
             (user_ref, tenant_ref, metadata_ref) = \
                     self.identity_api.authenticate(context=context,
                                                    user_id=user_id,
+                                                   user_name=username or None,
                                                    password=password,
-                                                   tenant_id=tenant_id)
-            token_ref = self.token_api.create_token(
-                    context, token_id, dict(expires='',
-                                            id=token_id,
-                                            user=user_ref,
-                                            tenant=tenant_ref,
-                                            metadata=metadata_ref))
+                                                   tenant_id=tenant_id,
+                                                   tenant_name=tenant_name)
+            if CONF.token.reuse:
+                reuse_key = token.reuse_key(
+                        user_ref['id'],
+                        tenant_ref and tenant_ref['id'] or None,
+                        password)
+                rv = self.token_api.get_reusable(context, reuse_key)
+                if rv:
+                    return rv
+
             if tenant_ref:
                 catalog_ref = self.catalog_api.get_catalog(
                         context=context,
@@ -170,7 +173,7 @@ class TokenController(wsgi.Application):
                 catalog_ref = {}
 
         elif 'token' in auth:
-            token = auth['token'].get('id', None)
+            old_token_id = auth['token'].get('id', None)
 
             tenant_name = auth.get('tenantName')
 
@@ -183,7 +186,8 @@ class TokenController(wsgi.Application):
                 tenant_id = auth.get('tenantId', None)
 
             old_token_ref = self.token_api.get_token(context=context,
-                                                     token_id=token)
+                                                     token_id=old_token_id)
+            assert old_token_ref is not None
             user_ref = old_token_ref['user']
 
             tenants = self.identity_api.get_tenants_for_user(context,
@@ -207,21 +211,24 @@ class TokenController(wsgi.Application):
                 metadata_ref = {}
                 catalog_ref = {}
 
-            token_ref = self.token_api.create_token(
-                    context, token_id, dict(expires='',
-                                            id=token_id,
-                                            user=user_ref,
-                                            tenant=tenant_ref,
-                                            metadata=metadata_ref))
-
-        # TODO(termie): optimize this call at some point and put it into the
-        #               the return for metadata
         # fill out the roles in the metadata
-        roles_ref = []
-        for role_id in metadata_ref.get('roles', []):
-            roles_ref.append(self.identity_api.get_role(context, role_id))
+        roles_ref = self.identity_api.get_roles(
+                context, metadata_ref.get('roles', []))
+
+        # the roles are needed up front as signed tokens carry them
+        expires = token.default_expire_time()
+        token_id = token.new_token_id(user_ref, tenant_ref, roles_ref, expires)
+        token_ref = self.token_api.create_token(
+                context, token_id, dict(id=token_id,
+                                        expires=expires,
+                                        user=user_ref,
+                                        tenant=tenant_ref,
+                                        metadata=metadata_ref))
         logging.debug('TOKEN_REF %s', token_ref)
-        return self._format_authenticate(token_ref, roles_ref, catalog_ref)
+        rv = self._format_authenticate(token_ref, roles_ref, catalog_ref)
+        if reuse_key:
+            self.token_api.set_reusable(context, reuse_key, token_id, rv)
+        return rv
 
     # admin only
     def validate_token(self, context, token_id, belongs_to=None):
@@ -233,18 +240,29 @@ class TokenController(wsgi.Application):
         # TODO(termie): this stuff should probably be moved to middleware
         self.assert_admin(context)
 
+        # signed tokens carry their roles, forged or expired ones are turned
+        # away before touching the backend, which is then only asked whether
+        # the token was revoked
+        payload = None
+        if token.is_signed(token_id):
+            payload = token.verify_signed(token_id)
+            if payload is None:
+                raise webob.exc.HTTPNotFound()
+
         token_ref = self.token_api.get_token(context=context,
                                              token_id=token_id)
+        if token_ref is None:
+            raise webob.exc.HTTPNotFound()
         if belongs_to:
             assert token_ref['tenant']['id'] == belongs_to
 
-        # TODO(termie): optimize this call at some point and put it into the
-        #               the return for metadata
+        if payload is not None:
+            return self._format_token(token_ref, payload['roles'])
+
         # fill out the roles in the metadata
         metadata_ref = token_ref['metadata']
-        roles_ref = []
-        for role_id in metadata_ref.get('roles', []):
-            roles_ref.append(self.identity_api.get_role(context, role_id))
+        roles_ref = self.identity_api.get_roles(
+                context, metadata_ref.get('roles', []))
         return self._format_token(token_ref, roles_ref)
 
     def endpoints(self, context, token_id):
@@ -264,8 +282,11 @@ class TokenController(wsgi.Application):
     def _format_token(self, token_ref, roles_ref):
         user_ref = token_ref['user']
         metadata_ref = token_ref['metadata']
+        expires = token_ref['expires']
+        if expires is not None:
+            expires = utils.isotime(expires)
         o = {'access': {'token': {'id': token_ref['id'],
-                                  'expires': token_ref['expires']
+                                  'expires': expires
                                   },
                         'user': {'id': user_ref['id'],
                                  'name': user_ref['name'],
@@ -104,6 +104,7 @@ class TestCase(unittest.TestCase):
         super(TestCase, self).__init__(*args, **kw)
         self._paths = []
         self._memo = {}
+        self._overrides = []
 
     def setUp(self):
         super(TestCase, self).setUp()
@@ -112,9 +113,17 @@ class TestCase(unittest.TestCase):
         for path in self._paths:
             if path in sys.path:
                 sys.path.remove(path)
+        for name, group in self._overrides:
+            CONF.set_override(name, None, group=group)
         CONF.reset()
         super(TestCase, self).tearDown()
 
+    def opt_in_group(self, group, **kw):
+        """Override config options in `group` for the duration of a test."""
+        for name, value in kw.iteritems():
+            CONF.set_override(name, value, group=group)
+            self._overrides.append((name, group))
+
     def load_backends(self):
         """Hacky shortcut to load the backends for data manipulation."""
         self.identity_api = utils.import_object(CONF.identity.driver)
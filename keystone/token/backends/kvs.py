@@ -1,16 +1,274 @@
 # vim: tabstop=4 shiftwidth=4 softtabstop=4
 
+import calendar
+import copy
+import datetime
+
+from keystone import config
+from keystone import token
 from keystone.common import kvs
 
 
-class Token(kvs.Base):
+CONF = config.CONF
+
+
+# Role ids are repeated across most tokens, so every token shares one copy.
+# Only the first MAX_ROLE_IDS distinct ids are shared, later ones are kept
+# by each token, so ids of roles that come and go cannot fill memory.
+ROLE_IDS = {}
+MAX_ROLE_IDS = 10000
+
+
+def _intern_role_id(role_id):
+    shared = ROLE_IDS.get(role_id)
+    if shared is None:
+        if len(ROLE_IDS) >= MAX_ROLE_IDS:
+            return role_id
+        shared = ROLE_IDS[role_id] = role_id
+    return shared
+
+
+class TokenRecord(object):
+    """What the kvs backend keeps for a token.
+
+    Holds the compact record the Manager creates tokens with (see
+    :func:`keystone.token.core.compact`) in slots rather than a dict, with
+    anything unexpected left in `extra`.
+
+    """
+
+    __slots__ = ('id', 'expires', 'user_id', 'tenant_id', 'roles', 'extra')
+    _MISSING = object()
+
+    def __init__(self, data):
+        data = dict(data)
+        self.id = data.pop('id', None)
+        self.expires = data.pop('expires', None)
+        self.user_id = data.pop('user_id', self._MISSING)
+        self.tenant_id = data.pop('tenant_id', self._MISSING)
+        roles = data.pop('roles', None)
+        if roles is not None:
+            roles = tuple(_intern_role_id(x) for x in roles)
+        self.roles = roles
+        self.extra = data or None
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        self.__init__(state)
+
+    def get(self, key, default=None):
+        value = getattr(self, key, default)
+        if value is self._MISSING:
+            return default
+        return value
+
+    def to_dict(self):
+        d = dict(self.extra or {})
+        d['id'] = self.id
+        d['expires'] = self.expires
+        if self.user_id is not self._MISSING:
+            d['user_id'] = self.user_id
+        if self.tenant_id is not self._MISSING:
+            d['tenant_id'] = self.tenant_id
+        if self.roles is not None:
+            d['roles'] = list(self.roles)
+        return d
+
+
+class Token(kvs.Base, token.Driver):
+    """Token store that reclaims expired tokens as it goes.
+
+    Tokens are hashed into coarse expiry buckets (a timing wheel with slots
+    of `[token] expiry_granularity` seconds).  Each write sweeps only the
+    buckets that have elapsed since the last sweep, so reclaiming expired
+    tokens costs work proportional to what expired rather than to the size
+    of the store.
+
+    Tokens are kept as :class:`TokenRecord` objects.
+
+    If `[token] max_tokens` is set the tokens closest to expiring are evicted
+    to stay within that many tokens.  The buckets holding tokens are kept in
+    a sorted set, so eviction goes straight to the earliest of them however
+    far apart they are.
+
+    The ids of each user's and each tenant's tokens are also indexed so they
+    can be revoked together without scanning the whole store.
+
+    """
+
     # Public interface
     def get_token(self, token_id):
-        return self.db.get('token-%s' % token_id)
+        record = self.db.get('token-%s' % token_id)
+        if record is None or self._is_expired(record):
+            return None
+        return record.to_dict()
 
     def create_token(self, token_id, data):
-        self.db.set('token-%s' % token_id, data)
-        return data
+        data_copy = copy.copy(data)
+        if 'expires' not in data_copy:
+            data_copy['expires'] = token.default_expire_time()
+        record = TokenRecord(data_copy)
+
+        stats = self.get_stats()
+        self._reclaim_expired(stats)
+        old_token_ref = self.db.get('token-%s' % token_id)
+        if old_token_ref is None:
+            stats['tokens'] += 1
+        else:
+            self._remove_from_owners(token_id, old_token_ref)
+        self.db.set('token-%s' % token_id, record)
+        self._add_to_owners(token_id, record)
+        if record.expires is not None:
+            self._add_to_bucket(token_id, record.expires)
+        self._enforce_limit(stats)
+        self.db.set('token_stats', stats)
+        return record.to_dict()
 
     def delete_token(self, token_id):
-        return self.db.delete('token-%s' % token_id)
+        token_ref = self.db.get('token-%s' % token_id)
+        rv = self.db.delete('token-%s' % token_id)
+        self._remove_from_owners(token_id, token_ref)
+        stats = self.get_stats()
+        stats['tokens'] -= 1
+        self.db.set('token_stats', stats)
+        return rv
+
+    def revoke_tokens_for_user(self, user_id, tenant_id=None):
+        return self._revoke(self.db.get('user_tokens-%s' % user_id, []),
+                            tenant_id=tenant_id)
+
+    def revoke_tokens_for_tenant(self, tenant_id):
+        return self._revoke(self.db.get('tenant_tokens-%s' % tenant_id, []))
+
+    def get_stats(self):
+        """Occupancy and reclamation counters for this store."""
+        return dict(self.db.get('token_stats', {'tokens': 0,
+                                                'expired': 0,
+                                                'evicted': 0}))
+
+    # Private interface
+    def _bucket(self, expires):
+        ts = calendar.timegm(expires.utctimetuple())
+        return int(ts) // CONF.token.expiry_granularity
+
+    def _add_to_bucket(self, token_id, expires):
+        # a token that is already expired, or that was created with an expiry
+        # behind the sweep cursor, goes into the next bucket to be swept so it
+        # is still reclaimed
+        bucket = max(self._bucket(expires), self._cursor())
+        bucket_key = 'token_expiry-%d' % bucket
+        token_ids = self.db.get(bucket_key)
+        if token_ids is None:
+            token_ids = []
+            self.db.sadd('token_expiry_buckets', bucket)
+        token_ids.append(token_id)
+        self.db.set(bucket_key, token_ids)
+
+    def _add_to_owners(self, token_id, token_ref):
+        for key in self._owner_keys(token_ref):
+            token_ids = self.db.get(key, [])
+            token_ids.append(token_id)
+            self.db.set(key, token_ids)
+
+    def _remove_from_owners(self, token_id, token_ref):
+        for key in self._owner_keys(token_ref):
+            token_ids = self.db.get(key, [])
+            token_ids.remove(token_id)
+            if token_ids:
+                self.db.set(key, token_ids)
+            else:
+                self.db.delete(key)
+
+    def _owner_keys(self, token_ref):
+        user_id, tenant_id = self._get_owner(token_ref)
+        keys = []
+        if user_id is not None:
+            keys.append('user_tokens-%s' % user_id)
+        if tenant_id is not None:
+            keys.append('tenant_tokens-%s' % tenant_id)
+        return keys
+
+    def _revoke(self, token_ids, tenant_id=None):
+        stats = self.get_stats()
+        count = 0
+        for token_id in list(token_ids):
+            token_ref = self.db.get('token-%s' % token_id)
+            if token_ref is None:
+                continue
+            if (tenant_id is not None
+                    and self._get_owner(token_ref)[1] != tenant_id):
+                continue
+            self.db.delete('token-%s' % token_id)
+            self._remove_from_owners(token_id, token_ref)
+            count += 1
+        stats['tokens'] -= count
+        self.db.set('token_stats', stats)
+        return count
+
+    def _cursor(self):
+        cursor = self.db.get('token_expiry_cursor')
+        if cursor is None:
+            cursor = self._bucket(datetime.datetime.utcnow())
+            self.db.set('token_expiry_cursor', cursor)
+        return cursor
+
+    def _reclaim_expired(self, stats):
+        """Delete the tokens in every bucket that has completely elapsed."""
+        cursor = self._cursor()
+        now_bucket = self._bucket(datetime.datetime.utcnow())
+        for bucket in xrange(cursor, now_bucket):
+            expired = self._drain_bucket(bucket)
+            stats['expired'] += expired
+            stats['tokens'] -= expired
+        if now_bucket > cursor:
+            self.db.set('token_expiry_cursor', now_bucket)
+
+    def _enforce_limit(self, stats):
+        """Evict the tokens closest to expiry until under `max_tokens`."""
+        max_tokens = CONF.token.max_tokens
+        if not max_tokens or stats['tokens'] <= max_tokens:
+            return
+
+        while stats['tokens'] > max_tokens:
+            buckets = self.db.srange('token_expiry_buckets', limit=1)
+            if not buckets:
+                break
+            evicted = self._drain_bucket(buckets[0],
+                                         limit=stats['tokens'] - max_tokens)
+            stats['evicted'] += evicted
+            stats['tokens'] -= evicted
+
+    def _drain_bucket(self, bucket, limit=None):
+        """Delete tokens filed under `bucket`, returns how many went away.
+
+        Ids of tokens that were deleted or re-created since being filed are
+        simply dropped.
+
+        """
+        bucket_key = 'token_expiry-%d' % bucket
+        token_ids = self.db.get(bucket_key)
+        if not token_ids:
+            if self.db.sismember('token_expiry_buckets', bucket):
+                self.db.srem('token_expiry_buckets', bucket)
+            return 0
+
+        count = 0
+        while token_ids and (limit is None or count < limit):
+            token_id = token_ids.pop()
+            token_ref = self.db.get('token-%s' % token_id)
+            if token_ref is None or token_ref.expires is None:
+                continue
+            if self._bucket(token_ref.expires) > bucket:
+                continue
+            self.db.delete('token-%s' % token_id)
+            self._remove_from_owners(token_id, token_ref)
+            count += 1
+
+        if token_ids:
+            self.db.set(bucket_key, token_ids)
+        else:
+            self.db.delete(bucket_key)
+            self.db.srem('token_expiry_buckets', bucket)
+        return count
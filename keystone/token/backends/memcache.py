@@ -0,0 +1,232 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+import calendar
+import copy
+import datetime
+import hashlib
+import re
+import time
+
+from keystone import config
+from keystone import token
+from keystone.common import memcache
+
+
+CONF = config.CONF
+
+
+# Keys memcached accepts as they are, anything else is hashed.
+SAFE_KEY = re.compile(r'^[\x21-\x7e]{1,250}$')
+
+# Check which tokens in an index still exist every this many additions.
+INDEX_PRUNE_INTERVAL = 64
+
+# Give up updating an index after losing this many check-and-set races.
+INDEX_RETRIES = 20
+
+
+class Token(token.Driver):
+    """Token store shared by several keystone nodes through memcached.
+
+    Tokens are spread over `[memcache] servers` and expire there on their own
+    at their `expires` time.  The ids of each user's and each tenant's tokens
+    are kept in index keys, updated with check-and-set so nodes can add to
+    them concurrently, so tokens can be revoked together.  An index expires
+    with the last of its tokens to expire.
+
+    """
+
+    def __init__(self, client=None):
+        if client is None:
+            client = memcache.Client(
+                    CONF.memcache.servers.split(','),
+                    max_connections=CONF.memcache.max_connections,
+                    timeout=CONF.memcache.socket_timeout)
+        self.client = client
+
+    # Public interface
+    def get_token(self, token_id):
+        token_ref = self.client.get(self._key('token', token_id))
+        if token_ref is None or self._is_expired(token_ref):
+            return None
+        return token_ref
+
+    def get_tokens(self, token_ids):
+        """Get several tokens with one request per server.
+
+        Returns: dict of the tokens that exist, by id.
+
+        """
+        keys = dict((self._key('token', x), x) for x in token_ids)
+        rv = {}
+        for key, token_ref in self.client.get_multi(keys.keys()).iteritems():
+            if not self._is_expired(token_ref):
+                rv[keys[key]] = token_ref
+        return rv
+
+    def create_token(self, token_id, data):
+        data_copy = copy.copy(data)
+        if 'expires' not in data_copy:
+            data_copy['expires'] = token.default_expire_time()
+
+        key = self._key('token', token_id)
+        expiration = self._expiration(data_copy['expires'])
+        if expiration is None:
+            # already expired, only make sure an older copy goes away
+            self.client.delete(key)
+            return copy.copy(data_copy)
+
+        if not self.client.set(key, data_copy, expiration):
+            raise memcache.ServerError('memcached did not store token %s'
+                                       % token_id)
+        for index_key in self._owner_keys(data_copy):
+            self._add_to_index(index_key, token_id, data_copy['expires'])
+        return copy.copy(data_copy)
+
+    def delete_token(self, token_id):
+        if not self.client.delete(self._key('token', token_id)):
+            raise KeyError(token_id)
+
+    def revoke_tokens_for_user(self, user_id, tenant_id=None):
+        index_key = self._key('user_tokens', user_id)
+        token_ids = self._get_index(index_key)
+        if tenant_id is not None:
+            token_ids = [x for x, token_ref
+                         in self.get_tokens(token_ids).iteritems()
+                         if self._get_owner(token_ref)[1] == tenant_id]
+        return self._revoke(index_key, token_ids)
+
+    def revoke_tokens_for_tenant(self, tenant_id):
+        index_key = self._key('tenant_tokens', tenant_id)
+        return self._revoke(index_key, self._get_index(index_key))
+
+    # Private interface
+    def _key(self, prefix, value):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        key = '%s-%s' % (prefix, value)
+        if not SAFE_KEY.match(key):
+            key = '%s-%s' % (prefix, hashlib.sha1(value).hexdigest())
+        return key
+
+    def _expiration(self, expires):
+        """Server-side expiration time for a token expiring at `expires`.
+
+        Returns: the memcached exptime, or None if already expired.
+
+        """
+        if expires is None:
+            return 0
+        delta = expires - datetime.datetime.utcnow()
+        seconds = delta.days * 86400 + delta.seconds
+        if delta.microseconds:
+            seconds += 1
+        if seconds <= 0:
+            return None
+        if seconds > memcache.MAX_RELATIVE_EXPIRATION:
+            return calendar.timegm(expires.utctimetuple())
+        return seconds
+
+    def _owner_keys(self, token_ref):
+        user_id, tenant_id = self._get_owner(token_ref)
+        keys = []
+        if user_id is not None:
+            keys.append(self._key('user_tokens', user_id))
+        if tenant_id is not None:
+            keys.append(self._key('tenant_tokens', tenant_id))
+        return keys
+
+    def _get_index(self, index_key):
+        return self._parse_index(self.client.get(index_key))[1]
+
+    def _parse_index(self, value):
+        """An index is the ids of its tokens, after `@<until>`: the unix time
+        its last token expires, or 0 if one never does.
+
+        Returns: (until, token ids).
+
+        """
+        token_ids = (value or '').split()
+        if token_ids and token_ids[0].startswith('@'):
+            return int(token_ids[0][1:]), token_ids[1:]
+        # written before indexes expired
+        return 0, token_ids
+
+    def _format_index(self, until, token_ids):
+        return ' '.join(['@%d' % until] + token_ids)
+
+    def _until(self, expires):
+        """Returns: the unix time `expires` is at, 0 for never."""
+        if expires is None:
+            return 0
+        until = calendar.timegm(expires.utctimetuple())
+        if expires.microsecond:
+            until += 1
+        return until
+
+    def _index_expiration(self, until):
+        """Returns: the memcached exptime for an index living until `until`."""
+        if not until:
+            return 0
+        seconds = until - int(time.time())
+        if seconds <= 0:
+            # negative expires right away, 0 would be never
+            return -1
+        if seconds > memcache.MAX_RELATIVE_EXPIRATION:
+            return until
+        return seconds
+
+    def _add_to_index(self, index_key, token_id, expires):
+        if isinstance(token_id, unicode):
+            token_id = token_id.encode('utf-8')
+        token_until = self._until(expires)
+        for i in xrange(INDEX_RETRIES):
+            value, cas_id = self.client.gets(index_key)
+            if value is None:
+                if self.client.add(index_key,
+                                   self._format_index(token_until,
+                                                      [token_id]),
+                                   self._index_expiration(token_until)):
+                    return
+                continue
+
+            until, token_ids = self._parse_index(value)
+            if until and token_until:
+                until = max(until, token_until)
+            else:
+                until = 0
+            token_ids.append(token_id)
+            if len(token_ids) % INDEX_PRUNE_INTERVAL == 0:
+                live = self.get_tokens(token_ids)
+                token_ids = [x for x in token_ids if x in live]
+            if self.client.cas(index_key,
+                               self._format_index(until, token_ids),
+                               cas_id, self._index_expiration(until)):
+                return
+        raise memcache.ServerError('Gave up adding token %s to %s after %d '
+                                   'tries' % (token_id, index_key,
+                                              INDEX_RETRIES))
+
+    def _remove_from_index(self, index_key, token_ids):
+        token_ids = set(token_ids)
+        for i in xrange(INDEX_RETRIES):
+            value, cas_id = self.client.gets(index_key)
+            if value is None:
+                return
+            until, remaining = self._parse_index(value)
+            remaining = [x for x in remaining if x not in token_ids]
+            if self.client.cas(index_key,
+                               self._format_index(until, remaining),
+                               cas_id,
+                               self._index_expiration(until)) is not False:
+                return
+        raise memcache.ServerError('Gave up removing tokens from %s after %d '
+                                   'tries' % (index_key, INDEX_RETRIES))
+
+    def _revoke(self, index_key, token_ids):
+        count = 0
+        for token_id in token_ids:
+            if self.client.delete(self._key('token', token_id)):
+                count += 1
+        self._remove_from_index(index_key, token_ids)
+        return count
@@ -0,0 +1,219 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+import copy
+import datetime
+
+import eventlet
+from eventlet import event
+from eventlet import queue
+
+from keystone import config
+from keystone import token
+from keystone.common import logging
+from keystone.common import sql
+from keystone.common.sql import migration
+
+
+CONF = config.CONF
+
+
+class TokenModel(sql.ModelBase, sql.DictBase):
+    __tablename__ = 'token'
+    id = sql.Column(sql.String(64), primary_key=True)
+    expires = sql.Column(sql.DateTime(), index=True)
+    user_id = sql.Column(sql.String(64), index=True)
+    tenant_id = sql.Column(sql.String(64), index=True)
+    _extra = sql.Column('extra', sql.JsonBlob())
+    extra = sql.JsonProperty('_extra')
+
+    @classmethod
+    def from_dict(cls, token_id, token_dict):
+        # shove any non-indexed properties into extra
+        extra = token_dict.copy()
+        extra.pop('id', None)
+        expires = extra.pop('expires', None)
+        user_id = extra.pop('user_id', None)
+        tenant_id = extra.pop('tenant_id', None)
+        return cls(id=token_id,
+                   expires=expires,
+                   user_id=user_id,
+                   tenant_id=tenant_id,
+                   extra=extra)
+
+    def to_dict(self):
+        extra_copy = self.extra.copy()
+        extra_copy['id'] = self.id
+        extra_copy['expires'] = self.expires
+        if self.user_id is not None:
+            extra_copy['user_id'] = self.user_id
+        if self.tenant_id is not None:
+            extra_copy['tenant_id'] = self.tenant_id
+        return extra_copy
+
+
+class GroupCommitter(object):
+    """Inserts rows from many green threads in shared transactions.
+
+    Rows queued within `window` seconds of each other, up to `max_size` of
+    them, are committed together, so a burst of writers pays for one commit
+    (and one fsync) instead of one each.  `add` only returns once its row is
+    committed.
+
+    Relies on green threads only switching while waiting, so queueing a row
+    and checking for a running committer cannot race with it exiting.
+
+    """
+
+    def __init__(self, get_session, window, max_size):
+        self.get_session = get_session
+        self.window = window
+        self.max_size = max_size
+        self.queue = queue.LightQueue()
+        self.thread = None
+
+    def add(self, row):
+        done = event.Event()
+        self.queue.put((row, done))
+        if self.thread is None:
+            self.thread = eventlet.spawn(self._run)
+        done.wait()
+
+    def _run(self):
+        batch = []
+        try:
+            while not self.queue.empty():
+                # give concurrent writers the window to join this batch
+                eventlet.sleep(self.window)
+                batch = []
+                while self.queue.qsize() and len(batch) < self.max_size:
+                    batch.append(self.queue.get_nowait())
+                self._commit(batch)
+        except Exception, e:
+            # writers must not wait forever for a committer that is gone
+            logging.exception('Group committer failed')
+            while self.queue.qsize():
+                batch.append(self.queue.get_nowait())
+            for _row, done in batch:
+                if not done.ready():
+                    done.send_exception(e)
+        finally:
+            self.thread = None
+
+    def _commit(self, batch):
+        try:
+            session = self.get_session()
+            with session.begin():
+                session.add_all([row for row, _done in batch])
+        except Exception, e:
+            if len(batch) == 1:
+                batch[0][1].send_exception(e)
+                return
+            # one bad row should not fail the others, retry them one by one
+            logging.warning('Group commit of %d rows failed: %s',
+                            len(batch), e)
+            for item in batch:
+                self._commit([item])
+            return
+        for _row, done in batch:
+            done.send()
+
+
+class Token(sql.Base, token.Driver):
+    """SQL token store.
+
+    With `[token] group_commit` turned on, tokens created concurrently are
+    inserted in shared transactions, see :class:`GroupCommitter`.
+
+    """
+
+    def __init__(self):
+        super(Token, self).__init__()
+        self.committer = None
+        if CONF.token.group_commit:
+            self.committer = GroupCommitter(
+                    self.get_session,
+                    window=CONF.token.group_commit_window / 1000.0,
+                    max_size=CONF.token.group_commit_size)
+
+    # Internal interface to manage the database
+    def db_sync(self):
+        migration.db_sync()
+
+    # Public interface
+    def get_token(self, token_id):
+        # NOTE: tokens are read from the primary, a lagging replica would
+        #       miss tokens just issued and keep revoked ones valid
+        session = self.get_session()
+        token_ref = session.query(TokenModel).get(token_id)
+        if not token_ref:
+            return
+        token_ref = token_ref.to_dict()
+        if self._is_expired(token_ref):
+            return
+        return token_ref
+
+    def create_token(self, token_id, data):
+        data_copy = copy.copy(data)
+        if 'expires' not in data_copy:
+            data_copy['expires'] = token.default_expire_time()
+
+        token_ref = TokenModel.from_dict(token_id, data_copy)
+        if self.committer is not None:
+            self.committer.add(token_ref)
+            return token_ref.to_dict()
+
+        session = self.get_session()
+        with session.begin():
+            session.add(token_ref)
+            session.flush()
+        return token_ref.to_dict()
+
+    def delete_token(self, token_id):
+        session = self.get_session()
+        token_ref = session.query(TokenModel).get(token_id)
+        if not token_ref:
+            raise KeyError(token_id)
+        with session.begin():
+            session.delete(token_ref)
+            session.flush()
+
+    def revoke_tokens_for_user(self, user_id, tenant_id=None):
+        session = self.get_session()
+        with session.begin():
+            q = session.query(TokenModel).filter_by(user_id=user_id)
+            if tenant_id is not None:
+                q = q.filter_by(tenant_id=tenant_id)
+            return q.delete(synchronize_session=False)
+
+    def revoke_tokens_for_tenant(self, tenant_id):
+        session = self.get_session()
+        with session.begin():
+            return session.query(TokenModel)\
+                          .filter_by(tenant_id=tenant_id)\
+                          .delete(synchronize_session=False)
+
+    def purge_expired_tokens(self, batch_size=1000):
+        """Delete expired tokens, `batch_size` rows at a time.
+
+        Every batch is its own short transaction that deletes by primary key,
+        so the token table is never locked for longer than one batch takes.
+
+        Returns: the number of tokens deleted.
+
+        """
+        session = self.get_session()
+        count = 0
+        while True:
+            now = datetime.datetime.utcnow()
+            with session.begin():
+                token_ids = [x.id for x in
+                             session.query(TokenModel.id)
+                                    .filter(TokenModel.expires <= now)
+                                    .limit(batch_size)]
+                if token_ids:
+                    session.query(TokenModel)\
+                           .filter(TokenModel.id.in_(token_ids))\
+                           .delete(synchronize_session=False)
+            count += len(token_ids)
+            if len(token_ids) < batch_size:
+                return count
@@ -2,13 +2,131 @@
 
 """Main entry point into the Token service."""
 
+import collections
+import copy
+import datetime
+import hashlib
+import hmac
+import os
+import time
+import uuid
+
 from keystone import config
 from keystone.common import manager
+from keystone.common import utils
 
 
 CONF = config.CONF
 
 
+# Authentication responses that may be handed out again, keyed by reuse_key
+# and kept in least recently used order.  See `[token] reuse`.
+REUSABLE = collections.OrderedDict()
+SALT = os.urandom(16)
+
+# Users and tenants that tokens are rehydrated with, keyed by (kind, id) and
+# kept for `[token] identity_cache_ttl` seconds in least recently used order.
+IDENTITY_CACHE = collections.OrderedDict()
+
+
+def default_expire_time():
+    """Determine when a fresh token should expire.
+
+    Expiration time varies based on configuration (see ``[token] expiration``).
+
+    Returns: a naive utc datetime.datetime object.
+
+    """
+    expire_delta = datetime.timedelta(seconds=CONF.token.expiration)
+    return datetime.datetime.utcnow() + expire_delta
+
+
+def new_token_id(user_ref, tenant_ref, roles_ref, expires):
+    """Generate the id for a new token.
+
+    With `[token] format = signed` the id is a signed description of the
+    token (see :class:`keystone.common.utils.TokenSigner`) that services can
+    verify without calling keystone, otherwise it is a random uuid.
+
+    """
+    if CONF.token.format != 'signed':
+        return uuid.uuid4().hex
+
+    payload = {'nonce': uuid.uuid4().hex,
+               'user': {'id': user_ref['id'], 'name': user_ref['name']},
+               'roles': [{'id': x['id'], 'name': x['name']}
+                         for x in roles_ref],
+               'expires': expires and utils.isotime(expires) or None}
+    if tenant_ref:
+        payload['tenant'] = {'id': tenant_ref['id'],
+                             'name': tenant_ref['name']}
+    return utils.TokenSigner(CONF.token.signing_key).sign(payload)
+
+
+def is_signed(token_id):
+    """Without a `[token] signing_key` no token is taken to be signed."""
+    return (bool(CONF.token.signing_key)
+            and utils.TokenSigner.is_signed(token_id))
+
+
+def verify_signed(token_id):
+    """Returns: the payload of a signed token id, or None if it is invalid."""
+    if not CONF.token.signing_key:
+        return None
+    return utils.TokenSigner(CONF.token.signing_key).verify(token_id)
+
+
+def unique_id(token_id):
+    """Key a token is stored under.
+
+    Signed token ids are too long to use as keys so they are stored under
+    their hash instead.
+
+    """
+    if not is_signed(token_id):
+        return token_id
+    if isinstance(token_id, unicode):
+        token_id = token_id.encode('utf-8')
+    return hashlib.sha1(token_id).hexdigest()
+
+
+def compact(data):
+    """Reduce token data to the record kept by the backend.
+
+    The user and tenant are only referenced by id and the metadata by its
+    role ids, the Manager looks the rest up again when the token is read.
+
+    """
+    record = dict(data)
+    if 'user' in record:
+        record['user_id'] = (record.pop('user') or {}).get('id')
+    if 'tenant' in record:
+        record['tenant_id'] = (record.pop('tenant') or {}).get('id')
+    if 'metadata' in record:
+        metadata_ref = dict(record.pop('metadata') or {})
+        record['roles'] = list(metadata_ref.pop('roles', []))
+        if metadata_ref:
+            record['metadata'] = metadata_ref
+    return record
+
+
+def reuse_key(user_id, tenant_id, credential):
+    """Fingerprint an authentication so its token can be handed out again.
+
+    Only an HMAC of `credential`, salted per process, is kept, but it ensures
+    a token is only reused for the exact credentials that were used to get it.
+
+    """
+    parts = []
+    for part in (user_id, tenant_id, credential):
+        part = part or u''
+        if isinstance(part, str):
+            part = part.decode('utf-8')
+        parts.append(part)
+    return hmac.new(SALT, u'\0'.join(parts).encode('utf-8'),
+                    hashlib.sha256).hexdigest()
+
+
 class Manager(manager.Manager):
     """Default pivot point for the Token backend.
 
@@ -19,3 +137,153 @@ class Manager(manager.Manager):
 
     def __init__(self):
         super(Manager, self).__init__(CONF.token.driver)
+        # imported late as the identity controllers depend on this module
+        from keystone import identity
+        self.identity_api = identity.Manager()
+
+    def get_token(self, context, token_id):
+        record = self.driver.get_token(unique_id(token_id))
+        if record is None:
+            return None
+        token_ref = self._rehydrate(context, record)
+        if token_ref is not None:
+            # the backend may only know the hash it is stored under
+            token_ref['id'] = token_id
+        return token_ref
+
+    def create_token(self, context, token_id, data):
+        record = self.driver.create_token(unique_id(token_id), compact(data))
+        token_ref = copy.copy(data)
+        token_ref['expires'] = record['expires']
+        return token_ref
+
+    def delete_token(self, context, token_id):
+        return self.driver.delete_token(unique_id(token_id))
+
+    def get_reusable(self, context, key):
+        """Get the response previously given for an identical authentication.
+
+        Only returned while the token in it is still valid, so expired and
+        revoked tokens are never handed out again.
+
+        Returns: the response or None.
+
+        """
+        entry = REUSABLE.pop(key, None)
+        if entry is None:
+            return None
+        token_id, response = entry
+        if self.get_token(context, token_id) is None:
+            return None
+        REUSABLE[key] = entry
+        return copy.deepcopy(response)
+
+    def set_reusable(self, context, key, token_id, response):
+        """Remember the response for an authentication under `key`."""
+        REUSABLE.pop(key, None)
+        REUSABLE[key] = (token_id, copy.deepcopy(response))
+        while len(REUSABLE) > CONF.token.reuse_cache_size:
+            REUSABLE.popitem(last=False)
+
+    def _rehydrate(self, context, record):
+        """Rebuild a full token_ref from the record made by `compact`.
+
+        Returns: token_ref, or None if its user or tenant no longer exists.
+
+        """
+        token_ref = dict(record)
+        if 'user_id' in token_ref:
+            user_id = token_ref.pop('user_id')
+            token_ref['user'] = self._get_identity(context, 'user', user_id)
+            if user_id is not None and token_ref['user'] is None:
+                return None
+        if 'tenant_id' in token_ref:
+            tenant_id = token_ref.pop('tenant_id')
+            token_ref['tenant'] = self._get_identity(context, 'tenant',
+                                                     tenant_id)
+            if tenant_id is not None and token_ref['tenant'] is None:
+                return None
+        if 'roles' in token_ref:
+            metadata_ref = dict(token_ref.pop('metadata', None) or {})
+            metadata_ref['roles'] = list(token_ref.pop('roles'))
+            token_ref['metadata'] = metadata_ref
+        return token_ref
+
+    def _get_identity(self, context, kind, ref_id):
+        """Cached `get_user` or `get_tenant` from the identity api."""
+        if ref_id is None:
+            return None
+
+        key = (kind, ref_id)
+        now = time.time()
+        entry = IDENTITY_CACHE.pop(key, None)
+        if entry is None or entry[0] <= now:
+            ref = getattr(self.identity_api, 'get_%s' % kind)(context, ref_id)
+            if ref is not None:
+                # tokens never show it, no need to keep it around
+                ref = dict(ref)
+                ref.pop('password', None)
+            entry = (now + CONF.token.identity_cache_ttl, ref)
+        IDENTITY_CACHE[key] = entry
+        while len(IDENTITY_CACHE) > CONF.token.identity_cache_size:
+            IDENTITY_CACHE.popitem(last=False)
+        return entry[1] is not None and dict(entry[1]) or None
+
+
+class Driver(object):
+    """Interface description for a Token driver."""
+
+    def get_token(self, token_id):
+        """Get a token by id.
+
+        Expired tokens are treated as if they did not exist.
+
+        Returns: token_ref or None.
+
+        """
+        raise NotImplementedError()
+
+    def create_token(self, token_id, data):
+        """Create a token by id and data.
+
+        The Manager hands drivers compact records (see `compact`) that refer
+        to their owner by `user_id` and `tenant_id`.
+
+        If `data` does not contain an `expires` key the token is given the
+        default expiration time, an `expires` of None never expires.
+
+        Returns: token_ref.
+
+        """
+        raise NotImplementedError()
+
+    def delete_token(self, token_id):
+        """Delete a token by id."""
+        raise NotImplementedError()
+
+    def revoke_tokens_for_user(self, user_id, tenant_id=None):
+        """Delete every token issued to a user.
+
+        If `tenant_id` is given only the tokens scoped to that tenant are
+        deleted.  Runs in time proportional to the user's tokens.
+
+        Returns: the number of tokens deleted.
+
+        """
+        raise NotImplementedError()
+
+    def revoke_tokens_for_tenant(self, tenant_id):
+        """Delete every token scoped to a tenant.
+
+        Returns: the number of tokens deleted.
+
+        """
+        raise NotImplementedError()
+
+    def _get_owner(self, token_ref):
+        """Returns: (user_id, tenant_id) a token was issued for."""
+        return token_ref.get('user_id'), token_ref.get('tenant_id')
+
+    def _is_expired(self, token_ref):
+        expires = token_ref.get('expires')
+        return expires is not None and expires <= datetime.datetime.utcnow()
@@ -1,3 +1,7 @@
+import datetime
+import uuid
+
+
 class IdentityTests(object):
   def test_authenticate_bad_user(self):
     self.assertRaises(AssertionError,
@@ -37,6 +41,55 @@ class IdentityTests(object):
     self.assertDictEquals(tenant_ref, self.tenant_bar)
     self.assertDictEquals(metadata_ref, self.metadata_foobar)
 
+  def test_authenticate_by_name(self):
+    user_ref, tenant_ref, metadata_ref = self.identity_api.authenticate(
+        user_name=self.user_foo['name'],
+        tenant_name=self.tenant_bar['name'],
+        password=self.user_foo['password'])
+    self.assertDictEquals(user_ref, self.user_foo)
+    self.assertDictEquals(tenant_ref, self.tenant_bar)
+    self.assertDictEquals(metadata_ref, self.metadata_foobar)
+
+  def test_authenticate_not_a_member(self):
+    self.assertRaises(AssertionError,
+        self.identity_api.authenticate,
+        user_id=self.user_foo['id'],
+        tenant_id=self.tenant_baz['id'],
+        password=self.user_foo['password'])
+
+  def test_get_auth_context(self):
+    user_ref, tenant_ref, is_member, metadata_ref = \
+        self.identity_api.get_auth_context(user_id=self.user_foo['id'],
+                                           tenant_name=self.tenant_bar['name'])
+    self.assertDictEquals(user_ref, self.user_foo)
+    self.assertDictEquals(tenant_ref, self.tenant_bar)
+    self.assert_(is_member)
+    self.assertDictEquals(metadata_ref, self.metadata_foobar)
+
+  def test_get_auth_context_no_tenant(self):
+    user_ref, tenant_ref, is_member, metadata_ref = \
+        self.identity_api.get_auth_context(user_name=self.user_foo['name'])
+    self.assertDictEquals(user_ref, self.user_foo)
+    self.assert_(tenant_ref is None)
+    self.assert_(not is_member)
+    self.assertEquals(metadata_ref, {})
+
+  def test_get_auth_context_not_a_member(self):
+    user_ref, tenant_ref, is_member, metadata_ref = \
+        self.identity_api.get_auth_context(user_id=self.user_foo['id'],
+                                           tenant_id=self.tenant_baz['id'])
+    self.assertDictEquals(tenant_ref, self.tenant_baz)
+    self.assert_(not is_member)
+    self.assertEquals(metadata_ref, {})
+
+  def test_get_auth_context_bad_user(self):
+    user_ref, tenant_ref, is_member, metadata_ref = \
+        self.identity_api.get_auth_context(
+            user_id=self.user_foo['id'] + 'WRONG',
+            tenant_id=self.tenant_bar['id'])
+    self.assert_(user_ref is None)
+    self.assert_(not is_member)
+
   def test_get_tenant_bad_tenant(self):
     tenant_ref = self.identity_api.get_tenant(
         tenant_id=self.tenant_bar['id'] + 'WRONG')
@@ -46,6 +99,20 @@ class IdentityTests(object):
     tenant_ref = self.identity_api.get_tenant(tenant_id=self.tenant_bar['id'])
     self.assertDictEquals(tenant_ref, self.tenant_bar)
 
+  def test_get_tenants(self):
+    tenant_refs = self.identity_api.get_tenants(
+        [self.tenant_baz['id'], 'missing', self.tenant_bar['id']])
+    self.assertEquals(len(tenant_refs), 2)
+    self.assertDictEquals(tenant_refs[0], self.tenant_baz)
+    self.assertDictEquals(tenant_refs[1], self.tenant_bar)
+    self.assertEquals(self.identity_api.get_tenants([]), [])
+
+  def test_get_many_tenants(self):
+    tenant_ids = ['missing-%d' % i for i in range(1200)]
+    tenant_ids.append(self.tenant_bar['id'])
+    tenant_refs = self.identity_api.get_tenants(tenant_ids)
+    self.assertEquals([x['id'] for x in tenant_refs], [self.tenant_bar['id']])
+
   def test_get_tenant_by_name_bad_tenant(self):
     tenant_ref = self.identity_api.get_tenant(
         tenant_id=self.tenant_bar['name'] + 'WRONG')
@@ -65,6 +132,22 @@ class IdentityTests(object):
     user_ref = self.identity_api.get_user(user_id=self.user_foo['id'])
     self.assertDictEquals(user_ref, self.user_foo)
 
+  def test_rename_user(self):
+    user_ref = dict(self.user_foo, name='renamed')
+    self.identity_api.update_user(self.user_foo['id'], user_ref)
+    self.assert_(self.identity_api.get_user_by_name('FOO') is None)
+    user_ref = self.identity_api.get_user_by_name('renamed')
+    self.assertEquals(user_ref['id'], self.user_foo['id'])
+    self.assertEquals(self.identity_api.get_user(self.user_foo['id'])['name'],
+                      'renamed')
+
+  def test_rename_tenant(self):
+    tenant_ref = dict(self.tenant_bar, name='renamed')
+    self.identity_api.update_tenant(self.tenant_bar['id'], tenant_ref)
+    self.assert_(self.identity_api.get_tenant_by_name('BAR') is None)
+    tenant_ref = self.identity_api.get_tenant_by_name('renamed')
+    self.assertEquals(tenant_ref['id'], self.tenant_bar['id'])
+
   def test_get_metadata_bad_user(self):
     metadata_ref = self.identity_api.get_metadata(
         user_id=self.user_foo['id'] + 'WRONG',
@@ -88,4 +171,133 @@ class IdentityTests(object):
         role_id=self.role_keystone_admin['id'])
     self.assertDictEquals(role_ref, self.role_keystone_admin)
 
+  def test_get_roles(self):
+    role_refs = self.identity_api.get_roles(
+        [self.role_useless['id'], 'missing', self.role_keystone_admin['id']])
+    self.assertEquals(len(role_refs), 2)
+    self.assertDictEquals(role_refs[0], self.role_useless)
+    self.assertDictEquals(role_refs[1], self.role_keystone_admin)
+    self.assertEquals(self.identity_api.get_roles([]), [])
+
+  def test_list_users(self):
+    user_ids = [x['id'] for x in self.identity_api.list_users()]
+    self.assertEquals(user_ids, [self.user_foo['id'], self.user_two['id']])
+
+    user_refs = self.identity_api.list_users(limit=1)
+    self.assertEquals([x['id'] for x in user_refs], [self.user_foo['id']])
+    user_refs = self.identity_api.list_users(marker=self.user_foo['id'])
+    self.assertEquals([x['id'] for x in user_refs], [self.user_two['id']])
+    user_refs = self.identity_api.list_users(marker=self.user_two['id'])
+    self.assertEquals(user_refs, [])
+
+  def test_list_users_reverse(self):
+    user_refs = self.identity_api.list_users(marker=self.user_two['id'],
+                                             reverse=True)
+    self.assertEquals([x['id'] for x in user_refs], [self.user_foo['id']])
+    user_refs = self.identity_api.list_users(reverse=True, limit=1)
+    self.assertEquals([x['id'] for x in user_refs], [self.user_two['id']])
+
+  def test_list_tenants(self):
+    tenant_refs = self.identity_api.list_tenants()
+    self.assertEquals([x['id'] for x in tenant_refs],
+                      [self.tenant_bar['id'], self.tenant_baz['id']])
+    tenant_refs = self.identity_api.list_tenants(
+        marker=self.tenant_bar['id'], limit=1)
+    self.assertEquals([x['id'] for x in tenant_refs],
+                      [self.tenant_baz['id']])
+
+  def test_get_tenant_users(self):
+    self.identity_api.add_user_to_tenant(self.tenant_bar['id'],
+                                         self.user_two['id'])
+    user_refs = self.identity_api.get_tenant_users(self.tenant_bar['id'])
+    self.assertEquals([x['id'] for x in user_refs],
+                      [self.user_foo['id'], self.user_two['id']])
+    user_refs = self.identity_api.get_tenant_users(
+        self.tenant_bar['id'], marker=self.user_foo['id'], limit=1)
+    self.assertEquals([x['id'] for x in user_refs], [self.user_two['id']])
+
+    self.identity_api.remove_user_from_tenant(self.tenant_bar['id'],
+                                              self.user_foo['id'])
+    user_refs = self.identity_api.get_tenant_users(self.tenant_bar['id'])
+    self.assertEquals([x['id'] for x in user_refs], [self.user_two['id']])
+    self.assertEquals(self.identity_api.get_tenant_users('missing'), [])
+
+  def test_list_roles(self):
+    role_refs = self.identity_api.list_roles(limit=1)
+    self.assertEquals([x['id'] for x in role_refs],
+                      [self.role_keystone_admin['id']])
+    role_refs = self.identity_api.list_roles(
+        marker=self.role_keystone_admin['id'])
+    self.assertEquals([x['id'] for x in role_refs],
+                      [self.role_useless['id']])
+
+
+
+
+class TokenTests(object):
+  def test_token_crud(self):
+    token_id = uuid.uuid4().hex
+    data = {'id': token_id,
+            'a': 'b'}
+    data_ref = self.token_api.create_token(token_id, data)
+    expires = data_ref.pop('expires')
+    self.assertTrue(isinstance(expires, datetime.datetime))
+    self.assertDictEquals(data_ref, data)
+
+    new_data_ref = self.token_api.get_token(token_id)
+    expires = new_data_ref.pop('expires')
+    self.assertTrue(isinstance(expires, datetime.datetime))
+    self.assertEquals(new_data_ref, data)
+
+    self.token_api.delete_token(token_id)
+    deleted_data_ref = self.token_api.get_token(token_id)
+    self.assert_(deleted_data_ref is None)
+
+  def test_expired_token(self):
+    token_id = uuid.uuid4().hex
+    expire_time = datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
+    data = {'id': token_id, 'a': 'b', 'expires': expire_time}
+    data_ref = self.token_api.create_token(token_id, data)
+    self.assertDictEquals(data_ref, data)
+    self.assert_(self.token_api.get_token(token_id) is None)
+
+  def test_null_expires_token(self):
+    token_id = uuid.uuid4().hex
+    data = {'id': token_id, 'a': 'b', 'expires': None}
+    data_ref = self.token_api.create_token(token_id, data)
+    self.assertDictEquals(data_ref, data)
+    new_data_ref = self.token_api.get_token(token_id)
+    self.assertEqual(data_ref, new_data_ref)
+
+  def _create_token_for(self, user_id, tenant_id=None):
+    token_id = uuid.uuid4().hex
+    data = {'id': token_id, 'user_id': user_id, 'tenant_id': tenant_id}
+    self.token_api.create_token(token_id, data)
+    return token_id
+
+  def test_revoke_tokens_for_user(self):
+    unscoped_id = self._create_token_for('foo')
+    bar_id = self._create_token_for('foo', 'bar')
+    baz_id = self._create_token_for('foo', 'baz')
+    other_id = self._create_token_for('two', 'bar')
+
+    self.assertEquals(
+        self.token_api.revoke_tokens_for_user('foo', tenant_id='bar'), 1)
+    self.assert_(self.token_api.get_token(bar_id) is None)
+    self.assert_(self.token_api.get_token(baz_id) is not None)
+
+    self.assertEquals(self.token_api.revoke_tokens_for_user('foo'), 2)
+    self.assert_(self.token_api.get_token(unscoped_id) is None)
+    self.assert_(self.token_api.get_token(baz_id) is None)
+    self.assert_(self.token_api.get_token(other_id) is not None)
+    self.assertEquals(self.token_api.revoke_tokens_for_user('foo'), 0)
+
+  def test_revoke_tokens_for_tenant(self):
+    foo_id = self._create_token_for('foo', 'bar')
+    two_id = self._create_token_for('two', 'bar')
+    other_id = self._create_token_for('two', 'baz')
 
+    self.assertEquals(self.token_api.revoke_tokens_for_tenant('bar'), 2)
+    self.assert_(self.token_api.get_token(foo_id) is None)
+    self.assert_(self.token_api.get_token(two_id) is None)
+    self.assert_(self.token_api.get_token(other_id) is not None)
@@ -1,39 +1,166 @@
+import datetime
+import time
 import uuid
 
+from keystone import config
 from keystone import test
 from keystone.identity.backends import kvs as identity_kvs
 from keystone.token.backends import kvs as token_kvs
 from keystone.catalog.backends import kvs as catalog_kvs
+from keystone.contrib.ec2.backends import kvs as ec2_kvs
 
 import test_backend
 import default_fixtures
 
 
+CONF = config.CONF
+
+
 class KvsIdentity(test.TestCase, test_backend.IdentityTests):
   def setUp(self):
     super(KvsIdentity, self).setUp()
     self.identity_api = identity_kvs.Identity(db={})
     self.load_fixtures(default_fixtures)
 
+  def test_names_point_at_ids(self):
+    db = self.identity_api.db
+    self.assertEquals(db.get('user_name-%s' % self.user_foo['name']),
+                      self.user_foo['id'])
+    self.assertEquals(db.get('tenant_name-%s' % self.tenant_bar['name']),
+                      self.tenant_bar['id'])
+
+    self.identity_api.delete_user(self.user_foo['id'])
+    self.assert_('user_name-%s' % self.user_foo['name'] not in db)
+    self.assert_(self.identity_api.get_user_by_name('FOO') is None)
+
+  def test_renamed_name_is_not_taken_back(self):
+    # two changes to foo in a row, the second reusing its first name for
+    # another user
+    self.identity_api.update_user(self.user_foo['id'],
+                                  dict(self.user_foo, name='renamed'))
+    self.identity_api.update_user(self.user_two['id'],
+                                  dict(self.user_two, name='FOO'))
+    self.identity_api.delete_user(self.user_foo['id'])
+    self.assertEquals(self.identity_api.get_user_by_name('FOO')['id'],
+                      self.user_two['id'])
+
+  def test_names_holding_records(self):
+    db = self.identity_api.db
+    db.set('user_name-%s' % self.user_foo['name'], dict(self.user_foo))
+    user_ref = self.identity_api.get_user_by_name(self.user_foo['name'])
+    self.assertEquals(user_ref['id'], self.user_foo['id'])
+
+    self.identity_api.update_user(self.user_foo['id'], dict(self.user_foo))
+    self.assertEquals(db.get('user_name-%s' % self.user_foo['name']),
+                      self.user_foo['id'])
 
-class KvsToken(test.TestCase):
+  def test_tenant_users_set_lives_with_the_tenant(self):
+    db = self.identity_api.db
+    key = 'tenant_users-%s' % self.tenant_baz['id']
+    self.identity_api.create_tenant('new', {'id': 'new', 'name': 'NEW'})
+    self.assertEquals(db.get('tenant_users-new'), set())
+
+    # reads of an unknown tenant do not write anything
+    self.assertEquals(self.identity_api.get_tenant_users('unknown'), [])
+    self.assert_('tenant_users-unknown' not in db)
+
+    self.identity_api.create_tenant(self.tenant_baz['id'], self.tenant_baz)
+    self.assertEquals(db.get(key), set([self.user_two['id']]))
+    self.identity_api.delete_tenant(self.tenant_baz['id'])
+    self.assert_(key not in db)
+
+
+class KvsToken(test.TestCase, test_backend.TokenTests):
   def setUp(self):
     super(KvsToken, self).setUp()
+    CONF(config_files=[test.etcdir('keystone.conf'),
+                       test.testsdir('test_overrides.conf')])
     self.token_api = token_kvs.Token(db={})
 
-  def test_token_crud(self):
+  def test_expired_tokens_are_reclaimed(self):
+    self.opt_in_group('token', expiry_granularity=1)
+    expire_time = datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
     token_id = uuid.uuid4().hex
-    data = {'id': token_id,
-            'a': 'b'}
-    data_ref = self.token_api.create_token(token_id, data)
-    self.assertDictEquals(data_ref, data)
+    self.token_api.create_token(token_id, {'id': token_id,
+                                           'expires': expire_time})
+    self.assertEquals(self.token_api.get_stats()['tokens'], 1)
+
+    time.sleep(1.1)
+    other_id = uuid.uuid4().hex
+    self.token_api.create_token(other_id, {'id': other_id})
+    self.assert_(self.token_api.db.get('token-%s' % token_id) is None)
+    stats = self.token_api.get_stats()
+    self.assertEquals(stats['tokens'], 1)
+    self.assertEquals(stats['expired'], 1)
+
+  def test_max_tokens_evicts_closest_to_expiry(self):
+    self.opt_in_group('token', max_tokens=2)
+    now = datetime.datetime.utcnow()
+    token_ids = []
+    for hours in (3, 1, 2):
+      token_id = uuid.uuid4().hex
+      token_ids.append(token_id)
+      self.token_api.create_token(
+          token_id,
+          {'id': token_id, 'expires': now + datetime.timedelta(hours=hours)})
 
-    new_data_ref = self.token_api.get_token(token_id)
-    self.assertEquals(new_data_ref, data)
+    self.assert_(self.token_api.get_token(token_ids[1]) is None)
+    self.assert_(self.token_api.get_token(token_ids[0]) is not None)
+    self.assert_(self.token_api.get_token(token_ids[2]) is not None)
+    stats = self.token_api.get_stats()
+    self.assertEquals(stats['tokens'], 2)
+    self.assertEquals(stats['evicted'], 1)
 
-    self.token_api.delete_token(token_id)
-    deleted_data_ref = self.token_api.get_token(token_id)
-    self.assert_(deleted_data_ref is None)
+  def test_eviction_skips_empty_buckets(self):
+    self.opt_in_group('token', max_tokens=1)
+    now = datetime.datetime.utcnow()
+    far_id = uuid.uuid4().hex
+    self.token_api.create_token(
+        far_id, {'id': far_id, 'expires': now + datetime.timedelta(30)})
+
+    drained = []
+    drain_bucket = self.token_api._drain_bucket
+    def _drain_bucket(bucket, limit=None):
+      drained.append(bucket)
+      return drain_bucket(bucket, limit=limit)
+    self.token_api._drain_bucket = _drain_bucket
+
+    # only the bucket of the token closest to expiry is visited
+    token_id = uuid.uuid4().hex
+    self.token_api.create_token(
+        token_id, {'id': token_id, 'expires': now + datetime.timedelta(31)})
+    self.assertEquals(len(drained), 1)
+    self.assert_(self.token_api.get_token(far_id) is None)
+    self.assert_(self.token_api.get_token(token_id) is not None)
+
+  def test_token_records_share_role_ids(self):
+    token_ids = []
+    for i in range(2):
+      token_id = uuid.uuid4().hex
+      token_ids.append(token_id)
+      self.token_api.create_token(
+          token_id,
+          {'id': token_id, 'user_id': 'foo', 'roles': [''.join(['ad', 'min'])]})
+
+    first, second = [self.token_api.db.get('token-%s' % x) for x in token_ids]
+    self.assert_(isinstance(first, token_kvs.TokenRecord))
+    self.assert_(first.roles[0] is second.roles[0])
+    self.assertEquals(self.token_api.get_token(token_ids[0])['roles'],
+                      ['admin'])
+
+  def test_shared_role_ids_are_bounded(self):
+    max_role_ids = token_kvs.MAX_ROLE_IDS
+    token_kvs.MAX_ROLE_IDS = len(token_kvs.ROLE_IDS) + 1
+    try:
+      for i in range(3):
+        token_id = uuid.uuid4().hex
+        self.token_api.create_token(
+            token_id, {'id': token_id, 'roles': [uuid.uuid4().hex]})
+        self.assertEquals(self.token_api.get_token(token_id)['id'],
+                          token_id)
+      self.assertEquals(len(token_kvs.ROLE_IDS), token_kvs.MAX_ROLE_IDS)
+    finally:
+      token_kvs.MAX_ROLE_IDS = max_role_ids
 
 
 class KvsCatalog(test.TestCase):
@@ -58,3 +185,22 @@ class KvsCatalog(test.TestCase):
   def test_get_catalog(self):
     catalog_ref = self.catalog_api.get_catalog('foo', 'bar')
     self.assertDictEquals(catalog_ref, self.catalog_foobar)
+
+
+class KvsEc2(test.TestCase):
+  def setUp(self):
+    super(KvsEc2, self).setUp()
+    self.ec2_api = ec2_kvs.Ec2(db={})
+
+  def test_credentials_listed_together_are_split_by_user(self):
+    db = self.ec2_api.db
+    for access, user_id in (('a', 'foo'), ('b', 'two'), ('c', 'foo')):
+      db.set('credential-%s' % access, {'access': access,
+                                        'user_id': user_id})
+    db.set('credential_list', ['a', 'b', 'c'])
+
+    self.assertEquals([x['access'] for x in
+                       self.ec2_api.list_credentials('foo')], ['a', 'c'])
+    self.assert_('credential_list' not in db)
+    self.ec2_api.delete_credential('b')
+    self.assertEquals(self.ec2_api.list_credentials('two'), [])
@@ -0,0 +1,231 @@
+import datetime
+import itertools
+import time
+import uuid
+
+import eventlet
+
+from keystone import config
+from keystone import test
+from keystone.common import memcache
+from keystone.token.backends import memcache as token_memcache
+
+import test_backend
+
+
+CONF = config.CONF
+
+
+class MemcacheStandIn(object):
+  """Just enough of a memcached server for the tests, on a green thread."""
+
+  def __init__(self):
+    # key -> (flags, expires at, cas id, data)
+    self.data = {}
+    self.commands = []
+    # answer storage commands with this instead of storing, if set
+    self.store_response = None
+    self.cas_ids = itertools.count(1)
+    self.sock = eventlet.listen(('127.0.0.1', 0))
+    self.server = '127.0.0.1:%d' % self.sock.getsockname()[1]
+    self.thread = eventlet.spawn(self._serve)
+
+  def stop(self):
+    self.thread.kill()
+    self.sock.close()
+
+  def _serve(self):
+    while True:
+      conn, _addr = self.sock.accept()
+      eventlet.spawn(self._handle, conn)
+
+  def _handle(self, conn):
+    f = conn.makefile('rw')
+    while True:
+      line = f.readline()
+      if not line:
+        return
+      parts = line.split()
+      self.commands.append(parts[0])
+      if parts[0] in ('get', 'gets'):
+        for key in parts[1:]:
+          item = self._get(key)
+          if item is None:
+            continue
+          flags, _expires, cas_id, data = item
+          header = 'VALUE %s %d %d' % (key, flags, len(data))
+          if parts[0] == 'gets':
+            header += ' %d' % cas_id
+          f.write('%s\r\n%s\r\n' % (header, data))
+        f.write('END\r\n')
+      elif parts[0] == 'delete':
+        existed = self._get(parts[1]) is not None
+        self.data.pop(parts[1], None)
+        f.write(existed and 'DELETED\r\n' or 'NOT_FOUND\r\n')
+      else:
+        key, flags, exptime, size = parts[1:5]
+        data = f.read(int(size) + 2)[:-2]
+        f.write('%s\r\n' % self._store(parts[0], key, int(flags),
+                                       int(exptime), data, parts[5:]))
+      f.flush()
+
+  def _get(self, key):
+    item = self.data.get(key)
+    if item is not None and item[1] and item[1] <= time.time():
+      del self.data[key]
+      return None
+    return item
+
+  def _store(self, command, key, flags, exptime, data, cas_id):
+    if self.store_response:
+      return self.store_response
+    item = self._get(key)
+    if command == 'add' and item is not None:
+      return 'NOT_STORED'
+    if command == 'cas':
+      if item is None:
+        return 'NOT_FOUND'
+      if item[2] != int(cas_id[0]):
+        return 'EXISTS'
+    if exptime > memcache.MAX_RELATIVE_EXPIRATION:
+      expires = exptime
+    elif exptime < 0:
+      expires = time.time() - 1
+    elif exptime:
+      expires = time.time() + exptime
+    else:
+      expires = 0
+    self.data[key] = (flags, expires, self.cas_ids.next(), data)
+    return 'STORED'
+
+
+class MemcacheClient(test.TestCase):
+  def setUp(self):
+    super(MemcacheClient, self).setUp()
+    self.servers = [MemcacheStandIn(), MemcacheStandIn()]
+    self.client = memcache.Client([x.server for x in self.servers])
+
+  def tearDown(self):
+    for server in self.servers:
+      server.stop()
+    super(MemcacheClient, self).tearDown()
+
+  def test_keys_are_spread_over_servers(self):
+    keys = ['key-%d' % i for i in range(200)]
+    for key in keys:
+      self.client.set(key, {'key': key})
+    for server in self.servers:
+      self.assert_(len(server.data) > 50)
+
+  def test_removing_a_server_only_moves_its_keys(self):
+    ring = memcache.HashRing(['a:11211', 'b:11211', 'c:11211'])
+    smaller = memcache.HashRing(['a:11211', 'b:11211'])
+    moved = 0
+    for i in range(1000):
+      key = 'key-%d' % i
+      node = ring.get_node(key)
+      if node == 'c:11211':
+        moved += 1
+      else:
+        self.assertEquals(smaller.get_node(key), node)
+    self.assert_(200 < moved < 500)
+
+  def test_get_multi_uses_one_request_per_server(self):
+    keys = ['key-%d' % i for i in range(20)]
+    for key in keys:
+      self.client.set(key, key)
+    for server in self.servers:
+      server.commands = []
+
+    values = self.client.get_multi(keys + ['missing'])
+    self.assertEquals(values, dict((x, x) for x in keys))
+    self.assertEquals(sum(len(x.commands) for x in self.servers), 2)
+
+  def test_connections_are_reused(self):
+    for i in range(10):
+      self.client.set('key', i)
+      self.assertEquals(self.client.get('key'), i)
+    pool = self.client.pools[self.client.ring.get_node('key')]
+    self.assertEquals(pool.current_size, 1)
+
+  def test_cas(self):
+    self.assert_(self.client.add('key', 'a'))
+    self.assert_(not self.client.add('key', 'b'))
+    value, cas_id = self.client.gets('key')
+    self.assertEquals(value, 'a')
+    self.client.set('key', 'c')
+    self.assertEquals(self.client.cas('key', 'd', cas_id), False)
+    self.client.delete('key')
+    self.assert_(self.client.cas('key', 'd', cas_id) is None)
+
+  def test_server_errors_are_raised(self):
+    for server in self.servers:
+      server.store_response = 'SERVER_ERROR object too large for cache'
+    self.assertRaises(memcache.ServerError, self.client.set, 'key', 'a')
+    self.assertRaises(memcache.ServerError, self.client.add, 'key', 'a')
+
+
+class MemcacheToken(test.TestCase, test_backend.TokenTests):
+  def setUp(self):
+    super(MemcacheToken, self).setUp()
+    CONF(config_files=[test.etcdir('keystone.conf'),
+                       test.testsdir('test_overrides.conf')])
+    self.servers = [MemcacheStandIn(), MemcacheStandIn()]
+    self.opt_in_group('memcache',
+                      servers=','.join(x.server for x in self.servers))
+    self.token_api = token_memcache.Token()
+
+  def tearDown(self):
+    for server in self.servers:
+      server.stop()
+    super(MemcacheToken, self).tearDown()
+
+  def test_expiry_is_set_on_the_server(self):
+    token_id = uuid.uuid4().hex
+    expires = datetime.datetime.utcnow() + datetime.timedelta(minutes=5)
+    self.token_api.create_token(token_id, {'id': token_id,
+                                           'expires': expires})
+    item = [x.data['token-%s' % token_id] for x in self.servers
+            if 'token-%s' % token_id in x.data][0]
+    self.assert_(abs(item[1] - (time.time() + 300)) < 5)
+
+  def test_get_tokens(self):
+    token_ids = [uuid.uuid4().hex for i in range(5)]
+    for token_id in token_ids:
+      self.token_api.create_token(token_id, {'id': token_id})
+    self.token_api.delete_token(token_ids[0])
+
+    token_refs = self.token_api.get_tokens(token_ids)
+    self.assertEquals(sorted(token_refs), sorted(token_ids[1:]))
+
+  def _index(self, key):
+    return [x.data[key] for x in self.servers if key in x.data][0]
+
+  def test_index_expires_with_its_last_token(self):
+    now = datetime.datetime.utcnow()
+    for minutes in (10, 5):
+      token_id = uuid.uuid4().hex
+      self.token_api.create_token(
+          token_id, {'id': token_id, 'user_id': 'foo',
+                     'expires': now + datetime.timedelta(minutes=minutes)})
+    item = self._index('user_tokens-foo')
+    self.assert_(abs(item[1] - (time.time() + 600)) < 5)
+
+  def test_failed_token_write_is_raised(self):
+    for server in self.servers:
+      server.store_response = 'SERVER_ERROR out of memory storing object'
+    token_id = uuid.uuid4().hex
+    self.assertRaises(memcache.ServerError, self.token_api.create_token,
+                      token_id, {'id': token_id, 'user_id': 'foo'})
+
+  def test_index_retries_are_capped(self):
+    token_id = uuid.uuid4().hex
+    self.token_api.create_token(token_id, {'id': token_id,
+                                           'user_id': 'foo'})
+    # as if other nodes always updated the index first
+    for server in self.servers:
+      server.store_response = 'EXISTS'
+    self.token_api.client.set = lambda *args: True
+    token_id = uuid.uuid4().hex
+    self.assertRaises(memcache.ServerError, self.token_api.create_token,
+                      token_id, {'id': token_id, 'user_id': 'foo'})
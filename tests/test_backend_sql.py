@@ -1,10 +1,22 @@
+import datetime
+import json
 import os
+import shutil
+import sqlite3
 import uuid
 
+import eventlet
+import sqlalchemy
+
 from keystone import config
 from keystone import test
+from keystone.common import sql
+from keystone.common import threadpool
+from keystone.common import utils
 from keystone.common.sql import util as sql_util
+from keystone.contrib.ec2.backends import sql as ec2_sql
 from keystone.identity.backends import sql as identity_sql
+from keystone.token.backends import sql as token_sql
 
 import test_backend
 import default_fixtures
@@ -28,26 +40,518 @@ class SqlIdentity(test.TestCase, test_backend.IdentityTests):
     self.identity_api = identity_sql.Identity()
     self.load_fixtures(default_fixtures)
 
+  def test_json_decoded_when_used(self):
+    session = self.identity_api.get_session()
+    user_ref = session.query(identity_sql.User).get(self.user_foo['id'])
+    self.assert_(not user_ref._extra.decoded)
+    self.assertEquals(user_ref.name, self.user_foo['name'])
+    self.assert_(not user_ref._extra.decoded)
 
-#class SqlToken(test_backend_kvs.KvsToken):
-#  def setUp(self):
-#    super(SqlToken, self).setUp()
-#    self.token_api = sql.SqlToken()
-#    self.load_fixtures(default_fixtures)
-
-#  def test_token_crud(self):
-#    token_id = uuid.uuid4().hex
-#    data = {'id': token_id,
-#            'a': 'b'}
-#    data_ref = self.token_api.create_token(token_id, data)
-#    self.assertDictEquals(data_ref, data)
-
-#    new_data_ref = self.token_api.get_token(token_id)
-#    self.assertEquals(new_data_ref, data)
-
-#    self.token_api.delete_token(token_id)
-#    deleted_data_ref = self.token_api.get_token(token_id)
-#    self.assert_(deleted_data_ref is None)
+    extra = user_ref.extra
+    self.assertEquals(extra['password'], self.user_foo['password'])
+    self.assert_(user_ref.extra is extra)
+
+  def test_model_as_dict(self):
+    role_ref = self.identity_api.get_role(self.role_useless['id'])
+    self.assertEquals(role_ref.to_dict(), self.role_useless)
+    self.assertEquals(dict(role_ref.iteritems()), self.role_useless)
+    self.assertEquals(json.loads(json.dumps([role_ref],
+                                            cls=utils.SmarterEncoder)),
+                      [self.role_useless])
+
+    # iterating is not tied to the object
+    first = iter(role_ref)
+    first.next()
+    self.assertEquals(sorted(role_ref), ['id', 'name'])
+    self.assertEquals(list(first), ['name'])
+
+  def test_json_codec(self):
+    calls = []
+    class Codec(object):
+      def dumps(self, value):
+        calls.append('dumps')
+        return json.dumps(value)
+      def loads(self, text):
+        calls.append('loads')
+        return json.loads(text)
+    sql.CODECS['counting'] = Codec()
+    self.opt_in_group('sql', json_codec='counting')
+    self.identity_api = identity_sql.Identity()
+    try:
+      self.identity_api.create_user('new', {'id': 'new', 'name': 'NEW',
+                                            'email': 'new@example.com'})
+      user_ref = self.identity_api.get_user('new')
+      self.assertEquals(user_ref['email'], 'new@example.com')
+      self.assertEquals(calls, ['dumps', 'loads'])
+    finally:
+      sql.set_codec('json')
+      del sql.CODECS['counting']
+
+
+def _forget_engines():
+  sql.ENGINES.clear()
+  sql.MAKERS.clear()
+  sql.REPLICAS.clear()
+  sql.THREAD_POOL = None
+
+
+def _sleep_ms(ms):
+  # blocks the thread it runs in, like a query in a C driver would
+  eventlet.patcher.original('time').sleep(ms / 1000.0)
+  return ms
+
+
+class SqlThreadedIdentity(SqlIdentity):
+  def setUp(self):
+    self.opt_in_group('sql', thread_pool_size=2)
+    _forget_engines()
+    super(SqlThreadedIdentity, self).setUp()
+    sqlalchemy.event.listen(self.identity_api.get_engine(), 'connect',
+                            self._connect)
+
+  def tearDown(self):
+    _forget_engines()
+    super(SqlThreadedIdentity, self).tearDown()
+
+  def _connect(self, dbapi_connection, connection_record):
+    dbapi_connection.create_function('sleep_ms', 1, _sleep_ms)
+
+  def _sleep(self, ms):
+    session = self.identity_api.get_session()
+    return session.execute('SELECT sleep_ms(:ms)', {'ms': ms}).scalar()
+
+  def test_calls_run_in_the_thread_pool(self):
+    calls = sql.get_thread_pool().get_stats()['calls']
+    self.identity_api.get_user(self.user_foo['id'])
+    self.assert_(sql.get_thread_pool().get_stats()['calls'] > calls)
+
+  def test_slow_queries_do_not_block_green_threads(self):
+    ticks = []
+    def _tick():
+      for i in range(5):
+        ticks.append(i)
+        eventlet.sleep(0.01)
+    ticker = eventlet.spawn(_tick)
+    self.assertEquals(self._sleep(200), 200)
+    self.assertEquals(ticks, range(5))
+    ticker.wait()
+
+  def test_errors_are_raised(self):
+    # SQLAlchemy rolls back before re-raising these
+    self.assertRaises(sqlalchemy.exc.IntegrityError,
+                      self.identity_api.create_user,
+                      self.user_foo['id'], dict(self.user_foo))
+
+  def test_timeout(self):
+    sql.get_thread_pool().timeout = 0.05
+    self.assertRaises(threadpool.Timeout, self._sleep, 200)
+    self.assertEquals(sql.get_thread_pool().get_stats()['timeouts'], 1)
+
+    # the abandoned connection was replaced
+    sql.get_thread_pool().timeout = 1
+    self.assertEquals(self._sleep(1), 1)
+
+
+class SqlToken(test.TestCase, test_backend.TokenTests):
+  def setUp(self):
+    super(SqlToken, self).setUp()
+    try:
+      os.unlink('bla.db')
+    except Exception:
+      pass
+    CONF(config_files=[test.etcdir('keystone.conf'),
+                       test.testsdir('test_overrides.conf'),
+                       test.testsdir('backend_sql.conf')])
+    sql_util.setup_test_database()
+    self.token_api = token_sql.Token()
+
+  def test_purge_expired_tokens(self):
+    expired = datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
+    for i in range(5):
+      token_id = uuid.uuid4().hex
+      self.token_api.create_token(token_id, {'id': token_id,
+                                             'expires': expired})
+    live_id = uuid.uuid4().hex
+    self.token_api.create_token(live_id, {'id': live_id})
+
+    self.assertEquals(self.token_api.purge_expired_tokens(batch_size=2), 5)
+    self.assert_(self.token_api.get_token(live_id) is not None)
+    self.assertEquals(self.token_api.purge_expired_tokens(batch_size=2), 0)
+
+
+class SqlGroupCommitToken(SqlToken):
+  def setUp(self):
+    super(SqlGroupCommitToken, self).setUp()
+    self.opt_in_group('token', group_commit=True)
+    self.token_api = token_sql.Token()
+
+  def test_concurrent_tokens_share_commits(self):
+    batches = []
+    commit = self.token_api.committer._commit
+    def _commit(batch):
+      batches.append(len(batch))
+      return commit(batch)
+    self.token_api.committer._commit = _commit
+
+    token_ids = [uuid.uuid4().hex for i in range(10)]
+    pool = eventlet.GreenPool()
+    for token_id in token_ids:
+      pool.spawn(self.token_api.create_token, token_id, {'id': token_id})
+    pool.waitall()
+
+    self.assertEquals(batches, [10])
+    for token_id in token_ids:
+      self.assert_(self.token_api.get_token(token_id) is not None)
+
+  def test_session_failure_fails_the_writers(self):
+    def _get_session():
+      raise sqlalchemy.exc.TimeoutError('pool exhausted')
+    self.token_api.committer.get_session = _get_session
+
+    pool = eventlet.GreenPool()
+    writers = [pool.spawn(self.token_api.create_token, token_id,
+                          {'id': token_id})
+               for token_id in [uuid.uuid4().hex for i in range(3)]]
+    for writer in writers:
+      self.assertRaises(sqlalchemy.exc.TimeoutError, writer.wait)
+
+  def test_committer_failure_fails_the_writers(self):
+    def _commit(batch):
+      raise RuntimeError('committer bug')
+    self.token_api.committer._commit = _commit
+    token_id = uuid.uuid4().hex
+    self.assertRaises(RuntimeError, self.token_api.create_token, token_id,
+                      {'id': token_id})
+    self.assert_(self.token_api.committer.thread is None)
+
+  def test_failed_row_only_fails_its_writer(self):
+    token_id = uuid.uuid4().hex
+    self.token_api.create_token(token_id, {'id': token_id})
+
+    other_id = uuid.uuid4().hex
+    pool = eventlet.GreenPool()
+    duplicate = pool.spawn(self.token_api.create_token,
+                           token_id, {'id': token_id})
+    other = pool.spawn(self.token_api.create_token,
+                       other_id, {'id': other_id})
+    self.assertEquals(other.wait()['id'], other_id)
+    self.assertRaises(Exception, duplicate.wait)
+
+
+class DroppedConnection(sqlite3.Connection):
+  dropped = False
+
+  def cursor(self, *args, **kw):
+    if self.dropped:
+      raise sqlite3.OperationalError('server has gone away')
+    return super(DroppedConnection, self).cursor(*args, **kw)
+
+
+class SqlPool(test.TestCase):
+  def setUp(self):
+    super(SqlPool, self).setUp()
+    try:
+      os.unlink('bla.db')
+    except Exception:
+      pass
+    self.opened = 0
+
+  def _connect(self):
+    self.opened += 1
+    return sqlite3.connect('bla.db')
+
+  def _pool(self, **kw):
+    return sql.GreenPool(self._connect, **kw)
+
+  def test_warm_up(self):
+    pool = self._pool(min_size=2, max_size=5)
+    pool.warm_up()
+    self.assertEquals(self.opened, 2)
+    stats = pool.get_stats()
+    self.assertEquals((stats['open'], stats['idle']), (2, 2))
+
+  def test_connections_are_reused(self):
+    pool = self._pool(max_size=5)
+    for i in range(3):
+      conn = pool.connect()
+      conn.cursor().execute('SELECT 1')
+      conn.close()
+    self.assertEquals(self.opened, 1)
+    stats = pool.get_stats()
+    self.assertEquals(stats['checkouts'], 3)
+    self.assertEquals(stats['checked_out'], 0)
+
+  def test_waits_for_a_connection(self):
+    pool = self._pool(max_size=1)
+    conn = pool.connect()
+    waiter = eventlet.spawn(pool.connect)
+    eventlet.sleep(0.05)
+    self.assertEquals(pool.get_stats()['checked_out'], 1)
+    conn.close()
+    waiter.wait().close()
+    stats = pool.get_stats()
+    self.assertEquals(self.opened, 1)
+    self.assertEquals(stats['waits'], 1)
+    self.assert_(stats['max_wait_time'] >= 0.05)
+
+  def test_timeout(self):
+    pool = self._pool(max_size=1, timeout=0.01)
+    conn = pool.connect()
+    self.assertRaises(sqlalchemy.exc.TimeoutError, pool.connect)
+    self.assertEquals(pool.get_stats()['timeouts'], 1)
+    conn.close()
+    pool.connect().close()
+
+  def test_idle_connections_are_pinged(self):
+    pool = sql.GreenPool(lambda: sqlite3.connect('bla.db',
+                                                 factory=DroppedConnection),
+                         ping_interval=0)
+    conn = pool.connect()
+    # as if the server went away while it sat in the pool
+    conn.connection.dropped = True
+    conn.close()
+
+    conn = pool.connect()
+    conn.cursor().execute('SELECT 1')
+    conn.close()
+    stats = pool.get_stats()
+    self.assertEquals((stats['pings'], stats['reconnects']), (1, 1))
+    self.assertEquals(stats['open'], 1)
+
+  def test_engine(self):
+    engine = sqlalchemy.create_engine('sqlite:///bla.db',
+                                      poolclass=sql.GreenPool,
+                                      creator=self._connect, max_size=2)
+    self.assertEquals(engine.execute('SELECT 1').scalar(), 1)
+    self.assertEquals(engine.pool.get_stats()['idle'], 1)
+
+  def test_engine_args(self):
+    CONF(config_files=[test.etcdir('keystone.conf'),
+                       test.testsdir('test_overrides.conf'),
+                       test.testsdir('backend_sql.conf')])
+    self.opt_in_group('sql', pool_timeout=7, pool_ping_interval=3)
+    # what create_engine passes for urls other than sqlite ones
+    engine = sqlalchemy.create_engine('sqlite:///bla.db',
+                                      creator=self._connect,
+                                      **sql.green_pool_args())
+    pool = engine.pool
+    self.assert_(isinstance(pool, sql.GreenPool))
+    self.assertEquals((pool.min_size, pool.max_size, pool.timeout,
+                       pool.ping_interval), (5, 10, 7, 3))
+
+
+class SqlReplicas(test.TestCase):
+  replicas = ['bla-replica1.db', 'bla-replica2.db']
+
+  def setUp(self):
+    super(SqlReplicas, self).setUp()
+    CONF(config_files=[test.etcdir('keystone.conf'),
+                       test.testsdir('test_overrides.conf'),
+                       test.testsdir('backend_sql.conf')])
+    sql_util.setup_test_database()
+    self.identity_api = identity_sql.Identity()
+    self.token_api = token_sql.Token()
+    self.load_fixtures(default_fixtures)
+
+    # each replica tells which one it is by the name of tenant bar
+    for path in self.replicas:
+      shutil.copy('bla.db', path)
+      self._rename_tenant(path, path.split('-')[1][:-3])
+    self._use_replicas(['sqlite:///%s' % x for x in self.replicas])
+
+  def tearDown(self):
+    self._forget_replicas()
+    for path in self.replicas:
+      os.unlink(path)
+    super(SqlReplicas, self).tearDown()
+
+  def _use_replicas(self, urls, **kw):
+    self._forget_replicas()
+    self.opt_in_group('sql', replicas=urls, **kw)
+
+  def _forget_replicas(self):
+    for urls in sql.REPLICAS.keys():
+      for url in urls[1]:
+        sql.ENGINES.pop(url, None)
+    sql.REPLICAS.clear()
+    sql.WRITES.at = None
+
+  def _rename_tenant(self, path, name):
+    conn = sqlite3.connect(path)
+    conn.execute('UPDATE tenant SET name = ? WHERE id = ?',
+                 (name, self.tenant_bar['id']))
+    conn.commit()
+    conn.close()
+
+  def _tenant_name(self):
+    return self.identity_api.get_tenant(self.tenant_bar['id'])['name']
+
+  def test_round_robin(self):
+    names = [self._tenant_name() for i in range(4)]
+    self.assertEquals(names, ['replica1', 'replica2'] * 2)
+    stats = self.identity_api.get_replicas().get_stats()
+    for url in CONF.sql.replicas:
+      self.assertEquals(stats[url]['reads'], 2)
+      self.assert_(stats[url]['healthy'])
+
+  def test_writes_go_to_the_primary(self):
+    self.opt_in_group('sql', read_your_writes=0)
+    self.identity_api.update_tenant(self.tenant_bar['id'],
+                                    dict(self.tenant_bar, name='written'))
+    self.assertEquals(self._tenant_name(), 'replica1')
+    conn = sqlite3.connect('bla.db')
+    name = conn.execute('SELECT name FROM tenant WHERE id = ?',
+                        (self.tenant_bar['id'],)).fetchone()[0]
+    conn.close()
+    self.assertEquals(name, 'written')
+
+  def test_read_your_writes(self):
+    self.identity_api.update_tenant(self.tenant_bar['id'],
+                                    dict(self.tenant_bar, name='written'))
+    self.assertEquals(self._tenant_name(), 'written')
+
+    # other green threads still read from the replicas
+    self.assertEquals(eventlet.spawn(self._tenant_name).wait(), 'replica1')
+
+  def test_unhealthy_replicas_are_skipped(self):
+    missing = 'sqlite:///%s' % os.path.join('missing', 'replica.db')
+    self._use_replicas([missing, 'sqlite:///bla-replica2.db'])
+    self.assertEquals([self._tenant_name() for i in range(2)],
+                      ['replica2'] * 2)
+    stats = self.identity_api.get_replicas().get_stats()
+    self.assertEquals(stats[missing]['healthy'], False)
+
+    # the primary is read when no replica is healthy
+    self._use_replicas([missing])
+    self.assertEquals(self._tenant_name(), self.tenant_bar['name'])
+
+  def test_least_loaded(self):
+    self._use_replicas(CONF.sql.replicas, replica_selection='least_loaded')
+    replicas = self.identity_api.get_replicas()
+    conn = replicas.engines[0].connect()
+    try:
+      self.assertEquals([self._tenant_name() for i in range(2)],
+                        ['replica2'] * 2)
+      self.assertEquals(
+          replicas.get_stats()['sqlite:///bla-replica1.db']['in_use'], 1)
+    finally:
+      conn.close()
+    self.assertEquals(self._tenant_name(), 'replica1')
+
+  def test_new_token_read_from_the_primary(self):
+    self.opt_in_group('sql', read_your_writes=0)
+    token_id = uuid.uuid4().hex
+    self.token_api.create_token(token_id, {'id': token_id, 'a': 'b'})
+    self.assertEquals(self.token_api.get_token(token_id)['a'], 'b')
+
+  def test_revoked_token_is_not_read_from_a_replica(self):
+    self.opt_in_group('sql', read_your_writes=0)
+    token_ids = [uuid.uuid4().hex for i in range(3)]
+    for i, token_id in enumerate(token_ids):
+      self.token_api.create_token(token_id, {'id': token_id,
+                                             'user_id': 'user%d' % i,
+                                             'tenant_id': 'tenant%d' % i})
+    # the replicas have not seen the revocations yet
+    for path in self.replicas:
+      shutil.copy('bla.db', path)
+
+    self.token_api.delete_token(token_ids[0])
+    self.token_api.revoke_tokens_for_user('user1')
+    self.token_api.revoke_tokens_for_tenant('tenant2')
+    for token_id in token_ids:
+      self.assert_(self.token_api.get_token(token_id) is None)
+
+
+class SqlQueryPlans(test.TestCase):
+  """Fails if a query on a hot path has to scan a whole table."""
+
+  def setUp(self):
+    super(SqlQueryPlans, self).setUp()
+    try:
+      os.unlink('bla.db')
+    except Exception:
+      pass
+    CONF(config_files=[test.etcdir('keystone.conf'),
+                       test.testsdir('test_overrides.conf'),
+                       test.testsdir('backend_sql.conf')])
+    sql_util.setup_test_database()
+    self.identity_api = identity_sql.Identity()
+    self.token_api = token_sql.Token()
+    self.ec2_api = ec2_sql.Ec2()
+    self.load_fixtures(default_fixtures)
+
+    self.statements = []
+    engines = set(api.get_engine()
+                  for api in (self.identity_api, self.token_api, self.ec2_api))
+    for engine in engines:
+      sqlalchemy.event.listen(engine, 'before_cursor_execute', self._record)
+
+  def _record(self, conn, cursor, statement, parameters, context,
+              executemany):
+    if not statement.startswith(('INSERT', 'EXPLAIN')):
+      self.statements.append((conn.engine, statement, parameters))
+
+  def assertIndexed(self, f, *args, **kw):
+    self.statements = []
+    f(*args, **kw)
+    statements = self.statements
+    self.assert_(statements)
+    for engine, statement, parameters in statements:
+      plan = engine.execute('EXPLAIN QUERY PLAN %s' % statement, parameters)
+      for row in plan:
+        # SCAN reads every row of the table, or of one of its indexes
+        self.assert_(not row['detail'].startswith('SCAN'),
+                     '%s\n%s' % (statement, row['detail']))
+
+  def test_identity_queries(self):
+    user_id = self.user_foo['id']
+    tenant_id = self.tenant_bar['id']
+    self.assertIndexed(self.identity_api.get_user, user_id)
+    self.assertIndexed(self.identity_api.get_user_by_name,
+                       self.user_foo['name'])
+    self.assertIndexed(self.identity_api.get_tenant, tenant_id)
+    self.assertIndexed(self.identity_api.get_tenant_by_name,
+                       self.tenant_bar['name'])
+    self.assertIndexed(self.identity_api.get_metadata, user_id, tenant_id)
+    self.assertIndexed(self.identity_api.get_tenants_for_user, user_id)
+    self.assertIndexed(self.identity_api.get_tenant_users, tenant_id,
+                       limit=10)
+    self.assertIndexed(self.identity_api.get_roles,
+                       [self.role_useless['id']])
+    self.assertIndexed(self.identity_api.get_tenants, [tenant_id])
+    self.assertIndexed(self.identity_api.get_auth_context,
+                       user_name=self.user_foo['name'],
+                       tenant_name=self.tenant_bar['name'])
+    # the first page is an ordered index scan cut short by the limit, only
+    # the following ones can be checked
+    self.assertIndexed(self.identity_api.list_users, marker=user_id,
+                       limit=10)
+    self.assertIndexed(self.identity_api.list_users, marker=user_id,
+                       limit=10, reverse=True)
+    self.assertIndexed(self.identity_api.list_roles,
+                       marker=self.role_useless['id'], limit=10)
+
+  def test_token_queries(self):
+    token_id = uuid.uuid4().hex
+    self.token_api.create_token(token_id, {'id': token_id,
+                                           'user_id': 'foo',
+                                           'tenant_id': 'bar'})
+    self.assertIndexed(self.token_api.get_token, token_id)
+    self.assertIndexed(self.token_api.revoke_tokens_for_user, 'foo',
+                       tenant_id='bar')
+    self.assertIndexed(self.token_api.revoke_tokens_for_tenant, 'bar')
+    self.assertIndexed(self.token_api.purge_expired_tokens)
+
+  def test_ec2_queries(self):
+    credential = {'user_id': 'foo',
+                  'tenant_id': 'bar',
+                  'access': uuid.uuid4().hex,
+                  'secret': uuid.uuid4().hex}
+    self.ec2_api.create_credential(credential['access'], credential)
+    self.assertIndexed(self.ec2_api.get_credential, credential['access'])
+    self.assertIndexed(self.ec2_api.list_credentials, 'foo', limit=10)
+    self.assertIndexed(self.ec2_api.list_credentials, 'foo',
+                       marker=credential['access'], limit=10)
 
 
 #class SqlCatalog(test_backend_kvs.KvsCatalog):
@@ -0,0 +1,98 @@
+import os
+import uuid
+
+from keystone import config
+from keystone import test
+from keystone.common import bulk
+from keystone.common.sql import util as sql_util
+from keystone.contrib.ec2.backends import kvs as ec2_kvs
+from keystone.contrib.ec2.backends import sql as ec2_sql
+from keystone.identity.backends import kvs as identity_kvs
+from keystone.identity.backends import sql as identity_sql
+
+import default_fixtures
+
+
+CONF = config.CONF
+
+
+class Bulk(test.TestCase):
+  def setUp(self):
+    super(Bulk, self).setUp()
+    try:
+      os.unlink('bla.db')
+    except Exception:
+      pass
+    CONF(config_files=[test.etcdir('keystone.conf'),
+                       test.testsdir('test_overrides.conf'),
+                       test.testsdir('backend_sql.conf')])
+    sql_util.setup_test_database()
+
+    self.identity_api = identity_kvs.Identity(db={})
+    self.ec2_api = ec2_kvs.Ec2(db={})
+    self.load_fixtures(default_fixtures)
+    self.identity_api.add_role_to_user_and_tenant(
+        self.user_foo['id'], self.tenant_bar['id'],
+        self.role_keystone_admin['id'])
+    self.credential = {'user_id': self.user_foo['id'],
+                       'tenant_id': self.tenant_bar['id'],
+                       'access': uuid.uuid4().hex,
+                       'secret': uuid.uuid4().hex}
+    self.ec2_api.create_credential(self.credential['access'],
+                                   self.credential)
+
+  def _export(self, page_size=1000):
+    return list(bulk.dump_lines(bulk.export_records(
+        self.identity_api, self.ec2_api, page_size=page_size)))
+
+  def _assert_imported(self, identity_api, ec2_api):
+    for user in default_fixtures.USERS:
+      user_ref = identity_api.get_user(user['id'])
+      self.assertEquals(user_ref['name'], user['name'])
+      self.assertEquals(user_ref['password'], user['password'])
+      self.assertEquals(identity_api.get_tenants_for_user(user['id']),
+                        user['tenants'])
+    for tenant in default_fixtures.TENANTS:
+      self.assertDictEquals(identity_api.get_tenant(tenant['id']), tenant)
+    self.assertEquals([x['id'] for x in identity_api.list_roles()],
+                      [x['id'] for x in default_fixtures.ROLES])
+    self.assertEquals(
+        identity_api.get_roles_for_user_and_tenant(self.user_foo['id'],
+                                                   self.tenant_bar['id']),
+        [self.role_keystone_admin['id']])
+    self.assertEquals(ec2_api.list_credentials(self.user_foo['id']),
+                      [self.credential])
+
+  def test_export(self):
+    records = list(bulk.load_lines(self._export()))
+    self.assertEquals([x[0] for x in records],
+                      ['tenant', 'tenant', 'role', 'role',
+                       'user', 'membership', 'metadata', 'ec2_credential',
+                       'user', 'membership', 'metadata'])
+    self.assert_('tenants' not in records[4][1])
+
+  def test_export_pages_through_the_drivers(self):
+    self.assertEquals(self._export(page_size=1), self._export())
+
+  def test_round_trip_to_kvs(self):
+    identity_api = identity_kvs.Identity(db={})
+    ec2_api = ec2_kvs.Ec2(db={})
+    count = bulk.import_records(bulk.load_lines(self._export()),
+                                identity_api, ec2_api)
+    self.assertEquals(count, 11)
+    self._assert_imported(identity_api, ec2_api)
+
+  def test_round_trip_to_sql_in_batches(self):
+    identity_api = identity_sql.Identity()
+    ec2_api = ec2_sql.Ec2()
+    progress = []
+    count = bulk.import_records(bulk.load_lines(self._export()),
+                                identity_api, ec2_api, batch_size=4,
+                                progress=progress.append)
+    self.assertEquals(count, 11)
+    self.assertEquals(progress, [4, 8, 10, 11])
+    self._assert_imported(identity_api, ec2_api)
+
+  def test_unknown_record_type(self):
+    self.assertRaises(ValueError, bulk.import_records,
+                      [('nonsense', {})], self.identity_api, self.ec2_api)
@@ -0,0 +1,63 @@
+import datetime
+import imp
+import os
+import StringIO
+import sys
+
+from keystone import config
+from keystone import test
+from keystone.common.sql import util as sql_util
+from keystone.token.backends import sql as token_sql
+
+
+CONF = config.CONF
+
+
+class PurgeTokens(test.TestCase):
+  def setUp(self):
+    super(PurgeTokens, self).setUp()
+    try:
+      os.unlink('bla.db')
+    except Exception:
+      pass
+    CONF(config_files=[test.etcdir('keystone.conf'),
+                       test.testsdir('test_overrides.conf'),
+                       test.testsdir('backend_sql.conf')])
+    sql_util.setup_test_database()
+    self.manage = imp.load_source('keystone_manage',
+                                  test.rootdir('bin', 'keystone-manage'))
+
+  def _run(self, name):
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = StringIO.StringIO()
+    sys.stderr = StringIO.StringIO()
+    try:
+      try:
+        self.manage.CMDS[name](argv=['keystone-manage']).run()
+        status = 0
+      except SystemExit, e:
+        status = e.code or 0
+      return status, sys.stdout.getvalue(), sys.stderr.getvalue()
+    finally:
+      sys.stdout, sys.stderr = stdout, stderr
+
+  def test_purge_tokens(self):
+    token_api = token_sql.Token()
+    now = datetime.datetime.utcnow()
+    token_api.create_token('expired', {'id': 'expired', 'user_id': 'foo',
+                                       'expires': now - datetime.timedelta(1)})
+    token_api.create_token('valid', {'id': 'valid', 'user_id': 'foo',
+                                     'expires': now + datetime.timedelta(1)})
+
+    status, out, _err = self._run('purge_tokens')
+    self.assertEquals(status, 0)
+    self.assertEquals(out.strip(), '1')
+    self.assert_(token_api.get_token('expired') is None)
+    self.assertEquals(token_api.get_token('valid')['id'], 'valid')
+
+  def test_purge_tokens_unsupported(self):
+    self.opt_in_group('token', driver='keystone.token.backends.kvs.Token')
+    status, out, err = self._run('purge_tokens')
+    self.assertEquals(status, 1)
+    self.assertEquals(out, '')
+    self.assert_('does not support purging tokens' in err)
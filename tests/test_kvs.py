@@ -0,0 +1,196 @@
+import datetime
+import os
+import shutil
+import tempfile
+
+import eventlet
+
+from keystone import config
+from keystone import test
+from keystone.common import kvs
+from keystone.identity.backends import kvs as identity_kvs
+from keystone.token.backends import kvs as token_kvs
+
+import default_fixtures
+
+
+CONF = config.CONF
+
+
+class DictKvs(test.TestCase):
+  def test_sets(self):
+    db = kvs.DictKvs()
+    db.sadd('ids', 'b')
+    db.sadd('ids', 'a')
+    db.sadd('ids', 'a')
+    self.assertEquals(db.smembers('ids'), set(['a', 'b']))
+    self.assert_(db.sismember('ids', 'a'))
+    db.srem('ids', 'a')
+    self.assert_(not db.sismember('ids', 'a'))
+    self.assertRaises(KeyError, db.srem, 'ids', 'a')
+    self.assert_(not db.sismember('missing', 'a'))
+
+  def test_srange(self):
+    db = kvs.DictKvs()
+    for i in (3, 1, 4, 0, 2):
+      db.sadd('ids', i)
+    self.assertEquals(db.srange('ids'), [0, 1, 2, 3, 4])
+    self.assertEquals(db.srange('ids', marker=1, limit=2), [2, 3])
+    self.assertEquals(db.srange('ids', marker=3, limit=2, reverse=True),
+                      [2, 1])
+
+    # the ordered copy follows later changes
+    db.sadd('ids', 5)
+    db.srem('ids', 2)
+    self.assertEquals(db.srange('ids', marker=1), [3, 4, 5])
+    db.set('ids', set([7]))
+    self.assertEquals(db.srange('ids'), [7])
+
+  def test_changes_do_not_keep_the_ordered_copy(self):
+    db = kvs.DictKvs()
+    db.sadd('ids', 'a')
+    db.srange('ids')
+    self.assert_('ids' in db._ordered)
+    db.sadd('ids', 'b')
+    self.assert_('ids' not in db._ordered)
+    self.assertEquals(db.srange('ids'), ['a', 'b'])
+    db.srem('ids', 'a')
+    self.assert_('ids' not in db._ordered)
+
+    self.assertEquals(db.srange('missing'), [])
+    self.assert_('missing' not in db._ordered)
+
+  def test_lists_become_sets(self):
+    db = kvs.DictKvs({'ids': ['a', 'b']})
+    db.sadd('ids', 'c')
+    self.assertEquals(db.get('ids'), set(['a', 'b', 'c']))
+
+
+class PersistentKvs(test.TestCase):
+  def setUp(self):
+    super(PersistentKvs, self).setUp()
+    CONF(config_files=[test.etcdir('keystone.conf'),
+                       test.testsdir('test_overrides.conf')])
+    self.tmpdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tmpdir, 'kvs.db')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+    super(PersistentKvs, self).tearDown()
+
+  def _reopen(self, db, **kw):
+    db.close()
+    return kvs.PersistentKvs(self.path, **kw)
+
+  def test_survives_restart(self):
+    db = kvs.PersistentKvs(self.path)
+    db.set('foo', {'a': 'b'})
+    db.set('bar', [1, 2])
+    db.delete('bar')
+
+    db = self._reopen(db)
+    self.assertEquals(db.get('foo'), {'a': 'b'})
+    self.assert_(db.get('bar') is None)
+    self.assertRaises(KeyError, db.delete, 'bar')
+
+  def test_sets_survive_restart(self):
+    db = kvs.PersistentKvs(self.path)
+    db.sadd('ids', 'a')
+    db.sadd('ids', 'b')
+    db.srem('ids', 'a')
+    db.snapshot()
+    db.sadd('ids', 'c')
+
+    db = self._reopen(db)
+    self.assertEquals(db.smembers('ids'), set(['b', 'c']))
+    self.assertEquals(db.srange('ids'), ['b', 'c'])
+
+  def test_last_writes_are_synced_after_sync_interval(self):
+    db = kvs.PersistentKvs(self.path, sync_batch=100, sync_interval=0.01)
+    db.set('foo', 'bar')
+    db.set('baz', 'qux')
+    self.assertEquals(db._pending, 2)
+    eventlet.sleep(0.05)
+    self.assertEquals(db._pending, 0)
+    self.assert_(db._syncer is None)
+
+  def test_snapshot_compacts_log(self):
+    db = kvs.PersistentKvs(self.path, snapshot_threshold=10)
+    for i in range(10):
+      db.set('key-%d' % (i % 3), i)
+    self.assertEquals(db._log_records, 0)
+    db._snapshotter.wait()
+    self.assert_(os.path.getsize(self.path) > 0)
+    self.assert_(not os.path.exists(db.prev_log_path))
+
+    for i in range(10, 25):
+      db.set('key-%d' % (i % 3), i)
+    db._snapshotter.wait()
+    self.assertEquals(db._log_records, 5)
+
+    db = self._reopen(db)
+    self.assertEquals(dict(db), {'key-0': 24, 'key-1': 22, 'key-2': 23})
+
+  def test_snapshot_does_not_block_writes(self):
+    db = kvs.PersistentKvs(self.path, snapshot_threshold=10)
+    for i in range(25):
+      db.set('key-%d' % (i % 3), i)
+    # the snapshot has not been written yet, a new one waits for it
+    self.assert_(not os.path.exists(self.path))
+    self.assertEquals(db._log_records, 15)
+
+    # a crash before it is written loses nothing
+    db._snapshotter.kill()
+    db._log.close()
+    db = kvs.PersistentKvs(self.path)
+    self.assertEquals(dict(db), {'key-0': 24, 'key-1': 22, 'key-2': 23})
+
+  def test_failed_snapshot_is_written_in_line(self):
+    db = kvs.PersistentKvs(self.path, snapshot_threshold=10)
+    db._write_snapshot = lambda data: 1 / 0
+    for i in range(10):
+      db.set('key-%d' % (i % 3), i)
+    db._snapshotter.wait()
+    self.assert_(os.path.exists(db.prev_log_path))
+
+    del db._write_snapshot
+    for i in range(10, 20):
+      db.set('key-%d' % (i % 3), i)
+    self.assert_(os.path.getsize(self.path) > 0)
+    self.assert_(not os.path.exists(db.prev_log_path))
+    self.assertEquals(db._log_records, 0)
+
+    db = self._reopen(db)
+    self.assertEquals(dict(db), {'key-0': 18, 'key-1': 19, 'key-2': 17})
+
+  def test_torn_log_record_is_discarded(self):
+    db = kvs.PersistentKvs(self.path)
+    db.set('foo', 'bar')
+    db.set('baz', 'qux')
+    db.close()
+    with open(db.log_path, 'r+b') as f:
+      f.truncate(os.path.getsize(db.log_path) - 2)
+
+    db = kvs.PersistentKvs(self.path)
+    self.assertEquals(dict(db), {'foo': 'bar'})
+    db.set('baz', 'quux')
+    db = self._reopen(db)
+    self.assertEquals(dict(db), {'foo': 'bar', 'baz': 'quux'})
+
+  def test_backends_use_configured_path(self):
+    self.opt_in_group('kvs', path=self.path)
+    identity_api = identity_kvs.Identity()
+    self.identity_api = identity_api
+    self.load_fixtures(default_fixtures)
+    token_api = token_kvs.Token()
+    self.assert_(identity_api.db is token_api.db)
+    token_api.create_token('tok', {'id': 'tok', 'user_id': 'foo',
+                                   'roles': ['admin']})
+
+    db = self._reopen(kvs.PERSISTENT.pop(self.path))
+    identity_api = identity_kvs.Identity(db=db)
+    token_api = token_kvs.Token(db=db)
+    self.assertEquals(identity_api.get_user('foo')['name'], 'FOO')
+    token_ref = token_api.get_token('tok')
+    self.assertEquals(token_ref['roles'], ['admin'])
+    self.assert_(isinstance(token_ref['expires'], datetime.datetime))
@@ -69,7 +69,6 @@ class CompatTestCase(test.TestCase):
     self.token_123 = self.token_api.create_token(
         'ab48a9efdfedb23ty3494',
         dict(id='ab48a9efdfedb23ty3494',
-             expires='2010-11-01T03:32:15-05:00',
              user=self.user_123,
              tenant=self.tenant_345,
              metadata=self.metadata_123))
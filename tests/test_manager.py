@@ -0,0 +1,188 @@
+from keystone import config
+from keystone import identity
+from keystone import test
+from keystone.common import manager
+from keystone.identity.backends import kvs as identity_kvs
+
+import default_fixtures
+
+
+CONF = config.CONF
+
+
+class Cache(test.TestCase):
+  def setUp(self):
+    super(Cache, self).setUp()
+    CONF(config_files=[test.etcdir('keystone.conf'),
+                       test.testsdir('test_overrides.conf')])
+    self.opt_in_group('cache', enabled=True)
+    manager.CACHES.clear()
+    self.identity_api = identity_kvs.Identity(db={})
+    self.load_fixtures(default_fixtures)
+    self.manager = identity.Manager()
+    self.manager.driver = self.identity_api
+
+  def tearDown(self):
+    manager.CACHES.clear()
+    super(Cache, self).tearDown()
+
+  def _stats(self, name):
+    stats = self.manager.get_cache_stats(None)[name]
+    return stats['hits'], stats['misses']
+
+  def test_disabled(self):
+    self.opt_in_group('cache', enabled=False)
+    api = identity.Manager()
+    self.assert_(api.cache is None)
+    self.assertEquals(api.get_cache_stats(None), {})
+
+  def test_read_through(self):
+    user_ref = self.manager.get_user(None, self.user_foo['id'])
+    self.assertDictEquals(user_ref, self.user_foo)
+    self.assertEquals(self._stats('get_user'), (0, 1))
+    self.assertDictEquals(self.manager.get_user(None, self.user_foo['id']),
+                          self.user_foo)
+    self.assertEquals(self._stats('get_user'), (1, 1))
+    self.manager.get_user(None, self.user_two['id'])
+    self.assertEquals(self._stats('get_user'), (1, 2))
+
+  def test_shared_by_managers_of_a_driver(self):
+    self.manager.get_user(None, self.user_foo['id'])
+    other = identity.Manager()
+    self.assert_(other.cache is self.manager.cache)
+
+  def test_returns_copies(self):
+    self.manager.get_user(None, self.user_foo['id'])
+    user_ref = self.manager.get_user(None, self.user_foo['id'])
+    user_ref['name'] = 'changed'
+    user_ref = self.manager.get_user(None, self.user_foo['id'])
+    self.assertEquals(user_ref['name'], 'FOO')
+
+  def test_unhashable_arguments(self):
+    self.manager.get_user(None, user_id=self.user_foo['id'])
+    self.manager.get_user(None, user_id=self.user_foo['id'])
+    self.assertEquals(self._stats('get_user'), (1, 1))
+    catalog_api = manager.Manager('keystone.catalog.backends.kvs.Catalog')
+    for i in range(2):
+      catalog_api.get_catalog(None, 'foo', 'bar', {'roles': ['x']})
+    self.assertEquals(catalog_api.get_cache_stats(None)['get_catalog'],
+                      {'hits': 1, 'misses': 1})
+
+  def test_negative_caching(self):
+    self.assert_(self.manager.get_user(None, 'new') is None)
+    self.assert_(self.manager.get_user(None, 'new') is None)
+    self.assertEquals(self._stats('get_user'), (1, 1))
+
+    self.manager.create_user(None, 'new', {'id': 'new', 'name': 'NEW'})
+    self.assertEquals(self.manager.get_user(None, 'new')['name'], 'NEW')
+
+  def test_negative_ttl(self):
+    self.opt_in_group('cache', negative_ttl=0)
+    manager.CACHES.clear()
+    api = identity.Manager()
+    api.driver = self.identity_api
+    api.get_user(None, 'new')
+    api.get_user(None, 'new')
+    self.assertEquals(api.get_cache_stats(None)['get_user']['misses'], 2)
+
+  def test_per_method_ttl(self):
+    self.opt_in_group('cache', methods=['get_user:0', 'get_tenant'])
+    manager.CACHES.clear()
+    api = identity.Manager()
+    api.driver = self.identity_api
+    self.assertEquals(api.cache.ttls, {'get_user': 0, 'get_tenant': 60})
+    for i in range(2):
+      api.get_user(None, self.user_foo['id'])
+      api.get_tenant(None, self.tenant_bar['id'])
+    stats = api.get_cache_stats(None)
+    self.assertEquals(stats['get_user'], {'hits': 0, 'misses': 2})
+    self.assertEquals(stats['get_tenant'], {'hits': 1, 'misses': 1})
+
+  def test_update_invalidates_the_same_id(self):
+    self.manager.get_user(None, self.user_foo['id'])
+    self.manager.get_user(None, self.user_two['id'])
+    self.manager.get_tenant(None, self.tenant_bar['id'])
+    user_ref = dict(self.user_foo, name='changed')
+    self.manager.update_user(None, self.user_foo['id'], user_ref)
+
+    self.assertEquals(
+        self.manager.get_user(None, self.user_foo['id'])['name'], 'changed')
+    self.manager.get_user(None, self.user_two['id'])
+    self.manager.get_tenant(None, self.tenant_bar['id'])
+    self.assertEquals(self._stats('get_user'), (1, 3))
+    self.assertEquals(self._stats('get_tenant'), (1, 1))
+
+  def test_update_invalidates_related_methods(self):
+    self.manager.get_user_by_name(None, self.user_foo['name'])
+    self.manager.update_user(None, self.user_foo['id'],
+                             dict(self.user_foo, name='changed'))
+    self.assert_(
+        self.manager.get_user_by_name(None, self.user_foo['name']) is None)
+
+  def test_delete_invalidates(self):
+    self.manager.get_role(None, self.role_useless['id'])
+    self.manager.delete_role(None, self.role_useless['id'])
+    self.assert_(self.manager.get_role(None, self.role_useless['id']) is None)
+
+  def test_other_writes_invalidate_everything(self):
+    self.manager.get_user(None, self.user_two['id'])
+    self.manager.add_user_to_tenant(None, self.tenant_bar['id'],
+                                    self.user_two['id'])
+    user_ref = self.manager.get_user(None, self.user_two['id'])
+    self.assert_(self.tenant_bar['id'] in user_ref['tenants'])
+
+  def test_credential_checks_are_not_cached(self):
+    ttls = manager.parse_ttls(
+        ['get_user', 'authenticate', 'get_auth_context:30', 'check_token',
+         'enforce_policy'], 60)
+    self.assertEquals(ttls, {'get_user': 60})
+
+  def test_password_change_is_seen_by_authenticate(self):
+    manager.CACHES.clear()
+    self.opt_in_group('cache', methods=['get_user', 'authenticate'])
+    self.manager = identity.Manager()
+    self.manager.driver = self.identity_api
+    self.manager.authenticate(None, user_id=self.user_foo['id'],
+                              password=self.user_foo['password'])
+    self.manager.update_user(None, self.user_foo['id'],
+                             dict(self.user_foo, password='changed'))
+
+    self.assertRaises(AssertionError, self.manager.authenticate, None,
+                      user_id=self.user_foo['id'],
+                      password=self.user_foo['password'])
+    user_ref, _tenant_ref, _metadata_ref = self.manager.authenticate(
+        None, user_id=self.user_foo['id'], password='changed')
+    self.assertEquals(user_ref['id'], self.user_foo['id'])
+
+  def test_reads_do_not_invalidate(self):
+    self.manager.get_user(None, self.user_foo['id'])
+    self.manager.list_users(None)
+    self.manager.get_tenants_for_user(None, self.user_foo['id'])
+    self.manager.get_user(None, self.user_foo['id'])
+    self.assertEquals(self._stats('get_user'), (1, 1))
+
+  def test_max_size(self):
+    cache = self.manager.cache
+    cache.max_size = 2
+    for user_id in (self.user_foo['id'], self.user_two['id'], 'missing'):
+      self.manager.get_user(None, user_id)
+    self.assertEquals(len(cache._entries), 2)
+    # least recently used went first
+    self.manager.get_user(None, self.user_foo['id'])
+    self.assertEquals(self._stats('get_user'), (0, 4))
+    self.manager.get_user(None, 'missing')
+    self.assertEquals(self._stats('get_user'), (1, 4))
+
+  def test_max_bytes(self):
+    cache = self.manager.cache
+    self.manager.get_user(None, self.user_foo['id'])
+    size = cache.size
+    self.assert_(size > 0)
+    cache.max_bytes = size
+    self.manager.get_user(None, self.user_two['id'])
+    self.assertEquals(len(cache._entries), 1)
+    self.assert_(cache.size <= size)
+
+    self.manager.delete_user(None, self.user_two['id'])
+    self.assertEquals(cache.size, 0)
+    self.assertEquals(cache._entries, {})
@@ -0,0 +1,77 @@
+import threading
+
+import eventlet
+from eventlet import tpool
+
+from keystone import test
+from keystone.common import threadpool
+
+
+# NOTE: blocks the calling OS thread even where time is monkey patched
+sleep = eventlet.patcher.original('time').sleep
+
+
+class ThreadPool(test.TestCase):
+  def setUp(self):
+    super(ThreadPool, self).setUp()
+    self.lock = threading.Lock()
+    self.running = 0
+    self.max_running = 0
+
+  def tearDown(self):
+    tpool.killall()
+    super(ThreadPool, self).tearDown()
+
+  def _work(self, seconds, value=None):
+    with self.lock:
+      self.running += 1
+      self.max_running = max(self.max_running, self.running)
+    sleep(seconds)
+    with self.lock:
+      self.running -= 1
+    return value
+
+  def test_execute(self):
+    pool = threadpool.ThreadPool(size=2)
+    self.assertEquals(pool.execute(self._work, 0, value='x'), 'x')
+    self.assertRaises(ZeroDivisionError, pool.execute, lambda: 1 / 0)
+    stats = pool.get_stats()
+    self.assertEquals(stats['calls'], 2)
+    self.assertEquals(stats['running'], 0)
+    self.assertEquals(stats['waiting'], 0)
+
+  def test_does_not_block_the_hub(self):
+    pool = threadpool.ThreadPool(size=2)
+    ticks = []
+
+    def tick():
+      for i in range(5):
+        ticks.append(i)
+        eventlet.sleep(0.01)
+
+    ticker = eventlet.spawn(tick)
+    pool.execute(self._work, 0.2)
+    self.assertEquals(len(ticks), 5)
+    ticker.wait()
+
+  def test_concurrency_is_bounded(self):
+    pool = threadpool.ThreadPool(size=2)
+    callers = [eventlet.spawn(pool.execute, self._work, 0.05, value=i)
+               for i in range(6)]
+    eventlet.sleep(0)
+    self.assertEquals(pool.get_stats()['waiting'], 4)
+    self.assertEquals([x.wait() for x in callers], range(6))
+    self.assertEquals(self.max_running, 2)
+    self.assertEquals(pool.get_stats()['max_waiting'], 4)
+
+  def test_timeout(self):
+    pool = threadpool.ThreadPool(size=1, timeout=0.05)
+    self.assertRaises(threadpool.Timeout, pool.execute, self._work, 0.2)
+    stats = pool.get_stats()
+    self.assertEquals(stats['timeouts'], 1)
+    # the call still holds its slot until it returns
+    self.assertEquals(stats['running'], 1)
+    self.assertRaises(threadpool.Timeout, pool.execute, self._work, 0)
+    eventlet.sleep(0.3)
+    self.assertEquals(pool.execute(self._work, 0, value='x'), 'x')
+    self.assertEquals(self.max_running, 1)
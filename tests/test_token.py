@@ -0,0 +1,251 @@
+import datetime
+import hashlib
+import uuid
+
+from keystone import config
+from keystone import service
+from keystone import test
+from keystone import token
+from keystone.common import utils
+from keystone.common.sql import util as sql_util
+from keystone.contrib import ec2
+from keystone.contrib.ec2.backends import kvs as ec2_kvs
+from keystone.identity.backends import kvs as identity_kvs
+from keystone.middleware import auth_token
+from keystone.token.backends import kvs as token_kvs
+from keystone.token.backends import sql as token_sql
+
+import default_fixtures
+
+
+CONF = config.CONF
+
+
+class TokenReuse(test.TestCase):
+  def setUp(self):
+    super(TokenReuse, self).setUp()
+    CONF(config_files=[test.etcdir('keystone.conf'),
+                       test.testsdir('test_overrides.conf')])
+    token.REUSABLE.clear()
+    self.token_api = token.Manager()
+
+  def test_reuse_key_depends_on_credentials(self):
+    key = token.reuse_key('foo', 'bar', 'foo2')
+    self.assertEquals(key, token.reuse_key(u'foo', u'bar', u'foo2'))
+    self.assertNotEquals(key, hashlib.sha256('foo\0bar\0foo2').hexdigest())
+    self.assertNotEquals(key, token.reuse_key('foo', 'bar', 'WRONG'))
+    self.assertNotEquals(key, token.reuse_key('foo', None, 'foo2'))
+
+  def test_reusable_while_token_is_valid(self):
+    token_id = uuid.uuid4().hex
+    self.token_api.create_token({}, token_id, {'id': token_id})
+    key = token.reuse_key('foo', 'bar', 'foo2')
+    response = {'access': {'token': {'id': token_id}}}
+    self.token_api.set_reusable({}, key, token_id, response)
+    self.assertDictEquals(self.token_api.get_reusable({}, key), response)
+
+    self.token_api.delete_token({}, token_id)
+    self.assert_(self.token_api.get_reusable({}, key) is None)
+
+  def test_reusable_is_bounded(self):
+    self.opt_in_group('token', reuse_cache_size=2)
+    keys = []
+    for i in range(3):
+      token_id = uuid.uuid4().hex
+      self.token_api.create_token({}, token_id, {'id': token_id})
+      keys.append(token.reuse_key('foo', str(i), 'foo2'))
+      self.token_api.set_reusable({}, keys[-1], token_id, {'id': token_id})
+
+    self.assert_(self.token_api.get_reusable({}, keys[0]) is None)
+    self.assert_(self.token_api.get_reusable({}, keys[2]) is not None)
+
+
+class TokenReuseControllers(test.TestCase):
+  def setUp(self):
+    super(TokenReuseControllers, self).setUp()
+    CONF(config_files=[test.etcdir('keystone.conf'),
+                       test.testsdir('test_overrides.conf')])
+    self.opt_in_group('token', reuse=True)
+    token.REUSABLE.clear()
+    token.IDENTITY_CACHE.clear()
+    self.identity_api = identity_kvs.Identity(db={})
+    self.load_fixtures(default_fixtures)
+    self.token_driver = token_kvs.Token(db={})
+    self.ec2_driver = ec2_kvs.Ec2(db={})
+    self.calls = []
+
+  def _use_drivers(self, controller):
+    controller.identity_api.driver = self.identity_api
+    controller.token_api.driver = self.token_driver
+    controller.token_api.identity_api.driver = self.identity_api
+    if hasattr(controller, 'ec2_api'):
+      controller.ec2_api.driver = self.ec2_driver
+    self._count(controller.token_api, 'create_token')
+    self._count(controller.catalog_api, 'get_catalog')
+    return controller
+
+  def _count(self, api, name):
+    f = getattr(api, name)
+    def _wrapper(*args, **kw):
+      self.calls.append(name)
+      return f(*args, **kw)
+    setattr(api, name, _wrapper)
+
+  def test_authenticate_reuses_the_response(self):
+    controller = self._use_drivers(service.TokenController())
+    auth = {'passwordCredentials': {'username': self.user_foo['name'],
+                                    'password': self.user_foo['password']},
+            'tenantId': self.tenant_bar['id']}
+    first = controller.authenticate({}, auth)
+    self.assertEquals(self.calls, ['get_catalog', 'create_token'])
+
+    self.assertDictEquals(controller.authenticate({}, auth), first)
+    self.assertEquals(self.calls, ['get_catalog', 'create_token'])
+
+    auth['passwordCredentials']['password'] = 'WRONG'
+    self.assertRaises(AssertionError, controller.authenticate, {}, auth)
+
+  def test_authenticate_ec2_reuses_the_response(self):
+    controller = self._use_drivers(ec2.Ec2Controller())
+    cred_ref = controller.create_credential(
+        {}, self.user_foo['id'], self.tenant_bar['id'])['credential']
+    credentials = {'access': cred_ref['access'],
+                   'host': 'localhost',
+                   'verb': 'GET',
+                   'path': '/',
+                   'params': {'SignatureVersion': '2', 'Action': 'Test'}}
+    signer = utils.Ec2Signer(cred_ref['secret'])
+    credentials['signature'] = signer.generate(credentials)
+
+    first = controller.authenticate_ec2({}, credentials=credentials)
+    self.assertEquals(self.calls, ['get_catalog', 'create_token'])
+
+    self.assertDictEquals(
+        controller.authenticate_ec2({}, credentials=credentials), first)
+    self.assertEquals(self.calls, ['get_catalog', 'create_token'])
+
+
+class CompactToken(test.TestCase):
+  def setUp(self):
+    super(CompactToken, self).setUp()
+    CONF(config_files=[test.etcdir('keystone.conf'),
+                       test.testsdir('test_overrides.conf')])
+    self.identity_api = identity_kvs.Identity()
+    self.load_fixtures(default_fixtures)
+    token.IDENTITY_CACHE.clear()
+    self.token_api = token.Manager()
+
+  def _create_token(self):
+    token_id = uuid.uuid4().hex
+    self.token_api.create_token({}, token_id,
+                                {'id': token_id,
+                                 'user': self.user_foo,
+                                 'tenant': self.tenant_bar,
+                                 'metadata': {'roles': ['keystone_admin']}})
+    return token_id
+
+  def test_backend_keeps_compact_record(self):
+    token_id = self._create_token()
+    record = self.token_api.driver.get_token(token_id)
+    self.assertEquals(record['user_id'], 'foo')
+    self.assertEquals(record['tenant_id'], 'bar')
+    self.assertEquals(record['roles'], ['keystone_admin'])
+    self.assert_('user' not in record)
+    self.assert_('metadata' not in record)
+
+  def test_token_is_rehydrated(self):
+    token_ref = self.token_api.get_token({}, self._create_token())
+    self.assertEquals(token_ref['user']['id'], 'foo')
+    self.assertEquals(token_ref['user']['name'], 'FOO')
+    self.assert_('password' not in token_ref['user'])
+    self.assertDictEquals(token_ref['tenant'], self.tenant_bar)
+    self.assertEquals(token_ref['metadata'], {'roles': ['keystone_admin']})
+
+  def test_token_of_missing_user_is_invalid(self):
+    token_id = self._create_token()
+    token.IDENTITY_CACHE.clear()
+    self.identity_api.delete_user('foo')
+    self.assert_(self.token_api.get_token({}, token_id) is None)
+
+
+class SignedToken(test.TestCase):
+  def setUp(self):
+    super(SignedToken, self).setUp()
+    CONF(config_files=[test.etcdir('keystone.conf'),
+                       test.testsdir('test_overrides.conf')])
+    self.opt_in_group('token', format='signed', signing_key='secret')
+    self.token_api = token.Manager()
+    self.user = {'id': 'foo', 'name': 'FOO'}
+    self.tenant = {'id': 'bar', 'name': 'BAR'}
+    self.roles = [{'id': 'keystone_admin', 'name': 'Keystone Admin'}]
+
+  def _new_token_id(self, expires=None):
+    if expires is None:
+      expires = token.default_expire_time()
+    return token.new_token_id(self.user, self.tenant, self.roles, expires)
+
+  def test_signed_token_carries_payload(self):
+    token_id = self._new_token_id()
+    self.assert_(token.is_signed(token_id))
+    payload = token.verify_signed(token_id)
+    self.assertEquals(payload['user'], self.user)
+    self.assertEquals(payload['tenant'], self.tenant)
+    self.assertEquals(payload['roles'], self.roles)
+    self.assertNotEquals(token_id, self._new_token_id())
+
+  def test_tampered_token_is_rejected(self):
+    token_id = self._new_token_id()
+    body, signature = token_id.split('.')
+    self.assert_(token.verify_signed(body + '.' + signature[::-1]) is None)
+    self.assert_(token.verify_signed(body[1:] + '.' + signature) is None)
+
+    self.opt_in_group('token', signing_key='other')
+    self.assert_(token.verify_signed(token_id) is None)
+
+  def test_expired_token_is_rejected(self):
+    expires = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+    self.assert_(token.verify_signed(self._new_token_id(expires)) is None)
+
+  def test_signed_token_storage(self):
+    token_id = self._new_token_id()
+    self.token_api.create_token({}, token_id, {'id': token_id})
+    self.assertEquals(self.token_api.get_token({}, token_id)['id'], token_id)
+    self.assert_(len(token.unique_id(token_id)) <= 64)
+
+    self.token_api.delete_token({}, token_id)
+    self.assert_(self.token_api.get_token({}, token_id) is None)
+
+  def test_signed_token_id_from_sql(self):
+    # the sql backend only has the hash of the id
+    CONF(config_files=[test.etcdir('keystone.conf'),
+                       test.testsdir('test_overrides.conf'),
+                       test.testsdir('backend_sql.conf')])
+    sql_util.setup_test_database()
+    self.token_api.driver = token_sql.Token()
+    token_id = self._new_token_id()
+    self.token_api.create_token({}, token_id, {'id': token_id})
+    self.assertEquals(self.token_api.get_token({}, token_id)['id'], token_id)
+
+  def test_dotted_id_without_signing_key(self):
+    self.opt_in_group('token', signing_key=None)
+    self.assert_(not token.is_signed('a.b'))
+    self.assert_(token.verify_signed('a.b') is None)
+
+    admin = self.client(self.loadapp('keystone', name='admin'),
+                        token=CONF.admin_token)
+    self.assertEquals(admin.get('/v2.0/tokens/a.b').status_int, 404)
+
+  def test_middleware_verifies_locally(self):
+    protocol = auth_token.AuthProtocol(None, {'service_port': '0',
+                                              'auth_port': '0',
+                                              'signing_key': 'secret'})
+    token_id = self._new_token_id()
+    self.assert_(protocol._validate_claims(token_id))
+    claims = protocol._expound_claims(token_id)
+    self.assertEquals(claims, {'user': 'FOO',
+                               'tenant': 'bar',
+                               'tenantName': 'BAR',
+                               'roles': ['Keystone Admin']})
+
+    body, signature = token_id.split('.')
+    self.assert_(not protocol._validate_claims(body + '.' + 'a' * 64))
@@ -0,0 +1,107 @@
+import webob
+import webob.dec
+
+from keystone import config
+from keystone import test
+from keystone.common import kvs
+from keystone.common import wsgi
+
+
+CONF = config.CONF
+
+
+class Paginate(test.TestCase):
+  def setUp(self):
+    super(Paginate, self).setUp()
+    CONF(config_files=[test.etcdir('keystone.conf'),
+                       test.testsdir('test_overrides.conf')])
+    self.db = kvs.DictKvs()
+    for i in range(10):
+      self.db.sadd('ids', 'id-%d' % i)
+    self.app = wsgi.Application()
+
+  def _list(self, marker, limit, reverse):
+    return [{'id': x}
+            for x in self.db.srange('ids', marker, limit, reverse)]
+
+  def _get(self, **query):
+    context = {'query_string': query, 'path': 'http://localhost/things'}
+    rv = self.app._paginate(context, 'things', self._list)
+    return ([x['id'] for x in rv['things']],
+            dict((x['rel'], x['href']) for x in rv['things_links']))
+
+  def test_first_page(self):
+    ids, links = self._get(limit='3')
+    self.assertEquals(ids, ['id-0', 'id-1', 'id-2'])
+    self.assertEquals(links,
+        {'next': 'http://localhost/things?limit=3&marker=id-2'})
+
+  def test_middle_page(self):
+    ids, links = self._get(limit='3', marker='id-4')
+    self.assertEquals(ids, ['id-5', 'id-6', 'id-7'])
+    self.assertEquals(links,
+        {'next': 'http://localhost/things?limit=3&marker=id-7',
+         'previous': 'http://localhost/things?limit=3&marker=id-1'})
+
+  def test_second_page_links_back_to_the_first(self):
+    ids, links = self._get(limit='3', marker='id-2')
+    self.assertEquals(ids, ['id-3', 'id-4', 'id-5'])
+    self.assertEquals(links['previous'], 'http://localhost/things?limit=3')
+
+  def test_last_page(self):
+    ids, links = self._get(limit='3', marker='id-6')
+    self.assertEquals(ids, ['id-7', 'id-8', 'id-9'])
+    self.assert_('next' not in links)
+
+  def test_limit_is_capped(self):
+    self.opt_in_group(None, list_limit=4)
+    ids, links = self._get(limit='100')
+    self.assertEquals(len(ids), 4)
+    ids, links = self._get()
+    self.assertEquals(len(ids), 4)
+
+  def test_bad_limit(self):
+    self.assertRaises(wsgi.webob.exc.HTTPBadRequest, self._get, limit='x')
+    self.assertRaises(wsgi.webob.exc.HTTPBadRequest, self._get, limit='0')
+
+
+class ExtensionRouter(test.TestCase):
+  """Requests the extension does not route reach the application as sent."""
+
+  def setUp(self):
+    super(ExtensionRouter, self).setUp()
+
+    @webob.dec.wsgify
+    def application(req):
+      return '%s|%s' % (req.script_name, req.path_info)
+
+    @webob.dec.wsgify
+    def extension(req):
+      return 'extension %s' % req.environ['wsgiorg.routing_args'][1]['id']
+
+    class Extension(wsgi.ExtensionRouter):
+      def add_routes(self, mapper):
+        mapper.connect('/OS-EXT/{id}', controller=extension)
+
+    self.router = Extension(application)
+
+  def _get(self, path, script_name=''):
+    req = webob.Request.blank(path, environ={'SCRIPT_NAME': script_name})
+    return req.get_response(self.router).body
+
+  def test_root(self):
+    self.assertEquals(self._get('/'), '|/')
+
+  def test_version(self):
+    self.assertEquals(self._get('/v2.0'), '|/v2.0')
+    self.assertEquals(self._get('/v2.0/tokens'), '|/v2.0/tokens')
+
+  def test_mounted(self):
+    self.assertEquals(self._get('/tokens', script_name='/v2.0'),
+                      '/v2.0|/tokens')
+    self.assertEquals(self._get('/', script_name='/v2.0'), '/v2.0|/')
+
+  def test_extension_route(self):
+    self.assertEquals(self._get('/OS-EXT/foo'), 'extension foo')
+    self.assertEquals(self._get('/OS-EXT/foo', script_name='/v2.0'),
+                      'extension foo')
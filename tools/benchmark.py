@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""Micro benchmarks for keystone internals.
+
+Usage: tools/benchmark.py COMMAND [count]
+
+Commands:
+
+    token_memory    bytes per token kept by the kvs backend, for full token
+                    dicts versus compact token records
+    group_commit    tokens per second created by concurrent green threads in
+                    the sql backend, with and without group commit
+    user_load       users per second created in the kvs backend, for a
+                    tenth of count users and for all of them
+    name_index      users per second created, updated and found by name in
+                    a persistent kvs backend, and the size of its log and of
+                    the store read back from it, for names holding copies of
+                    the users versus names pointing at their ids
+    json_columns    users per second listed and metadata per second read
+                    from the sql backend, and user rows per second loaded
+                    for their ids and names only, for JSON columns decoded
+                    as rows are loaded versus when first used, with each
+                    importable JSON codec
+    model_json      roles per second serialized to JSON as responses do,
+                    for models mapping their columns on every call versus
+                    once when declared
+    sql_offload     kvs identity calls per second, and the longest any of
+                    them waited, made by one green thread while count green
+                    threads run queries that block for 50ms in the sql
+                    backend, with the driver's calls made in the calling
+                    green thread versus in a thread pool
+
+"""
+
+import datetime
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+import eventlet
+import sqlalchemy.orm
+
+# If ../keystone/__init__.py exists, add ../ to Python search path, so that
+# it will override what happens to be installed in /usr/(local/)lib/python...
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir,
+                               'keystone',
+                               '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+
+from keystone import config
+from keystone import token
+from keystone.common import kvs
+from keystone.common import sql
+from keystone.common import utils
+from keystone.common.sql import migration
+from keystone.identity.backends import kvs as identity_kvs
+from keystone.identity.backends import sql as identity_sql
+from keystone.token.backends import kvs as token_kvs
+from keystone.token.backends import sql as token_sql
+
+
+CONF = config.CONF
+
+
+def deep_size(objects):
+    """Bytes used by `objects` and everything they reference, counted once."""
+    seen = set()
+    pending = list(objects)
+    size = 0
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            pending.extend(obj.iterkeys())
+            pending.extend(obj.itervalues())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            pending.extend(obj)
+        elif hasattr(obj, '__slots__'):
+            pending.extend(getattr(obj, x) for x in obj.__slots__
+                           if hasattr(obj, x))
+    return size
+
+
+def _token_data(roles):
+    """Token data as the controllers create it, with fresh identity refs."""
+    token_id = uuid.uuid4().hex
+    user_id = uuid.uuid4().hex
+    tenant_id = uuid.uuid4().hex
+    return {'id': token_id,
+            'expires': datetime.datetime.utcnow(),
+            'user': {'id': user_id,
+                     'name': 'user-%s' % user_id[:8],
+                     'password': uuid.uuid4().hex * 2,
+                     'email': 'user-%s@example.com' % user_id[:8],
+                     'enabled': True,
+                     'tenants': [tenant_id] + [uuid.uuid4().hex
+                                               for x in range(2)]},
+            'tenant': {'id': tenant_id,
+                       'name': 'tenant-%s' % tenant_id[:8],
+                       'enabled': True,
+                       'description': 'A tenant'},
+            'metadata': {'roles': [''.join(x) for x in roles]}}
+
+
+def token_memory(count=10000):
+    roles = ['Member', 'admin', 'netadmin']
+    full = [_token_data(roles) for x in xrange(count)]
+    compact = [token_kvs.TokenRecord(token.compact(x)) for x in full]
+
+    # the interned role ids are shared by every token, don't charge for them
+    shared = sum(sys.getsizeof(x) for x in token_kvs.ROLE_IDS)
+    full_size = deep_size(full) - sys.getsizeof(full)
+    compact_size = deep_size(compact) - sys.getsizeof(compact) - shared
+    print 'tokens:          %d' % count
+    print 'full dict:       %d bytes/token' % (full_size / count)
+    print 'compact record:  %d bytes/token' % (compact_size / count)
+
+
+def _load_config(**overrides):
+    CONF(config_files=[os.path.join(possible_topdir, 'etc', 'keystone.conf')])
+    for group, options in overrides.iteritems():
+        for name, value in options.iteritems():
+            CONF.set_override(name, value, group=group)
+
+
+def _create_tokens(token_api, count, concurrency):
+    pool = eventlet.GreenPool(concurrency)
+    start = time.time()
+    for i in xrange(count):
+        token_id = uuid.uuid4().hex
+        pool.spawn_n(token_api.create_token, token_id,
+                     {'id': token_id, 'user_id': 'foo', 'roles': []})
+    pool.waitall()
+    return count / (time.time() - start)
+
+
+def group_commit(count=2000, concurrency=100):
+    db_path = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    _load_config(sql={'connection': 'sqlite:///%s' % db_path})
+    migration.db_sync()
+
+    print 'tokens:          %d from %d green threads' % (count, concurrency)
+    for group_commit in (False, True):
+        CONF.set_override('group_commit', group_commit, group='token')
+        token_api = token_sql.Token()
+        rate = _create_tokens(token_api, count, concurrency)
+        print 'group commit %-5s %d tokens/s' % (group_commit, rate)
+    os.unlink(db_path)
+
+
+def _load_users(count):
+    identity_api = identity_kvs.Identity(db={})
+    start = time.time()
+    for i in xrange(count):
+        user_id = uuid.uuid4().hex
+        identity_api.create_user(user_id, {'id': user_id,
+                                           'name': 'user-%s' % user_id})
+    return count / (time.time() - start)
+
+
+def user_load(count=100000):
+    # the rate stays the same as the number of users grows if loading is
+    # linear
+    for n in (count / 10, count):
+        print '%-16s %d users/s' % ('%d users:' % n, _load_users(n))
+
+
+class _NameCopies(identity_kvs.Identity):
+    """The kvs identity backend as it was when names held whole users."""
+
+    def get_user_by_name(self, user_name):
+        return self.db.get('user_name-%s' % user_name)
+
+    def create_user(self, user_id, user):
+        self.db.set('user-%s' % user_id, user)
+        self.db.set('user_name-%s' % user['name'], user)
+        self.db.sadd('user_list', user_id)
+        return user
+
+    def update_user(self, user_id, user):
+        old_user = self.db.get('user-%s' % user_id)
+        self.db.delete('user_name-%s' % old_user['name'])
+        self.db.set('user-%s' % user_id, user)
+        self.db.set('user_name-%s' % user['name'], user)
+        return user
+
+
+def _timed(f, count, items):
+    start = time.time()
+    for item in items:
+        f(*item)
+    return count / (time.time() - start)
+
+
+def _user(i, **kw):
+    user_id = '%032x' % i
+    user = {'id': user_id,
+            'name': 'user-%s' % user_id,
+            'password': user_id * 2,
+            'email': 'user-%s@example.com' % user_id[-8:],
+            'enabled': True}
+    user.update(kw)
+    return user
+
+
+def _tree_size(obj):
+    """Bytes used by `obj` and what it contains, shared objects included."""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.iteritems():
+            size += _tree_size(k) + _tree_size(v)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for x in obj:
+            size += _tree_size(x)
+    return size
+
+
+def name_index(count=1000000):
+    print 'users:           %d' % count
+    for layout, identity_class in (('copies', _NameCopies),
+                                   ('pointers', identity_kvs.Identity)):
+        tmp_dir = tempfile.mkdtemp()
+        path = os.path.join(tmp_dir, 'kvs.db')
+        # fsync and snapshot rarely, the disk is not what is measured
+        db = kvs.PersistentKvs(path, sync_batch=100000, sync_interval=60,
+                               snapshot_threshold=count * 10)
+        identity_api = identity_class(db=db)
+        created = _timed(identity_api.create_user, count,
+                         ((x['id'], x)
+                          for x in (_user(i) for i in xrange(count))))
+        updated = _timed(identity_api.update_user, count,
+                         ((_user(i)['id'], _user(i, enabled=False))
+                          for i in xrange(count)))
+        found = _timed(identity_api.get_user_by_name, count,
+                       ((_user(i)['name'],) for i in xrange(count)))
+        db.close()
+        del identity_api, db
+        log_size = os.path.getsize(os.path.join(tmp_dir, 'kvs.db.log'))
+
+        # what a restarted process holds, nothing is shared between records
+        # read back from the log
+        db = kvs.PersistentKvs(path)
+        store_size = _tree_size(db)
+        db.close()
+        del db
+        shutil.rmtree(tmp_dir)
+
+        print ('names %-9s %d created/s  %d updated/s  %d found/s'
+               % (layout, created, updated, found))
+        print ('names %-9s log %d bytes/user  store %d bytes/user'
+               % (layout, log_size / count, store_size / count))
+
+
+class _EagerJsonBlob(sql.JsonBlob):
+    """JsonBlob as it was, decoding every value as rows are loaded."""
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return sql.get_codec().loads(value)
+
+
+def _json_columns(identity_class, eager):
+    for column in (identity_class.User.__table__.c.extra,
+                   identity_class.Metadata.__table__.c.data):
+        column.type = eager and _EagerJsonBlob() or sql.JsonBlob()
+
+
+def _list_all(list_f, page_size=1000):
+    marker = None
+    while True:
+        page = list_f(marker=marker, limit=page_size)
+        if not page:
+            return
+        marker = page[-1]['id']
+
+
+def json_columns(count=10000):
+    db_path = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    _load_config(sql={'connection': 'sqlite:///%s' % db_path})
+    migration.db_sync()
+    identity_api = identity_sql.Identity()
+    tenant_id = uuid.uuid4().hex
+    records = [('tenant', {'id': tenant_id, 'name': 'tenant'})]
+    for i in xrange(count):
+        user = _user(i, tenants=[tenant_id])
+        records.append(('user', user))
+        records.append(('metadata', {'user_id': user['id'],
+                                     'tenant_id': tenant_id,
+                                     'data': {'roles': ['Member', 'admin'],
+                                              'is_admin': False}}))
+    identity_api.import_records(records)
+    del records
+
+    codecs = []
+    for name in ('json', 'simplejson', 'ujson'):
+        try:
+            __import__(name)
+        except ImportError:
+            continue
+        codecs.append(name)
+
+    print 'users:           %d' % count
+    for codec in codecs:
+        sql.set_codec(codec)
+        for decoding, eager in (('eager', True), ('lazy', False)):
+            _json_columns(identity_sql, eager)
+            listed = _timed(_list_all, count, [(identity_api.list_users,)])
+
+            def _ids_and_names():
+                session = identity_api.get_session()
+                for user_ref in session.query(identity_sql.User):
+                    user_ref.id, user_ref.name
+            loaded = _timed(_ids_and_names, count, [()])
+
+            read = _timed(identity_api.get_metadata, count,
+                          ((_user(i)['id'], tenant_id)
+                           for i in xrange(count)))
+            print ('%-10s %-5s %d users listed/s  %d rows loaded/s  '
+                   '%d metadata read/s'
+                   % (codec, decoding, listed, loaded, read))
+    _json_columns(identity_sql, False)
+    sql.set_codec('json')
+    os.unlink(db_path)
+
+
+class _MapperEncoder(json.JSONEncoder):
+    """SmarterEncoder as it was, looking up a model's columns per object."""
+
+    def default(self, obj):
+        if not isinstance(obj, dict) and hasattr(obj, 'iteritems'):
+            columns = sqlalchemy.orm.object_mapper(obj).columns
+            return dict([(x.name, getattr(obj, x.name)) for x in columns])
+        return super(_MapperEncoder, self).default(obj)
+
+
+def model_json(count=100000):
+    roles = [identity_sql.Role(id=uuid.uuid4().hex, name='role-%d' % i)
+             for i in xrange(count)]
+    print 'roles:           %d' % count
+    for columns, encoder in (('per call', _MapperEncoder),
+                             ('declared', utils.SmarterEncoder)):
+        rate = _timed(lambda: json.dumps(roles, cls=encoder), count, [()])
+        print 'columns %-9s %d roles/s' % (columns, rate)
+
+
+def _sleep_ms(ms):
+    # blocks the thread it runs in, like a query in a C driver would
+    eventlet.patcher.original('time').sleep(ms / 1000.0)
+    return ms
+
+
+def sql_offload(count=20, ms=50):
+    db_path = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    _load_config(sql={'connection': 'sqlite:///%s' % db_path})
+    migration.db_sync()
+    kvs_api = identity_kvs.Identity(db={})
+    kvs_api.create_user('foo', {'id': 'foo', 'name': 'FOO'})
+
+    print 'queries:         %d of %dms from %d green threads' % (count, ms,
+                                                                 count)
+    for threads in (0, 10):
+        CONF.set_override('thread_pool_size', threads, group='sql')
+        sql.ENGINES.clear()
+        sql.MAKERS.clear()
+        sql.THREAD_POOL = None
+        identity_api = identity_sql.Identity()
+        sqlalchemy.event.listen(
+                identity_api.get_engine(), 'connect',
+                lambda conn, record: conn.create_function('sleep_ms', 1,
+                                                          _sleep_ms))
+
+        def _query():
+            session = identity_api.get_session()
+            session.execute('SELECT sleep_ms(:ms)', {'ms': ms}).scalar()
+
+        done = []
+        waits = []
+
+        def _kvs_calls():
+            while not done:
+                start = time.time()
+                eventlet.sleep(0)
+                kvs_api.get_user('foo')
+                waits.append(time.time() - start)
+
+        caller = eventlet.spawn(_kvs_calls)
+        pool = eventlet.GreenPool(count)
+        start = time.time()
+        for i in xrange(count):
+            pool.spawn_n(_query)
+        pool.waitall()
+        elapsed = time.time() - start
+        done.append(True)
+        caller.wait()
+
+        print ('threads %-3d sql %.2fs  kvs %d calls/s, longest wait %dms'
+               % (threads, elapsed, len(waits) / elapsed,
+                  max(waits) * 1000))
+    os.unlink(db_path)
+
+
+COMMANDS = {'token_memory': token_memory,
+            'group_commit': group_commit,
+            'user_load': user_load,
+            'name_index': name_index,
+            'json_columns': json_columns,
+            'model_json': model_json,
+            'sql_offload': sql_offload}
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] not in COMMANDS:
+        print __doc__
+        return 1
+    args = [int(x) for x in argv[2:]]
+    COMMANDS[argv[1]](*args)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))